@@ -16,6 +16,7 @@ import matplotlib.gridspec as gridspec
 # Import the updated dataclass
 sys.path.insert(0, str(Path(__file__).parent.parent / "script"))
 from ..script.dataclass import Experiment
+from ..script.experiment_io import load_experiment as load_experiment_file
 
 
 def prettify_system_name(system_name: str) -> str:
@@ -181,10 +182,7 @@ def load_experiment(experiment_id: str) -> Experiment:
     if not json_path.exists():
         raise FileNotFoundError(f"Experiment file not found: {json_path}")
     
-    with open(json_path, 'r') as f:
-        data = json.load(f)
-    
-    return Experiment(**data)
+    return load_experiment_file(str(json_path))
 
 
 def plot_trajectories(
@@ -0,0 +1,265 @@
+"""
+Construction and memoization of the acceleration function of a solution.
+
+The acceleration function is built the same way as xlsindy.dynamics_modeling.generate_acceleration_function,
+but in two steps so that the expensive symbolic part (expansion of the catalog and collection of the linear system)
+can be memoized, and persisted on disk, independently of the lambdify backend.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import numpy as np
+
+from collections import OrderedDict
+from typing import Callable, Tuple
+
+import xlsindy
+
+import sympy as sp
+
+from data_generation.script.experiment_matrix import expanded_catalog
+
+logger = logging.getLogger(__name__)
+
+def acceleration_linear_system(
+    solution_vector: np.ndarray,
+    solution_catalog: xlsindy.catalog.CatalogRepartition,
+    symbols_matrix: np.ndarray,
+) -> Tuple[np.ndarray|None, np.ndarray|None]:
+    """
+    Build the symbolic linear system A(q,q_d) q_dd = b(q,q_d,f) of a solution.
+
+    Args:
+        solution_vector (np.ndarray): the solution vector of the system.
+        solution_catalog (xlsindy.catalog.CatalogRepartition): the catalog of the solution.
+        symbols_matrix (np.ndarray): the symbolic matrix (forces, positions, velocities, accelerations).
+
+    Returns:
+        np.ndarray: the system matrix A (num_coordinates, num_coordinates) of sympy expressions, None if the model is not valid.
+        np.ndarray: the force vector b (num_coordinates, 1) of sympy expressions, None if the model is not valid.
+    """
+    num_coordinates = symbols_matrix.shape[1]
+
+    dynamic_equations = np.reshape(solution_vector, (-1, 1)).T @ expanded_catalog(solution_catalog)
+    dynamic_equations = dynamic_equations.flatten()
+
+    for i in range(num_coordinates):
+        if str(symbols_matrix[3, i]) not in str(dynamic_equations[i]):
+            return None, None
+
+    system_matrix, force_vector = (
+        np.empty((num_coordinates, num_coordinates), dtype=object),
+        np.empty((num_coordinates, 1), dtype=object),
+    )
+
+    for i in range(num_coordinates):
+        equation = dynamic_equations[i]
+        for j in range(num_coordinates):
+            equation = equation.collect(symbols_matrix[3, j])
+            term = equation.coeff(symbols_matrix[3, j])
+            system_matrix[i, j] = -term
+            equation -= term * symbols_matrix[3, j]
+
+        force_vector[i, 0] = equation
+
+    return system_matrix, force_vector
+
+def lambdify_acceleration_function(
+    system_matrix: np.ndarray,
+    force_vector: np.ndarray,
+    symbols_matrix: np.ndarray,
+    lambdify_module: str = "numpy",
+) -> Callable[[np.ndarray], np.ndarray]:
+    """
+    Lambdify the linear system into an acceleration function, same function as xlsindy generate_acceleration_function.
+
+    Returns:
+        function: takes as input a numerical symbol matrix (4, num_coordinates) and return the accelerations (num_coordinates, 1).
+    """
+    system_func = sp.lambdify([symbols_matrix], system_matrix, lambdify_module)
+    force_func = sp.lambdify([symbols_matrix], force_vector, lambdify_module)
+
+    if lambdify_module == "jax":
+
+        import jax.numpy as jnp
+
+        def acceleration_solver(input_values):
+            system_eval = system_func(input_values)
+            force_eval = force_func(input_values)
+            return jnp.linalg.solve(system_eval, force_eval)
+
+    else:
+
+        def acceleration_solver(input_values):
+            system_eval = system_func(input_values)
+            force_eval = force_func(input_values)
+            return np.linalg.solve(system_eval, force_eval)
+
+    return acceleration_solver
+
+def lambdify_batched_acceleration_function(
+    system_matrix: np.ndarray,
+    force_vector: np.ndarray,
+    symbols_matrix: np.ndarray,
+) -> Callable[[np.ndarray, np.ndarray, np.ndarray], np.ndarray]:
+    """
+    Batched numpy counterpart of lambdify_acceleration_function.
+
+    Every entry of the linear system is lambdified on its own so that it can be evaluated on arrays of states
+    (constant entries are broadcasted).
+
+    Returns:
+        function: acceleration(forces, qpos, qvel) -> qacc, every array of shape (batch, num_coordinates).
+    """
+    num_coordinates = symbols_matrix.shape[1]
+
+    entries_func = sp.lambdify(
+        [symbols_matrix], list(system_matrix.flatten()) + list(force_vector.flatten()), "numpy"
+    )
+
+    def acceleration(forces: np.ndarray, qpos: np.ndarray, qvel: np.ndarray) -> np.ndarray:
+        batch = qpos.shape[0]
+        input_matrix = np.zeros((4, num_coordinates, batch))
+        input_matrix[0] = forces.T
+        input_matrix[1] = qpos.T
+        input_matrix[2] = qvel.T
+
+        entries = np.stack([np.broadcast_to(entry, (batch,)) for entry in entries_func(input_matrix)], axis=1)
+
+        system_eval = entries[:, :num_coordinates**2].reshape(batch, num_coordinates, num_coordinates)
+        force_eval = entries[:, num_coordinates**2:].reshape(batch, num_coordinates, 1)
+
+        return np.linalg.solve(system_eval, force_eval)[:, :, 0]
+
+    return acceleration
+
+class AccelerationFunctionCache:
+    """
+    LRU memo of acceleration functions keyed on (catalog labels, solution vector hash, backend).
+
+    The symbolic linear system is memoized as well (keyed without the backend) so that asking the same solution
+    with another backend skip the expansion of the catalog. If `cache_dir` is set, the linear system is also pickled
+    on disk and shared between processes.
+
+    Args:
+        max_size (int): number of acceleration functions (and of linear systems) kept in memory (default 8).
+        cache_dir (str): folder of the on disk cache (default None, in memory only).
+    """
+
+    def __init__(self, max_size: int = 8, cache_dir: str|None = None):
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self._systems = OrderedDict()
+        self._functions = OrderedDict()
+
+    @staticmethod
+    def system_key(
+        solution_vector: np.ndarray,
+        solution_catalog: xlsindy.catalog.CatalogRepartition,
+        symbols_matrix: np.ndarray,
+    ) -> str:
+        """Hash of the catalog labels, the symbols and the solution vector."""
+        key = hashlib.md5()
+        key.update("\n".join(solution_catalog.label()).encode())
+        key.update(str(symbols_matrix).encode())
+        key.update(np.ascontiguousarray(solution_vector, dtype=np.float64).tobytes())
+        return key.hexdigest()
+
+    def _remember(self, store: OrderedDict, key, value):
+        store[key] = value
+        store.move_to_end(key)
+        while len(store) > self.max_size:
+            store.popitem(last=False)
+
+    def linear_system(
+        self,
+        solution_vector: np.ndarray,
+        solution_catalog: xlsindy.catalog.CatalogRepartition,
+        symbols_matrix: np.ndarray,
+    ) -> Tuple[np.ndarray|None, np.ndarray|None]:
+        """Memoized acceleration_linear_system."""
+        key = self.system_key(solution_vector, solution_catalog, symbols_matrix)
+
+        if key in self._systems:
+            self._systems.move_to_end(key)
+            return self._systems[key]
+
+        system = None
+        file_path = os.path.join(self.cache_dir, f"{key}.pkl") if self.cache_dir is not None else None
+
+        if file_path is not None and os.path.exists(file_path):
+            try:
+                with open(file_path, "rb") as f:
+                    system = pickle.load(f)
+                logger.info(f"Acceleration linear system loaded from {file_path}")
+            except Exception as e:
+                logger.warning(f"Failed to load the acceleration cache {file_path}: {e}")
+
+        if system is None:
+            system = acceleration_linear_system(solution_vector, solution_catalog, symbols_matrix)
+
+            if file_path is not None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                # write then rename, another process may read the same entry
+                temporary_path = f"{file_path}.{os.getpid()}.tmp"
+                with open(temporary_path, "wb") as f:
+                    pickle.dump(system, f)
+                os.replace(temporary_path, file_path)
+
+        self._remember(self._systems, key, system)
+        return system
+
+    def get(
+        self,
+        solution_vector: np.ndarray,
+        solution_catalog: xlsindy.catalog.CatalogRepartition,
+        symbols_matrix: np.ndarray,
+        backend: str = "numpy",
+    ) -> Tuple[Callable|None, bool]:
+        """
+        Memoized acceleration function of a solution.
+
+        Args:
+            backend (str): "numpy" or "jax" (function of a numerical symbol matrix, as xlsindy) or "batched" (see lambdify_batched_acceleration_function).
+
+        Returns:
+            function: the acceleration function, None if the model is not valid.
+            bool: Whether the acceleration function generation was successful.
+        """
+        key = (self.system_key(solution_vector, solution_catalog, symbols_matrix), backend)
+
+        if key in self._functions:
+            self._functions.move_to_end(key)
+            return self._functions[key]
+
+        system_matrix, force_vector = self.linear_system(solution_vector, solution_catalog, symbols_matrix)
+
+        if system_matrix is None:
+            result = (None, False)
+        elif backend == "batched":
+            result = (lambdify_batched_acceleration_function(system_matrix, force_vector, symbols_matrix), True)
+        else:
+            result = (lambdify_acceleration_function(system_matrix, force_vector, symbols_matrix, backend), True)
+
+        self._remember(self._functions, key, result)
+        return result
+
+acceleration_function_cache = AccelerationFunctionCache()
+"""the process wide cache used by the generators and align_data"""
+
+def configure_acceleration_cache(max_size: int|None = None, cache_dir: str|None = None):
+    """Set the size and the on disk folder of the process wide acceleration function cache."""
+    if max_size is not None:
+        acceleration_function_cache.max_size = max_size
+    acceleration_function_cache.cache_dir = cache_dir
+
+def cached_acceleration_function(
+    solution_vector: np.ndarray,
+    solution_catalog: xlsindy.catalog.CatalogRepartition,
+    symbols_matrix: np.ndarray,
+    time_symb: sp.Symbol,
+    lambdify_module: str = "numpy",
+) -> Tuple[Callable|None, bool]:
+    """Drop-in replacement of xlsindy.dynamics_modeling.generate_acceleration_function going through the process wide cache."""
+    return acceleration_function_cache.get(solution_vector, solution_catalog, symbols_matrix, lambdify_module)
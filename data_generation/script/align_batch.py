@@ -0,0 +1,188 @@
+"""
+Run every regression of an experiment in one process, the batched version of align_data.
+
+The experiment and its training data are loaded once, the catalog of each paradigm is built once and the acceleration
+functions are shared between the regressions (see alignment.py). The regressions are the grid
+paradigms x regression_types x noise_levels x data_ratios x optimization_functions, or the RegressionParameter listed
+in a jsonl file. Each regression is saved as soon as it is aligned, as align_data saves it : an interrupted batch keeps
+the regressions already done.
+
+exemple:
+python -m data_generation.script.align_batch --experiment-file results/{UID} \\
+    --paradigms mixed xlsindy sindy --regression-types explicit mixed --noise-levels 0.0 0.001 0.01
+"""
+
+from pydantic import BaseModel
+
+from typing import List
+import tyro
+
+import itertools
+import sys
+import time
+
+# Only light modules at the top, like align_data.
+
+from data_generation.script.dataclass import RegressionParameter
+from data_generation.script.experiment_io import load_experiment
+from data_generation.script.util import setup_logger
+
+logger = setup_logger(__name__)
+# the regression and validation logs
+setup_logger("data_generation.script.alignment")
+
+class Args(BaseModel):
+    experiment_file: str = "None"
+    """the experiment file (without extension)"""
+    paradigms: List[str] = ["mixed"]
+    """the paradigms of the grid (default mixed)"""
+    regression_types: List[str] = ["explicit"]
+    """the regression types of the grid (default explicit)"""
+    noise_levels: List[float] = [0.0]
+    """the noise levels of the grid (default 0.0)"""
+    data_ratios: List[float] = [2.0]
+    """the data ratios of the grid (default 2.0)"""
+    optimization_functions: List[str] = ["lasso_regression"]
+    """the optimization functions of the grid (default lasso_regression)"""
+    random_seed: List[int] = [0]
+    """the random seed of every regression of the grid (default 0)"""
+    parameters_file: str|None = None
+    """if set, a jsonl file with one RegressionParameter per line, run instead of the grid (default None)"""
+    skip_already_done: bool = True
+    """if true, skip the regressions already present in the result file"""
+    timeout: float|None = None
+    """if set, the time budget (in seconds) of each regression and its validation, the batch then goes on with the next one, once exhausted it is saved as timed out with its partial timing (default None, no budget)"""
+    validation_generator: str = "theorical"
+    """the generator of the validation rollout : "theorical" (RK45), "theorical-vectorized" (fixed step RK4) or "theorical-jax" (jitted fixed step RK4)"""
+    divergence_factor: float|None = None
+    """if set, the validation rollout stops once the state leaves this factor times the largest absolute position or velocity of the validation reference, or once the RK45 step collapses, the truncated rollout and the reason are saved (default None, full validation time)"""
+    acceleration_cache_dir: str|None = None
+    """if set, the folder where the symbolic acceleration systems are persisted and shared between runs (default in memory only)"""
+    component_cache_dir: str|None = None
+    """if set, the folder where the xlsindy_component outputs (catalog, symbols, ideal solution) are cached between runs (default in memory only)"""
+    jax_cache: bool = False
+    """if set, the jax programs are compiled once and loaded from a persistent compilation cache by the next runs, their input shapes are padded to be reused (default off)"""
+    jax_cache_dir: str|None = None
+    """if set, the folder of the persistent jax compilation cache used with --jax-cache (default ~/.cache/data_generation/jax)"""
+
+def regression_grid(args: Args) -> List[RegressionParameter]:
+    """The regressions of the batch, in the order of the file or of the grid (paradigm first, the catalog is built once per paradigm)."""
+    if args.parameters_file is not None:
+        with open(args.parameters_file) as f:
+            return [RegressionParameter.model_validate_json(line) for line in f if line.strip()]
+
+    return [
+        RegressionParameter(
+            paradigm=paradigm,
+            regression_type=regression_type,
+            noise_level=noise_level,
+            data_ratio=data_ratio,
+            optimization_function=optimization_function,
+            random_seed=args.random_seed,
+        )
+        for paradigm, regression_type, noise_level, data_ratio, optimization_function in itertools.product(
+            args.paradigms, args.regression_types, args.noise_levels, args.data_ratios, args.optimization_functions
+        )
+    ]
+
+if __name__ == "__main__":
+
+    args = tyro.cli(Args)
+
+    ## CLI validation
+    if args.experiment_file == "None":
+        raise ValueError(
+            "experiment_file should be provided, don't hesitate to invoke --help"
+        )
+
+    experiment_data = load_experiment(args.experiment_file + ".json", series="lazy")
+
+    regressions = regression_grid(args)
+
+    # the same regression given twice runs once
+    regressions = list({regression.UID: regression for regression in regressions}.values())
+
+    if args.skip_already_done:
+        done = set(experiment_data.data.validation_group.get_trajectory_name())
+        skipped = [regression for regression in regressions if regression.UID in done]
+        regressions = [regression for regression in regressions if regression.UID not in done]
+        if skipped:
+            print(f"{len(skipped)} regressions already aligned")
+
+    if not regressions:
+        print("already aligned")
+        exit()
+
+    from data_generation.script.acceleration_function import configure_acceleration_cache
+    from data_generation.script.compilation_cache import DEFAULT_CACHE_DIR,compilation_stats,configure_compilation_cache
+    from data_generation.script.alignment import RegressionTimeout,add_reference_solutions,align_regression,failed_trajectory
+    from data_generation.script.alignment import load_component,load_training_data,save_alignment,set_regression_trajectory
+    from data_generation.script.alignment import time_budget
+    from data_generation.script.experiment_matrix import experiment_matrix_cache
+
+    configure_acceleration_cache(cache_dir=args.acceleration_cache_dir)
+    configure_compilation_cache(cache_dir=(args.jax_cache_dir or DEFAULT_CACHE_DIR) if args.jax_cache else None)
+
+    sys.path.append(experiment_data.generation_params.experiment_folder)
+
+    trajectories = []
+    failed = 0
+    timed_out = 0
+
+    start_time = time.perf_counter()
+
+    try:
+        training_data = load_training_data(experiment_data)
+    except Exception as e:
+        print("Alignment failed with error :", e)
+        training_data = None
+
+    for index, regression_parameters in enumerate(regressions):
+
+        logger.info(f"Regression {index + 1}/{len(regressions)} : {regression_parameters.model_dump(exclude={'UID'})}")
+
+        reference_solutions = []
+
+        try:
+            if training_data is None:
+                raise ValueError(f"the training data of {experiment_data.data_path} could not be loaded")
+
+            component = load_component(experiment_data, regression_parameters, args.component_cache_dir)
+            reference_solutions = add_reference_solutions(experiment_data, regression_parameters.paradigm, component)
+
+            with time_budget(args.timeout):
+                trajectory = align_regression(
+                    experiment_data,
+                    regression_parameters,
+                    training_data,
+                    component,
+                    validation_generator=args.validation_generator,
+                    divergence_factor=args.divergence_factor,
+                )
+
+            if not trajectory.regression_result.valid:
+                print("Skipped model verification, retrieval failed")
+
+        except RegressionTimeout as timeout:
+
+            print("Alignment timed out :", timeout)
+
+            trajectory = failed_trajectory(regression_parameters, timeout=True, regression_result=timeout.regression_result)
+            timed_out += 1
+
+        except Exception as e:
+
+            print("Alignment failed with error :", e)
+
+            trajectory = failed_trajectory(regression_parameters, timeout=False)
+            failed += 1
+
+        set_regression_trajectory(experiment_data, trajectory)
+        trajectories.append(trajectory)
+
+        # saved as soon as it is aligned, an interrupted batch keeps the regressions already done
+        save_alignment(args.experiment_file + ".json", reference_solutions, [trajectory])
+
+    logger.info(f"{len(trajectories)} regressions aligned in {time.perf_counter() - start_time:.2f} s, {failed} failed, {timed_out} timed out")
+    logger.info(f"experiment matrices : {experiment_matrix_cache.misses} built, {experiment_matrix_cache.hits} reused")
+    logger.info(compilation_stats.report())
@@ -16,36 +16,24 @@ from pydantic import BaseModel
 from typing import List
 import tyro
 
-import xlsindy
-
 import time
 
-import numpy as np
-import json
-
 import hashlib
 
 import sys
 import os
-import importlib
-
-from jax import jit
-from jax import vmap
-
-import pickle
-
-import pandas as pd
 
-from tqdm import tqdm
-
-from xlsindy.logger import setup_logger
-
-from data_generation.script.generate_trajectory import generate_theoretical_trajectory
+# Only light modules at the top, the skip path and --help should not pay for xlsindy and jax.
+# The regression backends are imported once the experiment is known to need an alignment.
 
 from data_generation.script.dataclass import DataGenerationParams,Experiment,TrajectoryData,RegressionParameter
 from data_generation.script.dataclass import RegressionResult,Solution
+from data_generation.script.experiment_io import load_experiment
+from data_generation.script.util import setup_logger
 
 logger = setup_logger(__name__)
+# the regression and validation logs
+setup_logger("data_generation.script.alignment")
 
 class Args(BaseModel):
     experiment_file: str = "None"
@@ -55,7 +43,21 @@ class Args(BaseModel):
     skip_already_done: bool = True
     """if true, skip the experiment if already present in the result file"""
     timeout_signal: bool = False
-    """if true, skip everything and return the experiment with a timeout"""
+    """if true, skip everything and return the experiment with a timeout (for the drivers that kill align_data, see --timeout for an in-process budget)"""
+    timeout: float|None = None
+    """if set, the time budget (in seconds) of the regression and its validation, once exhausted it is saved as timed out with its partial timing (default None, no budget)"""
+    validation_generator: str = "theorical"
+    """the generator of the validation rollout : "theorical" (RK45), "theorical-vectorized" (fixed step RK4) or "theorical-jax" (jitted fixed step RK4)"""
+    divergence_factor: float|None = None
+    """if set, the validation rollout stops once the state leaves this factor times the largest absolute position or velocity of the validation reference, or once the RK45 step collapses, the truncated rollout and the reason are saved (default None, full validation time)"""
+    acceleration_cache_dir: str|None = None
+    """if set, the folder where the symbolic acceleration systems are persisted and shared between runs (default in memory only)"""
+    component_cache_dir: str|None = None
+    """if set, the folder where the xlsindy_component outputs (catalog, symbols, ideal solution) are cached between runs (default in memory only)"""
+    jax_cache: bool = False
+    """if set, the jax programs are compiled once and loaded from a persistent compilation cache by the next runs, their input shapes are padded to be reused (default off)"""
+    jax_cache_dir: str|None = None
+    """if set, the folder of the persistent jax compilation cache used with --jax-cache (default ~/.cache/data_generation/jax)"""
 
 
 if __name__ == "__main__":
@@ -68,75 +70,41 @@ if __name__ == "__main__":
             "experiment_file should be provided, don't hesitate to invoke --help"
         )
 
-    with open(args.experiment_file + ".json", "r") as json_file:
-        experiment_data = Experiment(**json.load(json_file))
-
-    sys.path.append(experiment_data.generation_params.experiment_folder)
-
-    # import the xlsindy_gen.py script
-    xlsindy_gen = importlib.import_module("xlsindy_gen")
+    # the series are parsed on first access, the skip check below only reads the trajectory names
+    experiment_data = load_experiment(args.experiment_file + ".json", series="lazy")
 
-    try:
-        xlsindy_component = eval(f"xlsindy_gen.xlsindy_component")
-    except AttributeError:
-        raise AttributeError(
-            f"xlsindy_gen.py should contain a function named {args.regression_parameters.paradigm}_component in order to work with algorithm {args.regression_parameters.paradigm}"
-        )
+    # Nothing to align, leave before importing the regression backends (same check as below, nothing is written)
+    if args.skip_already_done and not args.timeout_signal:
+        if args.regression_parameters.UID in experiment_data.data.validation_group.get_trajectory_name():
+            print("already aligned")
+            exit()
 
-    try:
-        forces_wrapper = xlsindy_gen.forces_wrapper
-    except AttributeError:
-        forces_wrapper = None
+    from data_generation.script.acceleration_function import configure_acceleration_cache
+    from data_generation.script.compilation_cache import DEFAULT_CACHE_DIR,compilation_stats,configure_compilation_cache
+    from data_generation.script.alignment import RegressionTimeout,add_reference_solutions,align_regression,failed_trajectory
+    from data_generation.script.alignment import load_component,load_training_data,regression_random_seed,save_alignment
+    from data_generation.script.alignment import set_regression_trajectory,time_budget
 
-    random_seed = experiment_data.generation_params.random_seed + args.regression_parameters.random_seed
-    print("random seed is :", random_seed)
-    num_coordinates, time_sym, symbols_matrix, full_catalog, xml_content, extra_info = (
-        xlsindy_component(mode=args.regression_parameters.paradigm, random_seed=random_seed)
-    )
+    configure_acceleration_cache(cache_dir=args.acceleration_cache_dir)
+    configure_compilation_cache(cache_dir=(args.jax_cache_dir or DEFAULT_CACHE_DIR) if args.jax_cache else None)
 
-    full_catalog: xlsindy.catalog.CatalogRepartition = full_catalog
+    sys.path.append(experiment_data.generation_params.experiment_folder)
 
-    regression_function = eval(f"xlsindy.optimization.{args.regression_parameters.optimization_function}")
+    print("random seed is :", regression_random_seed(experiment_data, args.regression_parameters))
+    component = load_component(experiment_data, args.regression_parameters, args.component_cache_dir)
 
     # Add the other ideal vector if another mode is present.
-
-    if args.regression_parameters.paradigm not in experiment_data.data.training_group.get_trajectory_by_name("training_data").get_solution_mode() :
-
-        experiment_data.data.training_group.get_trajectory_by_name("training_data").solutions.append(
-            Solution(
-                mode_solution=args.regression_parameters.paradigm,
-                solution_vector=extra_info["ideal_solution_vector"],
-                solution_label=full_catalog.label()
-            )
-        )
-
-
-    if args.regression_parameters.paradigm not in experiment_data.data.validation_group.get_trajectory_by_name("validation_data").get_solution_mode() :
-
-        experiment_data.data.validation_group.get_trajectory_by_name("validation_data").solutions.append(
-            Solution(
-                mode_solution=args.regression_parameters.paradigm,
-                solution_vector=extra_info["ideal_solution_vector"],
-                solution_label=full_catalog.label()
-            )
-        )
+    # The reference trajectories are then updated in the experiment json, otherwise only the regression is saved.
+    reference_solutions = add_reference_solutions(experiment_data, args.regression_parameters.paradigm, component)
 
     ## Mark the experiment as timeout if needed
     if args.timeout_signal:
 
-        experiment_data.data.validation_group.del_trajectory_by_name(args.regression_parameters.UID)
-        experiment_data.data.validation_group.trajectories.append(
-            TrajectoryData(
-                name=args.regression_parameters.UID,
-                regression_result=RegressionResult(
-                    regression_parameters=args.regression_parameters
-                )
-            )
-        )
-        
+        trajectory = failed_trajectory(args.regression_parameters, timeout=True)
+        set_regression_trajectory(experiment_data, trajectory)
+
         print("print model ...")
-        with open(args.experiment_file + ".json", "w") as file:
-            file.write(experiment_data.model_dump_json(indent=4))
+        save_alignment(args.experiment_file + ".json", reference_solutions, [trajectory])
 
         exit()
 
@@ -147,265 +115,36 @@ if __name__ == "__main__":
 
 
     try:
-        with open(experiment_data.data_path, 'rb') as f:
-            sim_data = pickle.load(f)
-
-        rng = np.random.default_rng(random_seed)
-        # load
-        imported_time = sim_data["simulation_time_training"]
-        imported_qpos = sim_data["simulation_qpos_training"]
-        imported_qvel = sim_data["simulation_qvel_training"]
-        imported_qacc = sim_data["simulation_qacc_training"]
-        imported_force = sim_data["force_vector_training"]
-
-
-        # add noise
-        imported_qpos += rng.normal(loc=0, scale=args.regression_parameters.noise_level, size=imported_qpos.shape)#*np.linalg.norm(imported_qpos)/imported_qpos.shape[0]
-        imported_qvel += rng.normal(loc=0, scale=args.regression_parameters.noise_level, size=imported_qvel.shape)#*np.linalg.norm(imported_qvel)/imported_qvel.shape[0]
-        imported_qacc += rng.normal(loc=0, scale=args.regression_parameters.noise_level, size=imported_qacc.shape)#*np.linalg.norm(imported_qacc)/imported_qacc.shape[0]
-        imported_force += rng.normal(loc=0, scale=args.regression_parameters.noise_level, size=imported_force.shape)#*np.linalg.norm(imported_force)/imported_force.shape[0]
-
-        # Use a fixed ratio of the data in respect with catalog size
-        catalog_size = full_catalog.catalog_length
-        data_ratio = args.regression_parameters.data_ratio
-        
-        # Sample uniformly n samples from the imported arrays
-        n_samples = int(catalog_size * data_ratio)
-        total_samples = imported_qpos.shape[0]
-        
-        if n_samples < total_samples:
-
-            # Evenly spaced sampling (deterministic, uniform distribution)
-            sample_indices = np.linspace(0, total_samples - 1, n_samples, dtype=int)
-            
-            # Apply sampling to all arrays
-            imported_qpos = imported_qpos[sample_indices]
-            imported_qvel = imported_qvel[sample_indices]
-            imported_qacc = imported_qacc[sample_indices]
-            imported_force = imported_force[sample_indices]
-            
-            logger.info(f"Sampled {n_samples} points uniformly from {total_samples} total samples")
-        else:
-            logger.info(f"Using all {total_samples} samples (requested {n_samples})")
-
-        ## XLSINDY dependent
-
-        start_time = time.perf_counter()
-
-        pre_knowledge_indices = np.nonzero(experiment_data.generation_params.forces_scale_vector)[0] + full_catalog.starting_index_by_type("ExternalForces")
-
-
-        pre_knowledge_mask = np.zeros((full_catalog.catalog_length,))
-        pre_knowledge_mask[pre_knowledge_indices] = 1.0
-
-        if args.regression_parameters.regression_type == "implicit":
-
-            logger.info("Starting implicit regression")
-
-            solution, exp_matrix = xlsindy.simulation.regression_implicite(
-                theta_values=imported_qpos,
-                velocity_values=imported_qvel,
-                acceleration_values=imported_qacc,
-                time_symbol=time_sym,
-                symbol_matrix=symbols_matrix,
-                catalog_repartition=full_catalog,
-                regression_function=regression_function,
-            )
-
-        elif args.regression_parameters.regression_type == "explicit":
-            
-            logger.info("Starting explicit regression")
-
-            solution, exp_matrix = xlsindy.simulation.regression_explicite(
-                theta_values=imported_qpos,
-                velocity_values=imported_qvel,
-                acceleration_values=imported_qacc,
-                time_symbol=time_sym,
-                symbol_matrix=symbols_matrix,
-                catalog_repartition=full_catalog,
-                external_force=imported_force,
-                regression_function=regression_function,
-                pre_knowledge_mask=pre_knowledge_mask
-            )
-
-        elif args.regression_parameters.regression_type == "mixed":
-
-            logger.info("Starting mixed regression")
-
-            solution, exp_matrix = xlsindy.simulation.regression_mixed(
-                theta_values=imported_qpos,
-                velocity_values=imported_qvel,
-                acceleration_values=imported_qacc,
-                time_symbol=time_sym,
-                symbol_matrix=symbols_matrix,
-                catalog_repartition=full_catalog,
-                external_force=imported_force,
-                regression_function=regression_function,
-                pre_knowledge_mask=pre_knowledge_mask
+        training_data = load_training_data(experiment_data)
+
+        with time_budget(args.timeout):
+            trajectory = align_regression(
+                experiment_data,
+                args.regression_parameters,
+                training_data,
+                component,
+                validation_generator=args.validation_generator,
+                divergence_factor=args.divergence_factor,
             )
 
-        end_time = time.perf_counter()
-
-        regression_time = end_time - start_time
-
-        logger.info(f"Regression completed in {end_time - start_time:.2f} seconds")
-
-        # DEBUG
-        # solution = extra_info["ideal_solution_vector"]
-        # Apply hard thresholding to the solution
-        threshold = 1e-2  # Adjust threshold value as needed
-        solution = np.where(np.abs(solution)/np.linalg.norm(solution) < threshold, 0, solution)
-
-        ##--------------------------------
-
-        model_acceleration_func, valid_model = (
-            xlsindy.dynamics_modeling.generate_acceleration_function(
-                solution, 
-                full_catalog,
-                symbols_matrix,
-                time_sym,
-                lambdify_module="jax",
-            )
-        )
-        model_dynamics_system = xlsindy.dynamics_modeling.dynamics_function_RK4_env(
-            model_acceleration_func
-        )
-
-        ## Analysis of result
-
-        regression_result = RegressionResult(
-            regression_parameters=args.regression_parameters,
-            valid=valid_model,
-            timeout=False,
-            regression_time=regression_time
-        )
-
-
-        if valid_model:
-
-            # Acceleration comparison result
-
-            model_dynamics_system = vmap(model_dynamics_system, in_axes=(1, 1), out_axes=1)
-            
-            model_coordinate = xlsindy.dynamics_modeling.vectorised_acceleration_generation(
-                model_dynamics_system, imported_qpos, imported_qvel, imported_force
-            )
-            # Finally, select the columns of interest (e.g., every second column starting at index 1)
-            model_acc = model_coordinate[:, 1::2]
-
-            # Estimate of the variance between model and mujoco
-            RMSE_acceleration = xlsindy.result_formatting.relative_mse(
-                model_acc[3:-3], imported_qacc[3:-3]
-            )
-
-            regression_result.RMSE_acceleration = RMSE_acceleration
-            print("estimate variance between mujoco and model is : ", RMSE_acceleration)
+        if not trajectory.regression_result.valid:
+            print("Skipped model verification, retrieval failed")
 
-            # Trajectory comparison result
+    except RegressionTimeout as timeout:
 
-            model_acceleration_func_np, _ = (
-                xlsindy.dynamics_modeling.generate_acceleration_function(
-                    solution, 
-                    full_catalog,
-                    symbols_matrix,
-                    time_sym,
-                    lambdify_module="numpy",
-                )
-            )
+        print("Alignment timed out :", timeout)
 
+        trajectory = failed_trajectory(args.regression_parameters, timeout=True, regression_result=timeout.regression_result)
 
-            (simulation_time_g, 
-            simulation_qpos_g, 
-            simulation_qvel_g, 
-            simulation_qacc_g, 
-            force_vector_g,
-            _) = generate_theoretical_trajectory(
-                num_coordinates,
-                experiment_data.generation_params.initial_position,
-                experiment_data.generation_params.initial_condition_randomness,
-                [experiment_data.generation_params.random_seed,0], # Ensure same seed as for data generation
-                1,
-                experiment_data.generation_params.validation_time,
-                solution,
-                full_catalog,
-                time_sym,
-                symbols_matrix,
-                experiment_data.generation_params.forces_scale_vector,
-            )
-
-            new_trajectory = TrajectoryData.from_numpy(
-                            name=args.regression_parameters.UID,
-                            time=simulation_time_g,
-                            qpos=simulation_qpos_g,
-                            qvel=simulation_qvel_g,
-                            qacc=simulation_qacc_g,
-                            forces=force_vector_g,
-                            reference_time=experiment_data.data.validation_group.get_trajectory_by_name("validation_data").series.time.time,
-                            mode_solution=args.regression_parameters.paradigm,
-                            solution_vector=solution,
-                            solution_label=full_catalog.label(),
-                            reference=False,
-                            regression_result=regression_result
-                        )
-
-            # Compute the position RMSE on the validation trajectory
-
-            validation_pos = experiment_data.data.validation_group.get_trajectory_by_name("validation_data").series.qpos.get_numpy_series()
-            regression_pos = new_trajectory.series.qpos.get_numpy_series()
-
-            error = xlsindy.result_formatting.relative_mse(
-                regression_pos, validation_pos
-            )
-
-            new_trajectory.regression_result.RMSE_validation_position = error
-
-            logger.info(f"Position RMSE on validation trajectory: {error}")
-
-
-            experiment_data.data.validation_group.del_trajectory_by_name(args.regression_parameters.UID)
-            experiment_data.data.validation_group.trajectories.append(new_trajectory)
-            
-        else: 
-            experiment_data.data.validation_group.del_trajectory_by_name(args.regression_parameters.UID)
-            experiment_data.data.validation_group.trajectories.append(
-                TrajectoryData(
-                    name=args.regression_parameters.UID,
-                    regression_result=regression_result,
-                    solutions=[
-                        Solution(
-                            mode_solution=args.regression_parameters.paradigm,
-                            solution_vector=solution,
-                            solution_label=full_catalog.label()
-                        )
-                    ],
-                )
-            )
+    except Exception as e:
 
-            # Generate the batch as a theory one
+        print("Alignment failed with error :", e)
 
-        if not valid_model:
-            print("Skipped model verification, retrieval failed")
-        
-        print("print model ...")
-        with open(args.experiment_file + ".json", "w") as file:
-            file.write(experiment_data.model_dump_json(indent=4))
+        trajectory = failed_trajectory(args.regression_parameters, timeout=False)
 
-    except Exception as e:
-        
-        print("Alignment failed with error :", e)
+    set_regression_trajectory(experiment_data, trajectory)
 
-        experiment_data.data.validation_group.del_trajectory_by_name(args.regression_parameters.UID)
-        experiment_data.data.validation_group.trajectories.append(
-            TrajectoryData(
-                name=args.regression_parameters.UID,
-                regression_result=RegressionResult(
-                    regression_parameters=args.regression_parameters,
-                    timeout=False
-                )
-            )
-        )
-        
-        print("print model ...")
-        with open(args.experiment_file + ".json", "w") as file:
-            file.write(experiment_data.model_dump_json(indent=4))
+    print("print model ...")
+    save_alignment(args.experiment_file + ".json", reference_solutions, [trajectory])
 
+    logger.info(compilation_stats.report())
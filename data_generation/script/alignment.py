@@ -0,0 +1,525 @@
+"""
+Regression of an experiment and validation of the retrieved model, shared by align_data (one regression per process)
+and align_batch (every regression of an experiment in one process).
+
+The expensive parts are loaded once per process and shared between the regressions of an experiment : the training data
+(load_training_data), the xlsindy_component of each paradigm (component_cache), the expanded catalog and the experiment
+matrix (experiment_matrix) and the acceleration functions (acceleration_function).
+"""
+import contextlib
+import logging
+import signal
+import time
+
+import numpy as np
+
+from typing import List, NamedTuple
+
+import xlsindy
+
+from jax import vmap
+
+from data_generation.script.acceleration_function import cached_acceleration_function
+from data_generation.script.compilation_cache import pad_rows,padded_length
+from data_generation.script.component_cache import load_xlsindy_component
+from data_generation.script.dataclass import Experiment,RegressionParameter,RegressionResult,Solution,TrajectoryData
+from data_generation.script.experiment_io import save_trajectories,update_experiment
+from data_generation.script.experiment_matrix import cached_experiment_matrix
+from data_generation.script.generate_trajectory import DivergenceGuard,generate_theoretical_trajectory,generate_theoretical_vectorized_trajectory
+from data_generation.script.jax_trajectory import generate_jax_trajectory
+from data_generation.script.simulation_data import load_simulation_data
+from data_generation.script.util import import_xlsindy_gen
+
+logger = logging.getLogger(__name__)
+
+VALIDATION_GENERATORS = {
+    "theorical": generate_theoretical_trajectory,
+    "theorical-vectorized": generate_theoretical_vectorized_trajectory,
+    "theorical-jax": generate_jax_trajectory,
+}
+
+class ReferenceSolution(NamedTuple):
+    """Ideal solution of a paradigm to add to a reference trajectory of the experiment."""
+    group_name: str
+    trajectory_name: str
+    solution: Solution
+
+class RegressionTimeout(Exception):
+    """
+    Raised inside a regression whose time budget is exhausted (see time_budget).
+
+    `regression_result` is set by align_regression : the regression time so far, or the complete result of the regression
+    if the validation was running.
+    """
+
+    def __init__(self, seconds: float):
+        super().__init__(f"time budget of {seconds} s exhausted")
+        self.regression_result: RegressionResult|None = None
+
+# SIGALRM is process wide, so is the budget : seconds of the running budget and whether it expired
+_budget = {"seconds": None, "expired": False}
+
+@contextlib.contextmanager
+def time_budget(seconds: float|None):
+    """
+    Raise RegressionTimeout in the block once `seconds` have elapsed, no budget if None.
+
+    The budget is a SIGALRM timer (main thread only) : the exception is raised at the next python instruction, a long call
+    in compiled code (a solver, a jax kernel) is interrupted when it returns. A library may catch it and raise its own
+    error instead (joblib does), align_regression reports any error raised once the budget expired as a RegressionTimeout.
+    """
+    if seconds is None:
+        yield
+        return
+
+    def expire(signum, frame):
+        _budget["expired"] = True
+        raise RegressionTimeout(seconds)
+
+    _budget.update(seconds=seconds, expired=False)
+    previous_handler = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+        _budget.update(seconds=None, expired=False)
+
+def regression_random_seed(experiment: Experiment, regression_parameters: RegressionParameter) -> List[int]:
+    """Seed of the catalog and of the noise of a regression."""
+    return experiment.generation_params.random_seed + regression_parameters.random_seed
+
+def load_component(experiment: Experiment, regression_parameters: RegressionParameter, component_cache_dir: str|None = None) -> tuple:
+    """
+    xlsindy_component of the experiment system for the paradigm of a regression, built once per process (see component_cache).
+
+    Returns:
+        tuple: the output of xlsindy_component (num_coordinates, time_sym, symbols_matrix, full_catalog, xml_content, extra_info)
+    """
+    # import the xlsindy_gen.py script
+    xlsindy_gen = import_xlsindy_gen(experiment.generation_params.experiment_folder)
+
+    try:
+        xlsindy_component = xlsindy_gen.xlsindy_component
+    except AttributeError:
+        raise AttributeError(
+            f"xlsindy_gen.py should contain a function named xlsindy_component in order to work with algorithm {regression_parameters.paradigm}"
+        )
+
+    return load_xlsindy_component(
+        xlsindy_component,
+        component_cache_dir,
+        mode=regression_parameters.paradigm,
+        random_seed=regression_random_seed(experiment, regression_parameters),
+    )
+
+def add_reference_solutions(experiment: Experiment, paradigm: str, component: tuple) -> List[ReferenceSolution]:
+    """
+    Add the ideal solution of a paradigm to the reference trajectories that do not have it yet.
+
+    Returns:
+        List[ReferenceSolution]: the solutions added, to be saved with save_alignment.
+    """
+    _, _, _, full_catalog, _, extra_info = component
+
+    added = []
+    for group_name, trajectory_name in (("training_group", "training_data"), ("validation_group", "validation_data")):
+        trajectory = getattr(experiment.data, group_name).get_trajectory_by_name(trajectory_name)
+
+        if paradigm not in trajectory.get_solution_mode():
+            solution = Solution(
+                mode_solution=paradigm,
+                solution_vector=extra_info["ideal_solution_vector"],
+                solution_label=full_catalog.label()
+            )
+            trajectory.solutions.append(solution)
+            added.append(ReferenceSolution(group_name, trajectory_name, solution))
+
+    return added
+
+def load_training_data(experiment: Experiment) -> dict:
+    """The training arrays of an experiment, memory mapped if the data is columnar, shared by its regressions."""
+    return load_simulation_data(experiment.data_path, group="training")
+
+def failed_trajectory(regression_parameters: RegressionParameter, timeout: bool, regression_result: RegressionResult|None = None) -> TrajectoryData:
+    """
+    Trajectory of a regression that did not complete.
+
+    Args:
+        regression_result (RegressionResult): what has been computed before the regression stopped (default None),
+            it is marked as not valid as a regression without result.
+    """
+    if regression_result is None:
+        regression_result = RegressionResult(regression_parameters=regression_parameters)
+
+    regression_result.valid = False
+    regression_result.timeout = timeout
+
+    return TrajectoryData(
+        name=regression_parameters.UID,
+        regression_result=regression_result
+    )
+
+def set_regression_trajectory(experiment: Experiment, trajectory: TrajectoryData) -> None:
+    """Replace the trajectory of a regression in the validation group."""
+    experiment.data.validation_group.del_trajectory_by_name(trajectory.name)
+    experiment.data.validation_group.trajectories.append(trajectory)
+
+def validate_solution(
+    experiment: Experiment,
+    regression_parameters: RegressionParameter,
+    regression_result: RegressionResult,
+    solution: np.ndarray,
+    component: tuple,
+    validation_generator: str = "theorical",
+    divergence_factor: float|None = None,
+) -> TrajectoryData:
+    """
+    Validation rollout of a retrieved model against the validation_data trajectory of an experiment (see align_regression).
+
+    Args:
+        regression_result (RegressionResult): the result of the regression, completed with the validation RMSE and
+            the stop of a guarded rollout.
+        solution (np.ndarray): the solution vector of the model.
+
+    Returns:
+        TrajectoryData: the trajectory of the regression, without series if the rollout stopped before the second
+        reference sample.
+    """
+    num_coordinates, time_sym, symbols_matrix, full_catalog, _, _ = component
+
+    generation_params = experiment.generation_params
+    validation_reference = experiment.data.validation_group.get_trajectory_by_name("validation_data")
+    validation_series = validation_reference.load_series()
+
+    validation_pos = validation_series.qpos.get_numpy_series()
+
+    guard_argument = {}
+    if divergence_factor is not None:
+        divergence_guard = DivergenceGuard.from_reference(
+            validation_pos,
+            validation_series.qvel.get_numpy_series(),
+            factor=divergence_factor,
+        )
+        guard_argument["divergence_guard"] = divergence_guard
+
+    (simulation_time_g,
+    simulation_qpos_g,
+    simulation_qvel_g,
+    simulation_qacc_g,
+    force_vector_g,
+    _) = VALIDATION_GENERATORS[validation_generator](
+        num_coordinates,
+        generation_params.initial_position,
+        generation_params.initial_condition_randomness,
+        [generation_params.random_seed,0], # Ensure same seed as for data generation
+        1,
+        generation_params.validation_time,
+        solution,
+        full_catalog,
+        time_sym,
+        symbols_matrix,
+        generation_params.forces_scale_vector,
+        **guard_argument,
+    )
+
+    if divergence_factor is not None and divergence_guard.stop_reason is not None:
+        regression_result.validation_stop_reason = divergence_guard.stop_reason
+        regression_result.validation_end_time = divergence_guard.stop_time
+
+        # stopped before a second reference sample, nothing to interpolate or to compare
+        if np.count_nonzero(validation_series.time.time <= simulation_time_g[-1, 0]) < 2:
+            return TrajectoryData(
+                name=regression_parameters.UID,
+                regression_result=regression_result,
+                solutions=[
+                    Solution(
+                        mode_solution=regression_parameters.paradigm,
+                        solution_vector=solution,
+                        solution_label=full_catalog.label()
+                    )
+                ],
+            )
+
+    new_trajectory = TrajectoryData.from_numpy(
+        name=regression_parameters.UID,
+        time=simulation_time_g,
+        qpos=simulation_qpos_g,
+        qvel=simulation_qvel_g,
+        qacc=simulation_qacc_g,
+        forces=force_vector_g,
+        reference_time=validation_series.time.time,
+        mode_solution=regression_parameters.paradigm,
+        solution_vector=solution,
+        solution_label=full_catalog.label(),
+        reference=False,
+        regression_result=regression_result
+    )
+
+    # Compute the position RMSE on the validation trajectory (up to the stop of a truncated rollout)
+
+    regression_pos = new_trajectory.series.qpos.get_numpy_series()
+    validation_pos = validation_pos[:len(regression_pos)]
+
+    error = xlsindy.result_formatting.relative_mse(
+        regression_pos, validation_pos
+    )
+
+    new_trajectory.regression_result.RMSE_validation_position = error
+
+    logger.info(f"Position RMSE on validation trajectory: {error}")
+
+    return new_trajectory
+
+def align_regression(
+    experiment: Experiment,
+    regression_parameters: RegressionParameter,
+    training_data: dict,
+    component: tuple,
+    validation_generator: str = "theorical",
+    divergence_factor: float|None = None,
+) -> TrajectoryData:
+    """
+    Run a regression on the training data of an experiment and validate the retrieved model.
+
+    Args:
+        experiment (Experiment): the experiment, the validation_data trajectory is the validation reference.
+        regression_parameters (RegressionParameter): the regression to run.
+        training_data (dict): the training arrays (load_training_data), they are not modified.
+        component (tuple): the xlsindy_component of the paradigm (load_component).
+        validation_generator (str): the generator of the validation rollout, a key of VALIDATION_GENERATORS.
+        divergence_factor (float): if set, the validation rollout stops once the state leaves `divergence_factor` times the
+            largest absolute position or velocity of the validation reference, or once its step collapses (see DivergenceGuard).
+            The truncated rollout is kept and the reason of the stop is recorded in the RegressionResult (default None, no guard).
+
+    Returns:
+        TrajectoryData: the trajectory of the regression, with the validation rollout if the model is valid.
+    """
+    num_coordinates, time_sym, symbols_matrix, full_catalog, xml_content, extra_info = component
+
+    full_catalog: xlsindy.catalog.CatalogRepartition = full_catalog
+
+    regression_function = getattr(xlsindy.optimization, regression_parameters.optimization_function)
+
+    rng = np.random.default_rng(regression_random_seed(experiment, regression_parameters))
+    # load
+    imported_time = training_data["simulation_time_training"]
+    imported_qpos = training_data["simulation_qpos_training"]
+    imported_qvel = training_data["simulation_qvel_training"]
+    imported_qacc = training_data["simulation_qacc_training"]
+    imported_force = training_data["force_vector_training"]
+
+
+    # add noise (not in place, the memory mapped arrays are read only)
+    imported_qpos = imported_qpos + rng.normal(loc=0, scale=regression_parameters.noise_level, size=imported_qpos.shape)#*np.linalg.norm(imported_qpos)/imported_qpos.shape[0]
+    imported_qvel = imported_qvel + rng.normal(loc=0, scale=regression_parameters.noise_level, size=imported_qvel.shape)#*np.linalg.norm(imported_qvel)/imported_qvel.shape[0]
+    imported_qacc = imported_qacc + rng.normal(loc=0, scale=regression_parameters.noise_level, size=imported_qacc.shape)#*np.linalg.norm(imported_qacc)/imported_qacc.shape[0]
+    imported_force = imported_force + rng.normal(loc=0, scale=regression_parameters.noise_level, size=imported_force.shape)#*np.linalg.norm(imported_force)/imported_force.shape[0]
+
+    # Use a fixed ratio of the data in respect with catalog size
+    catalog_size = full_catalog.catalog_length
+    data_ratio = regression_parameters.data_ratio
+
+    # Sample uniformly n samples from the imported arrays
+    n_samples = int(catalog_size * data_ratio)
+    total_samples = imported_qpos.shape[0]
+
+    if n_samples < total_samples:
+
+        # Evenly spaced sampling (deterministic, uniform distribution)
+        sample_indices = np.linspace(0, total_samples - 1, n_samples, dtype=int)
+
+        # Apply sampling to all arrays
+        imported_qpos = imported_qpos[sample_indices]
+        imported_qvel = imported_qvel[sample_indices]
+        imported_qacc = imported_qacc[sample_indices]
+        imported_force = imported_force[sample_indices]
+
+        logger.info(f"Sampled {n_samples} points uniformly from {total_samples} total samples")
+    else:
+        logger.info(f"Using all {total_samples} samples (requested {n_samples})")
+
+    ## XLSINDY dependent
+
+    start_time = time.perf_counter()
+    regression_result = None
+
+    # a time budget (see time_budget) can interrupt the regression or the validation anywhere,
+    # the timeout carries what has been computed so far
+    try:
+        pre_knowledge_indices = np.nonzero(experiment.generation_params.forces_scale_vector)[0] + full_catalog.starting_index_by_type("ExternalForces")
+
+
+        pre_knowledge_mask = np.zeros((full_catalog.catalog_length,))
+        pre_knowledge_mask[pre_knowledge_indices] = 1.0
+
+        # the regressions sharing this catalog and these (noisy, sampled) data build the experiment matrix once
+        with cached_experiment_matrix(full_catalog) as regression_catalog:
+
+            if regression_parameters.regression_type == "implicit":
+
+                logger.info("Starting implicit regression")
+
+                solution, exp_matrix = xlsindy.simulation.regression_implicite(
+                    theta_values=imported_qpos,
+                    velocity_values=imported_qvel,
+                    acceleration_values=imported_qacc,
+                    time_symbol=time_sym,
+                    symbol_matrix=symbols_matrix,
+                    catalog_repartition=regression_catalog,
+                    regression_function=regression_function,
+                )
+
+            elif regression_parameters.regression_type == "explicit":
+
+                logger.info("Starting explicit regression")
+
+                solution, exp_matrix = xlsindy.simulation.regression_explicite(
+                    theta_values=imported_qpos,
+                    velocity_values=imported_qvel,
+                    acceleration_values=imported_qacc,
+                    time_symbol=time_sym,
+                    symbol_matrix=symbols_matrix,
+                    catalog_repartition=regression_catalog,
+                    external_force=imported_force,
+                    regression_function=regression_function,
+                    pre_knowledge_mask=pre_knowledge_mask
+                )
+
+            elif regression_parameters.regression_type == "mixed":
+
+                logger.info("Starting mixed regression")
+
+                solution, exp_matrix = xlsindy.simulation.regression_mixed(
+                    theta_values=imported_qpos,
+                    velocity_values=imported_qvel,
+                    acceleration_values=imported_qacc,
+                    time_symbol=time_sym,
+                    symbol_matrix=symbols_matrix,
+                    catalog_repartition=regression_catalog,
+                    external_force=imported_force,
+                    regression_function=regression_function,
+                    pre_knowledge_mask=pre_knowledge_mask
+                )
+
+        end_time = time.perf_counter()
+
+        regression_time = end_time - start_time
+
+        logger.info(f"Regression completed in {end_time - start_time:.2f} seconds")
+
+        # DEBUG
+        # solution = extra_info["ideal_solution_vector"]
+        # Apply hard thresholding to the solution
+        threshold = 1e-2  # Adjust threshold value as needed
+        solution = np.where(np.abs(solution)/np.linalg.norm(solution) < threshold, 0, solution)
+
+        ##--------------------------------
+
+        model_acceleration_func, valid_model = (
+            cached_acceleration_function(
+                solution,
+                full_catalog,
+                symbols_matrix,
+                time_sym,
+                lambdify_module="jax",
+            )
+        )
+        model_dynamics_system = xlsindy.dynamics_modeling.dynamics_function_RK4_env(
+            model_acceleration_func
+        )
+
+        ## Analysis of result
+
+        regression_result = RegressionResult(
+            regression_parameters=regression_parameters,
+            valid=valid_model,
+            timeout=False,
+            regression_time=regression_time
+        )
+
+        if not valid_model:
+            # Generate the batch as a theory one
+            return TrajectoryData(
+                name=regression_parameters.UID,
+                regression_result=regression_result,
+                solutions=[
+                    Solution(
+                        mode_solution=regression_parameters.paradigm,
+                        solution_vector=solution,
+                        solution_label=full_catalog.label()
+                    )
+                ],
+            )
+
+        # Acceleration comparison result
+
+        model_dynamics_system = vmap(model_dynamics_system, in_axes=(1, 1), out_axes=1)
+
+        # the same number of samples for every data ratio, the compiled programs are reused (see compilation_cache)
+        sample_number = len(imported_qpos)
+        padded_samples = padded_length(sample_number)
+
+        model_coordinate = xlsindy.dynamics_modeling.vectorised_acceleration_generation(
+            model_dynamics_system,
+            pad_rows(imported_qpos, padded_samples),
+            pad_rows(imported_qvel, padded_samples),
+            pad_rows(imported_force, padded_samples),
+        )[:sample_number]
+        # Finally, select the columns of interest (e.g., every second column starting at index 1)
+        model_acc = model_coordinate[:, 1::2]
+
+        # Estimate of the variance between model and mujoco
+        RMSE_acceleration = xlsindy.result_formatting.relative_mse(
+            model_acc[3:-3], imported_qacc[3:-3]
+        )
+
+        regression_result.RMSE_acceleration = RMSE_acceleration
+        logger.info(f"estimate variance between mujoco and model is : {RMSE_acceleration}")
+
+        # Trajectory comparison result
+        return validate_solution(
+            experiment,
+            regression_parameters,
+            regression_result,
+            solution,
+            component,
+            validation_generator=validation_generator,
+            divergence_factor=divergence_factor,
+        )
+
+    except Exception as error:
+        if not isinstance(error, RegressionTimeout) and not _budget["expired"]:
+            raise
+
+        if regression_result is None:
+            regression_result = RegressionResult(
+                regression_parameters=regression_parameters,
+                regression_time=time.perf_counter() - start_time
+            )
+
+        timeout = error if isinstance(error, RegressionTimeout) else RegressionTimeout(_budget["seconds"])
+        timeout.regression_result = regression_result
+        if timeout is error:
+            raise
+        raise timeout from error
+
+def save_alignment(json_path: str, reference_solutions: List[ReferenceSolution], trajectories: List[TrajectoryData]) -> None:
+    """
+    Save the regressions of an experiment : the new reference solutions in the experiment json, the trajectories as records.
+    """
+    def add_solutions(experiment: Experiment) -> bool:
+        updated = False
+        for reference in reference_solutions:
+            trajectory = getattr(experiment.data, reference.group_name).get_trajectory_by_name(reference.trajectory_name)
+            # another align run may have added it since this one loaded the experiment
+            if reference.solution.mode_solution not in trajectory.get_solution_mode():
+                trajectory.solutions.append(reference.solution)
+                updated = True
+        return updated
+
+    if reference_solutions:
+        update_experiment(json_path, add_solutions)
+
+    save_trajectories(json_path, trajectories)
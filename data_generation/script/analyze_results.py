@@ -10,6 +10,7 @@ import tyro
 from tqdm import tqdm
 
 from data_generation.script.dataclass import Experiment
+from data_generation.script.experiment_io import load_experiment
 
 
 def clear_screen():
@@ -35,8 +36,8 @@ def analyze_results(results_dir: str = "results", only_valid_experiments: bool =
     json_files = list(Path(results_dir).glob("*.json"))
     for json_path in tqdm(json_files, desc="Analyzing experiments"):
         try:
-            with open(json_path, 'r') as f:
-                experiment = Experiment(**json.load(f))
+            # only the parameters and the regression results are used
+            experiment = load_experiment(str(json_path), series="headers")
             
             # Extract system name from experiment folder
             system_name = experiment.generation_params.experiment_folder.split('/')[-1]
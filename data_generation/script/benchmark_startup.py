@@ -0,0 +1,109 @@
+"""
+Startup benchmark of the data_generation CLIs.
+
+Measure the wall time of the commands that should return immediately : the --help of generate_data and align_data,
+and a generate_data / align_data run skipped because the result already exists. These runs only pay for the imports,
+a regression here means a heavy module (xlsindy, mujoco, jax, scipy...) is imported again at the top of a script.
+
+exemple:
+python -m data_generation.script.benchmark_startup --repeat 5
+"""
+
+from dataclasses import dataclass
+import tyro
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from data_generation.script.dataclass import DataGenerationParams,Experiment,RegressionParameter
+
+@dataclass
+class Args:
+    repeat: int = 5
+    """the number of runs of each command, the median is reported (default 5)"""
+    experiment_folder: str = "data_generation/mujoco_align_data/cart_pole"
+    """the experiment folder used for the skipped runs (default cart_pole)"""
+
+def time_command(command: list, cwd: str, env: dict, repeat: int) -> float:
+    """Median wall time (in seconds) of a command, raise if it fails."""
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        subprocess.run(command, cwd=cwd, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start_time)
+    return statistics.median(timings)
+
+def skipped_experiment(workdir: str, experiment_folder: str) -> tuple:
+    """
+    Write in `workdir` an experiment json that both CLIs consider as already done.
+
+    Returns:
+        DataGenerationParams: the generation parameters of the experiment.
+        RegressionParameter: a regression already present in the validation group.
+    """
+    params = DataGenerationParams(experiment_folder=experiment_folder)
+    regression = RegressionParameter()
+
+    experiment = Experiment(
+        generation_params=params,
+        data_path=f"results_data/{params.UID}.pkl",
+        data=Experiment.ExperimentData(
+            validation_group=Experiment.ExperimentData.TrajectoryGroup(
+                batch_starting_time=[0.0],
+                trajectories=[{"name": regression.UID}],
+            ),
+            training_group=Experiment.ExperimentData.TrajectoryGroup(
+                batch_starting_time=[0.0],
+                trajectories=[],
+            ),
+        ),
+    )
+
+    os.makedirs(os.path.join(workdir, "results"), exist_ok=True)
+    with open(os.path.join(workdir, "results", f"{params.UID}.json"), "w") as file:
+        file.write(experiment.model_dump_json(indent=4))
+
+    return params, regression
+
+if __name__ == "__main__":
+
+    args = tyro.cli(Args)
+
+    repository = os.getcwd()
+    experiment_folder = os.path.abspath(args.experiment_folder)
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [repository, env.get("PYTHONPATH")]))
+
+    with tempfile.TemporaryDirectory() as workdir:
+
+        params, regression = skipped_experiment(workdir, experiment_folder)
+
+        regression_args = []
+        for key, value in json.loads(regression.model_dump_json(exclude={"UID"})).items():
+            flag = f"--regression-parameters.{key.replace('_', '-')}"
+            regression_args += [flag, *map(str, value)] if isinstance(value, list) else [flag, str(value)]
+
+        commands = {
+            "python (interpreter only)": [sys.executable, "-c", "pass"],
+            "generate_data --help": [sys.executable, "-m", "data_generation.script.generate_data", "--help"],
+            "align_data --help": [sys.executable, "-m", "data_generation.script.align_data", "--help"],
+            "generate_data (skipped)": [
+                sys.executable, "-m", "data_generation.script.generate_data",
+                "--params.experiment-folder", experiment_folder,
+            ],
+            "align_data (skipped)": [
+                sys.executable, "-m", "data_generation.script.align_data",
+                "--experiment-file", f"results/{params.UID}",
+                *regression_args,
+            ],
+        }
+
+        for name, command in commands.items():
+            median = time_command(command, workdir, env, args.repeat)
+            print(f"{name:<28} {median*1000:8.1f} ms")
@@ -0,0 +1,110 @@
+"""
+Check that a model which diverges from the start of its validation rollout keeps the reason of the stop (see
+DivergenceGuard and alignment.validate_solution).
+
+The ideal solution of an experiment is validated with each validation generator in two cases :
+- the dynamics are not finite at t=0 (the force signal of the experiment is replaced by nan), the rollout stops on its
+  initial state;
+- the state leaves the bound on the first step (a divergence factor far below the reference, `--tight-factor`).
+
+The validation must not raise, and validation_stop_reason and validation_end_time must be recorded, the script fails
+otherwise.
+
+exemple:
+python -m data_generation.script.check_divergence_guard --experiment-file results/{UID}
+"""
+
+from dataclasses import dataclass, field
+from typing import List
+import tyro
+
+import sys
+
+import numpy as np
+
+from data_generation.script.util import setup_logger
+
+logger = setup_logger(__name__)
+
+@dataclass
+class Args:
+    experiment_file: str = "None"
+    """the experiment file (without extension)"""
+    paradigm: str = "mixed"
+    """the paradigm whose ideal solution is validated (default mixed)"""
+    validation_generators: List[str] = field(default_factory=lambda: ["theorical", "theorical-vectorized", "theorical-jax"])
+    """the validation generators checked (default every generator)"""
+    divergence_factor: float = 10.0
+    """the divergence factor of the non finite case (default 10.0)"""
+    tight_factor: float = 1e-9
+    """the divergence factor of the out of bound case, small enough for the first step to leave the bound (default 1e-9)"""
+
+if __name__ == "__main__":
+
+    args = tyro.cli(Args)
+
+    if args.experiment_file == "None":
+        raise ValueError(
+            "experiment_file should be provided, don't hesitate to invoke --help"
+        )
+
+    from data_generation.script.alignment import load_component,validate_solution
+    from data_generation.script.dataclass import RegressionParameter,RegressionResult
+    from data_generation.script.experiment_io import load_experiment
+
+    experiment = load_experiment(args.experiment_file + ".json")
+
+    sys.path.append(experiment.generation_params.experiment_folder)
+
+    regression_parameters = RegressionParameter(paradigm=args.paradigm)
+    component = load_component(experiment, regression_parameters)
+    solution = np.asarray(component[5]["ideal_solution_vector"], dtype=np.float64)
+
+    # the dynamics of the model are not finite from t=0
+    non_finite_experiment = experiment.model_copy(update={
+        "generation_params": experiment.generation_params.model_copy(update={
+            "forces_scale_vector": [np.nan] * len(experiment.generation_params.forces_scale_vector),
+        }),
+    })
+
+    cases = (
+        ("non finite at t=0", non_finite_experiment, args.divergence_factor),
+        ("out of bound on the first step", experiment, args.tight_factor),
+    )
+
+    failures = []
+
+    for generator in args.validation_generators:
+        for name, case_experiment, factor in cases:
+
+            regression_result = RegressionResult(
+                regression_parameters=regression_parameters,
+                valid=True,
+                timeout=False,
+                regression_time=0.0,
+            )
+
+            try:
+                trajectory = validate_solution(
+                    case_experiment,
+                    regression_parameters,
+                    regression_result,
+                    solution,
+                    component,
+                    validation_generator=generator,
+                    divergence_factor=factor,
+                )
+            except Exception as e:
+                failures.append(f"{generator}, {name} : raised {type(e).__name__} {e}")
+                continue
+
+            result = trajectory.regression_result
+            print(f"{generator}, {name} : {result.validation_stop_reason} at t={result.validation_end_time}")
+
+            if result.validation_stop_reason is None or result.validation_end_time is None:
+                failures.append(f"{generator}, {name} : no stop recorded")
+
+    if failures:
+        raise SystemExit("FAILED : " + "; ".join(failures))
+
+    print(f"ok : the stop is recorded with {len(args.validation_generators)} generators")
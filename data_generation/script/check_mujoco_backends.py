@@ -0,0 +1,132 @@
+"""
+Check that the two mujoco backends of generate_data give the same trajectories : "mujoco" (python control callback,
+stream_mujoco_trajectory) and "mujoco-rollout" (native rollout, stream_mujoco_rollout_trajectory).
+
+The backends do not integrate exactly the same system. With the RK4 integrator, the callback evaluates the force at the
+time of every stage (t, t + h/2, t + h/2, t + h) while the rollout takes the force of the step as a qfrc_applied control,
+held at its value at t during the 4 stages (zero order hold). The gap is a local error in h times the force derivative
+and it accumulates along the trajectory, it is not a rounding difference : the comparison uses absolute tolerances
+(on cart_pole with the defaults, the measured gap is about 1e-3 on qpos, 3e-3 on qvel and 5e-2 on qacc). The qacc gap
+is larger : the first callback of a step records the acceleration of the previous evaluation (the last RK4 stage of the
+previous step) while the rollout recomputes the acceleration at the start of the step. The forces are the same
+sinusoidal signal evaluated at the same step times, they should match.
+
+Two grids are checked :
+- the full recording : the callback backend records every stage, the sample at the start of each step (one in four
+  under RK4) is compared with the sample of the rollout;
+- the decimated recording of generate_data (`--sample-number`, `--truncation`) : both backends must keep the same
+  steps (the sample times are compared exactly) and agree within the same tolerances.
+
+The script fails if a grid differs or if a gap is above its tolerance.
+
+exemple:
+python -m data_generation.script.check_mujoco_backends --batch-number 3 --max-time 2.0
+"""
+
+from dataclasses import dataclass, field
+from typing import List
+import tyro
+
+import numpy as np
+
+from data_generation.script.check_mujoco_workers import load_mujoco_system
+from data_generation.script.util import setup_logger
+
+logger = setup_logger(__name__)
+
+@dataclass
+class Args:
+    experiment_folder: str = "data_generation/mujoco_align_data/cart_pole"
+    """the experiment folder of the system (default cart_pole)"""
+    damping_coefficients: List[float] = field(default_factory=lambda: [-0.5, -0.5])
+    """the damping coefficients of the system (default -0.5 -0.5)"""
+    forces_scale_vector: List[float] = field(default_factory=lambda: [1.0, 1.0])
+    """the scale of the forces of each coordinate (default 1.0 1.0)"""
+    initial_condition_randomness: List[float] = field(default_factory=lambda: [3.0])
+    """the randomness of the initial condition of each batch (default 3.0)"""
+    random_seed: List[int] = field(default_factory=lambda: [1])
+    """the random seed of the generation (default 1)"""
+    batch_number: int = 3
+    """the number of batches (default 3)"""
+    max_time: float = 2.0
+    """the simulated time of each batch (default 2.0)"""
+    sample_number: int = 300
+    """the sample number of the decimated grid (default 300)"""
+    truncation: int = 5
+    """the truncation of the decimated grid, the one of generate_data (default 5)"""
+    qpos_tolerance: float = 5e-3
+    """the largest absolute gap accepted on the positions (default 5e-3)"""
+    qvel_tolerance: float = 1e-2
+    """the largest absolute gap accepted on the velocities (default 1e-2)"""
+    qacc_tolerance: float = 1e-1
+    """the largest absolute gap accepted on the accelerations (default 1e-1)"""
+
+def compare_trajectories(name: str, callback: tuple, rollout: tuple, args: Args) -> List[str]:
+    """
+    Compare the arrays of two generated trajectories on the same time grid.
+
+    Returns:
+        List[str]: the failures, empty if the grids are the same and every gap is within its tolerance.
+    """
+    if callback[0].shape != rollout[0].shape or not np.array_equal(callback[0], rollout[0]):
+        return [f"{name} : the sample times differ ({len(callback[0])} and {len(rollout[0])} samples)"]
+
+    failures = []
+    for array_name, index, tolerance in (
+        ("qpos", 1, args.qpos_tolerance),
+        ("qvel", 2, args.qvel_tolerance),
+        ("qacc", 3, args.qacc_tolerance),
+        ("forces", 4, 1e-9),
+    ):
+        gap = np.max(np.abs(callback[index] - rollout[index]))
+        print(f"{name}, {array_name} : max gap {gap:.2e} (tolerance {tolerance:.0e})")
+        if not gap <= tolerance:
+            failures.append(f"{name} : {array_name} gap {gap:.2e} above {tolerance:.0e}")
+    return failures
+
+if __name__ == "__main__":
+
+    args = tyro.cli(Args)
+
+    from data_generation.script.generate_trajectory import generate_mujoco_rollout_trajectory,generate_mujoco_trajectory
+    from data_generation.script.generate_trajectory import load_mujoco_model,mujoco_stage_count
+
+    num_coordinates, xml_content, mujoco_transform, inverse_mujoco_transform = load_mujoco_system(
+        args.experiment_folder, args.damping_coefficients, args.random_seed
+    )
+
+    inputs = (
+        num_coordinates,
+        np.zeros((num_coordinates, 2)),
+        args.initial_condition_randomness,
+        args.random_seed,
+        args.batch_number,
+        args.max_time,
+        xml_content,
+        args.forces_scale_vector,
+        mujoco_transform,
+        inverse_mujoco_transform,
+    )
+
+    # one callback call per step, or one per stage of the RK4
+    stages = mujoco_stage_count(load_mujoco_model(xml_content))
+
+    callback = generate_mujoco_trajectory(*inputs)
+    rollout = generate_mujoco_rollout_trajectory(*inputs)
+
+    failures = compare_trajectories(
+        "full",
+        tuple(array[::stages] for array in callback[:5]),
+        rollout,
+        args,
+    )
+
+    callback = generate_mujoco_trajectory(*inputs, sample_number=args.sample_number, truncation=args.truncation)
+    rollout = generate_mujoco_rollout_trajectory(*inputs, sample_number=args.sample_number, truncation=args.truncation)
+
+    failures += compare_trajectories("decimated", callback, rollout, args)
+
+    if failures:
+        raise SystemExit("FAILED : " + "; ".join(failures))
+
+    print(f"ok : {args.batch_number} batches, full and decimated ({len(rollout[0])} samples) grids within tolerance")
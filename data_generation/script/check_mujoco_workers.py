@@ -0,0 +1,103 @@
+"""
+Check that the threaded mujoco generation gives the same trajectories as the serial one (see stream_mujoco_trajectory).
+
+The same batches are generated with `--workers 1` and with `--workers N`, every array (time, qpos, qvel, qacc, forces)
+and the batch starting times must be bit identical, the script fails otherwise.
+
+exemple:
+python -m data_generation.script.check_mujoco_workers --workers 3 --batch-number 3
+"""
+
+from dataclasses import dataclass, field
+from typing import List
+import tyro
+
+import os
+import sys
+
+import numpy as np
+
+from data_generation.script.util import import_xlsindy_gen,setup_logger
+
+logger = setup_logger(__name__)
+
+@dataclass
+class Args:
+    experiment_folder: str = "data_generation/mujoco_align_data/cart_pole"
+    """the experiment folder of the system (default cart_pole)"""
+    damping_coefficients: List[float] = field(default_factory=lambda: [-0.5, -0.5])
+    """the damping coefficients of the system (default -0.5 -0.5)"""
+    forces_scale_vector: List[float] = field(default_factory=lambda: [1.0, 1.0])
+    """the scale of the forces of each coordinate (default 1.0 1.0)"""
+    initial_condition_randomness: List[float] = field(default_factory=lambda: [3.0])
+    """the randomness of the initial condition of each batch (default 3.0)"""
+    random_seed: List[int] = field(default_factory=lambda: [1])
+    """the random seed of the generation (default 1)"""
+    batch_number: int = 3
+    """the number of batches (default 3)"""
+    max_time: float = 2.0
+    """the simulated time of each batch (default 2.0)"""
+    sample_number: int|None = None
+    """if set, the number of samples kept over all the batches (default None, every step)"""
+    workers: int = 3
+    """the number of workers compared to the serial generation (default 3)"""
+
+def load_mujoco_system(experiment_folder: str, damping_coefficients: List[float], random_seed: List[int]) -> tuple:
+    """
+    The mujoco model of an experiment folder, as generate_data loads it.
+
+    Returns:
+        tuple: (num_coordinates, xml_content, mujoco_transform, inverse_mujoco_transform)
+    """
+    from data_generation.script.component_cache import load_xlsindy_component
+
+    folder_path = os.path.abspath(experiment_folder)
+    sys.path.append(folder_path)
+    xlsindy_gen = import_xlsindy_gen(folder_path)
+
+    num_coordinates, _, _, _, xml_content, _ = load_xlsindy_component(
+        xlsindy_gen.xlsindy_component, random_seed=random_seed, damping_coefficients=damping_coefficients
+    )
+    return num_coordinates, xml_content, xlsindy_gen.mujoco_transform, xlsindy_gen.inverse_mujoco_transform
+
+if __name__ == "__main__":
+
+    args = tyro.cli(Args)
+
+    from data_generation.script.generate_trajectory import generate_mujoco_trajectory
+
+    num_coordinates, xml_content, mujoco_transform, inverse_mujoco_transform = load_mujoco_system(
+        args.experiment_folder, args.damping_coefficients, args.random_seed
+    )
+
+    def generate(workers: int) -> tuple:
+        return generate_mujoco_trajectory(
+            num_coordinates,
+            np.zeros((num_coordinates, 2)),
+            args.initial_condition_randomness,
+            args.random_seed,
+            args.batch_number,
+            args.max_time,
+            xml_content,
+            args.forces_scale_vector,
+            mujoco_transform,
+            inverse_mujoco_transform,
+            sample_number=args.sample_number,
+            truncation=0 if args.sample_number is None else 5,
+            workers=workers,
+        )
+
+    serial = generate(1)
+    threaded = generate(args.workers)
+
+    names = ("time", "qpos", "qvel", "qacc", "forces", "batch_starting_times")
+    failures = [
+        f"{name} differs (max gap {np.max(np.abs(np.asarray(a) - np.asarray(b))) if np.shape(a) == np.shape(b) else 'shape'})"
+        for name, a, b in zip(names, serial, threaded)
+        if not np.array_equal(a, b)
+    ]
+
+    if failures:
+        raise SystemExit(f"FAILED with {args.workers} workers : " + ", ".join(failures))
+
+    print(f"ok : {args.batch_number} batches identical with 1 and {args.workers} workers ({len(serial[0])} samples)")
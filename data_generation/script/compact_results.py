@@ -0,0 +1,49 @@
+"""
+Write the trajectory records of align_data (results/{UID}.trajectories/) back in the experiment json (see experiment_io.py).
+
+The site reads the experiment json alone, compact before packaging results/ for a release.
+
+exemple:
+python -m data_generation.script.compact_results --results-dir results
+"""
+
+from dataclasses import dataclass
+import tyro
+
+import glob
+import os
+
+from data_generation.script.experiment_io import compact_experiment
+from data_generation.script.util import setup_logger
+
+logger = setup_logger(__name__)
+
+@dataclass
+class Args:
+    results_dir: str = "results"
+    """the folder of the experiment json to compact (default results)"""
+
+if __name__ == "__main__":
+
+    args = tyro.cli(Args)
+
+    compacted = 0
+    records = 0
+    failed = 0
+
+    for json_path in sorted(glob.glob(os.path.join(args.results_dir, "*.json"))):
+
+        # the manifest of the site lives in the same folder
+        if os.path.basename(json_path) == "files.json":
+            continue
+
+        try:
+            merged = compact_experiment(json_path)
+            if merged:
+                compacted += 1
+                records += merged
+        except Exception as e:
+            logger.error(f"Failed to compact {json_path}: {e}")
+            failed += 1
+
+    logger.info(f"{records} records merged in {compacted} experiments, {failed} failed")
@@ -0,0 +1,130 @@
+"""
+Persistent compilation cache of the jax programs of the alignment.
+
+Every align_data process compiles the same jax programs : the model acceleration evaluated on the training samples
+(the vmapped xlsindy dynamics_function_RK4_env, run op by op) and the jitted rollout of the theorical-jax validation
+(see jax_trajectory). The coefficients of the model are inputs of these programs, they only depend on the catalog of the
+(system, paradigm) and on the shapes of their inputs. With the jax compilation cache on disk, the executables compiled
+by one process are loaded by the next ones.
+
+A cache hit needs the same shapes : while the cache is on, the number of samples and of time steps are padded up to the
+next multiple of PAD_MULTIPLE (padded_length), the padded part is computed and dropped. The bucket is coarse enough for
+the close data ratios and validation times to share an executable, and the padding adds at most PAD_MULTIPLE - 1 rows
+(a power of two could nearly double the work, 4001 steps would run as 8192). The batch axis is not padded.
+
+The cache is opt-in (align_data --jax-cache), in the user cache folder by default (DEFAULT_CACHE_DIR). A cold run pays
+the compilation and the write of every executable.
+
+The compile time (tracing, lowering and compilation or loading of the executables) and the hit rate of the cache are
+collected from the jax monitoring events, see compilation_stats.
+
+On some hosts XLA logs a machine feature mismatch when it loads an executable from the cache, the executable is still
+used. TF_CPP_MIN_LOG_LEVEL=3 silences it.
+"""
+import logging
+import os
+import numpy as np
+
+import jax
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")), "data_generation", "jax"
+)
+"""the default cache folder ($XDG_CACHE_HOME/data_generation/jax, ~/.cache/data_generation/jax if unset)"""
+
+DEFAULT_MAX_SIZE = 2**30
+"""the size of the cache folder (in bytes) above which the least recently used executables are deleted (needs filelock)"""
+
+PAD_MULTIPLE = 1024
+"""the bucket of the padded lengths (see padded_length)"""
+
+# the jax monitoring events of a compilation
+_COMPILE_EVENTS = (
+    "/jax/core/compile/jaxpr_trace_duration",
+    "/jax/core/compile/jaxpr_to_mlir_module_duration",
+    "/jax/core/compile/backend_compile_duration",
+)
+
+class CompilationStats:
+    """Compile time and use of the persistent cache in the process, filled by the jax monitoring listeners."""
+
+    def __init__(self):
+        self.compile_time = 0.0
+        self.requests = 0
+        self.hits = 0
+        self.listening = False
+
+    def on_event(self, event: str, **kwargs):
+        if event == "/jax/compilation_cache/compile_requests_use_cache":
+            self.requests += 1
+        elif event == "/jax/compilation_cache/cache_hits":
+            self.hits += 1
+
+    def on_duration(self, event: str, duration: float, **kwargs):
+        if event in _COMPILE_EVENTS:
+            self.compile_time += duration
+
+    def listen(self):
+        """Register the listeners (once per process)."""
+        if not self.listening:
+            jax.monitoring.register_event_listener(self.on_event)
+            jax.monitoring.register_event_duration_secs_listener(self.on_duration)
+            self.listening = True
+
+    @property
+    def hit_rate(self) -> float|None:
+        """Share of the compilations loaded from the cache, None if the cache was not used."""
+        return self.hits / self.requests if self.requests else None
+
+    def report(self) -> str:
+        if self.hit_rate is None or _cache["dir"] is None:
+            return f"jax compilation : {self.compile_time:.2f} s, persistent cache not used"
+        return f"jax compilation : {self.compile_time:.2f} s, persistent cache {self.hits}/{self.requests} hits ({self.hit_rate:.0%})"
+
+compilation_stats = CompilationStats()
+"""the compilation statistics of the process"""
+
+_cache = {"dir": None}
+
+def configure_compilation_cache(cache_dir: str|None = DEFAULT_CACHE_DIR, max_size: int = DEFAULT_MAX_SIZE):
+    """
+    Use a persistent jax compilation cache in `cache_dir` and pad the shapes of the alignment programs, None keeps the
+    cache off. The compile time is collected in both cases.
+
+    To be called before the first jax computation of the process.
+    """
+    compilation_stats.listen()
+
+    if cache_dir is None:
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    jax.config.update("jax_compilation_cache_dir", cache_dir)
+    # the op by op programs compile fast but there are many of them, they are cached as well
+    jax.config.update("jax_persistent_cache_min_compile_time_secs", 0.0)
+
+    # jax needs filelock to evict the old entries, without it every read of the cache fails
+    try:
+        import filelock
+        jax.config.update("jax_compilation_cache_max_size", max_size)
+    except ImportError:
+        logger.warning("filelock is not installed, the size of the jax compilation cache is not limited")
+
+    _cache["dir"] = cache_dir
+    logger.info(f"jax compilation cache in {cache_dir}")
+
+def padded_length(length: int) -> int:
+    """The length of an input once padded : the next multiple of PAD_MULTIPLE if the cache is on, `length` otherwise."""
+    if _cache["dir"] is None or length <= 1:
+        return length
+    return -(-length // PAD_MULTIPLE) * PAD_MULTIPLE
+
+def pad_rows(array: np.ndarray, length: int) -> np.ndarray:
+    """Pad the first axis of `array` up to `length` by repeating its last row."""
+    array = np.asarray(array)
+    if len(array) >= length:
+        return array
+    return np.pad(array, [(0, length - len(array))] + [(0, 0)] * (array.ndim - 1), mode="edge")
@@ -0,0 +1,99 @@
+"""
+Content addressed cache of the xlsindy_component outputs of the systems in mujoco_align_data.
+
+Building the catalog (generate_full_catalog, cross_catalog, newton_from_lagrangian, augment_catalog...) is pure sympy work
+that only depends on the arguments of xlsindy_component and on the source of the system, so its output can be pickled once
+and reloaded by every generate_data and align_data run.
+"""
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pickle
+
+from typing import Callable, Dict
+
+import xlsindy
+
+logger = logging.getLogger(__name__)
+
+# In process cache, keyed by component_cache_key
+_components: Dict[str, tuple] = {}
+
+def source_hash(folder: str) -> str:
+    """Hash of every file of a system folder and of the python helpers of its parent folder (text_utils.py...)."""
+    key = hashlib.md5()
+
+    paths = [os.path.join(folder, name) for name in sorted(os.listdir(folder))]
+    parent = os.path.dirname(os.path.abspath(folder))
+    paths += [os.path.join(parent, name) for name in sorted(os.listdir(parent)) if name.endswith(".py")]
+
+    for path in paths:
+        if os.path.isfile(path):
+            key.update(os.path.basename(path).encode())
+            with open(path, "rb") as f:
+                key.update(f.read())
+
+    return key.hexdigest()
+
+def component_cache_key(xlsindy_component: Callable, **kwargs) -> str:
+    """
+    Key of an xlsindy_component call : system, arguments (defaults included), source hash and xlsindy version.
+    """
+    folder = os.path.dirname(os.path.abspath(inspect.getsourcefile(xlsindy_component)))
+
+    arguments = inspect.signature(xlsindy_component).bind(**kwargs)
+    arguments.apply_defaults()
+
+    key = json.dumps(
+        {
+            "system": os.path.basename(folder),
+            "arguments": arguments.arguments,
+            "source": source_hash(folder),
+            "xlsindy": getattr(xlsindy, "__version__", None),
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.md5(key.encode()).hexdigest()
+
+def load_xlsindy_component(xlsindy_component: Callable, cache_dir: str|None = None, **kwargs) -> tuple:
+    """
+    Call xlsindy_component(**kwargs) through the cache.
+
+    The output is kept for the process and, if `cache_dir` is set, pickled in `{cache_dir}/{key}.pkl` for the next runs.
+    The returned objects are shared between the calls with the same arguments, they should not be modified.
+
+    Returns:
+        tuple: the output of xlsindy_component (num_coordinates, time_sym, symbols_matrix, catalog_repartition, xml_content, extra_info)
+    """
+    key = component_cache_key(xlsindy_component, **kwargs)
+
+    if key in _components:
+        return _components[key]
+
+    component = None
+    file_path = os.path.join(cache_dir, f"{key}.pkl") if cache_dir is not None else None
+
+    if file_path is not None and os.path.exists(file_path):
+        try:
+            with open(file_path, "rb") as f:
+                component = pickle.load(f)
+            logger.info(f"xlsindy component loaded from {file_path}")
+        except Exception as e:
+            logger.warning(f"Failed to load the component cache {file_path}: {e}")
+
+    if component is None:
+        component = xlsindy_component(**kwargs)
+
+        if file_path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            # write then rename, another process may read the same entry
+            temporary_path = f"{file_path}.{os.getpid()}.tmp"
+            with open(temporary_path, "wb") as f:
+                pickle.dump(component, f)
+            os.replace(temporary_path, file_path)
+
+    _components[key] = component
+    return component
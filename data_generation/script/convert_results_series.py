@@ -0,0 +1,62 @@
+"""
+Convert the experiment json of results/ between inline series and a binary series sidecar (see experiment_io.py).
+
+The site reads the inline format, convert back with --series-format json before packaging results/ for a release.
+
+exemple:
+python -m data_generation.script.convert_results_series --results-dir results --series-format sidecar
+"""
+
+from dataclasses import dataclass
+import tyro
+
+import glob
+import os
+
+from data_generation.script.experiment_io import load_experiment,save_experiment
+from data_generation.script.util import setup_logger
+
+logger = setup_logger(__name__)
+
+@dataclass
+class Args:
+    results_dir: str = "results"
+    """the folder of the experiment json to convert (default results)"""
+    series_format: str = "sidecar"
+    """the target format : "sidecar" (binary {UID}.series.bin next to a slim json) or "json" (inline float lists) (default sidecar)"""
+    dtype: str = "<f8"
+    """the numpy dtype of the values in the sidecar, "<f4" halves the size but is not lossless (default "<f8")"""
+
+if __name__ == "__main__":
+
+    args = tyro.cli(Args)
+
+    if args.series_format not in ("sidecar", "json"):
+        raise ValueError(f"Unknown series format {args.series_format}, expected sidecar or json")
+
+    sidecar = args.series_format == "sidecar"
+
+    converted = 0
+    skipped = 0
+    failed = 0
+
+    for json_path in sorted(glob.glob(os.path.join(args.results_dir, "*.json"))):
+
+        # the manifest of the site lives in the same folder
+        if os.path.basename(json_path) == "files.json":
+            continue
+
+        try:
+            experiment = load_experiment(json_path)
+
+            if (experiment.series_path is not None) == sidecar:
+                skipped += 1
+                continue
+
+            save_experiment(experiment, json_path, sidecar=sidecar, dtype=args.dtype)
+            converted += 1
+        except Exception as e:
+            logger.error(f"Failed to convert {json_path}: {e}")
+            failed += 1
+
+    logger.info(f"{converted} converted, {skipped} already in the {args.series_format} format, {failed} failed")
@@ -19,6 +19,7 @@ python -m data_generation.script.generate_data \
 
 import subprocess
 import argparse
+import json
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import sys
@@ -141,6 +142,28 @@ def generate_command(experiment_name, random_seed, damping_coef, initial_pos, fo
     return command
 
 
+def generate_params(experiment_name, random_seed, damping_coef, initial_pos, force_scale):
+    """Generate the DataGenerationParams fields of the given configuration (same experiment as generate_command)"""
+    # Initial position (need to duplicate each value to match qpos, qvel format)
+    initial_pos_full = []
+    for val in initial_pos:
+        initial_pos_full.extend([val, 0.0])
+
+    return {
+        "random_seed": [random_seed],
+        "damping_coefficients": damping_coef,
+        "batch_number": FIXED_ARGS["batch_number"],
+        "generation_type": FIXED_ARGS["generation_type"],
+        "max_time": FIXED_ARGS["max_time"],
+        "sample_number": FIXED_ARGS["sample_number"],
+        "max_validation_sample": FIXED_ARGS["max_validation_sample"],
+        "experiment_folder": EXPERIMENT_FOLDERS[experiment_name],
+        "initial_condition_randomness": FIXED_ARGS["initial_condition_randomness"],
+        "initial_position": initial_pos_full,
+        "forces_scale_vector": force_scale,
+    }
+
+
 def run_command(command_info):
     """Worker function to execute a command
     
@@ -199,10 +222,17 @@ def main():
         action="store_true",
         help="Only execute commands, don't save to file"
     )
+    parser.add_argument(
+        "--jobs-output",
+        type=str,
+        default=None,
+        help="Also save the parameters of every command as JSONL, to be run in a single process by data_generation.script.generate_worker"
+    )
     
     args = parser.parse_args()
     
     commands = []
+    jobs = []
     
     for experiment_name in EXPERIMENT_FOLDERS.keys():
         print(f"Generating commands for {experiment_name}...")
@@ -223,6 +253,13 @@ def main():
                             force_scale
                         )
                         commands.append(command)
+                        jobs.append(generate_params(
+                            experiment_name,
+                            random_seed,
+                            damping_coef,
+                            initial_pos,
+                            force_scale
+                        ))
     
     print(f"\nGenerated {len(commands)} commands")
     
@@ -241,6 +278,16 @@ def main():
                 f.write(f"{cmd}\n\n")
         
         print(f"Output saved to: {output_file}")
+
+    if args.jobs_output is not None:
+        Path(args.jobs_output).parent.mkdir(parents=True, exist_ok=True)
+
+        with open(args.jobs_output, 'w') as f:
+            for job in jobs:
+                f.write(json.dumps(job) + "\n")
+
+        print(f"Jobs saved to: {args.jobs_output}")
+        print(f"Run them in a single process with: python -m data_generation.script.generate_worker --jobs {args.jobs_output}")
     
     # Execute in parallel if workers specified
     if args.workers is not None:
@@ -1,8 +1,8 @@
-from pydantic import BaseModel, Field, computed_field, field_validator
-from typing import List, Callable
+from pydantic import BaseModel, Field, computed_field, field_validator, model_validator
+from pydantic import PlainSerializer, PlainValidator, PrivateAttr, WithJsonSchema
+from typing import Annotated, List, Callable
 import hashlib
 import numpy as np
-from scipy.interpolate import CubicSpline
 
 class DataGenerationParams(BaseModel):
 
@@ -15,7 +15,7 @@ class DataGenerationParams(BaseModel):
     batch_number: int = 1
     """the number of batch to generate, this is used to generate more data mainly in implicit case (default 1)"""
     generation_type: str = "theorical"
-    """if true generate the data using mujoco otherwise use the theoritical generator (default true)"""
+    """the generator used : "mujoco" (python control callback), "mujoco-rollout" (native mujoco rollout), "theorical" (RK45 per batch), "theorical-vectorized" (RK4 on every batch at once) or "theorical-jax" (jitted RK4 on every batch at once) (default theorical)"""
     max_time: float = 10.0
     """the maximum time for the simulation"""
     initial_condition_randomness: List[float] = Field(default_factory=lambda: [0.0])
@@ -79,52 +79,76 @@ class RegressionResult(BaseModel):
     """the root mean square error on the acceleration prediction"""
     RMSE_validation_position: float|None = None
     """the root mean square error on the position prediction on the validation trajectory"""
+    validation_stop_reason: str|None = None
+    """why the validation rollout stopped before the end ("diverged" or "step_collapse", see DivergenceGuard), None if it went to the end"""
+    validation_end_time: float|None = None
+    """the time the validation rollout stopped at, None if it went to the end"""
+
+def _as_float_array(value) -> np.ndarray:
+    """Validate a series of floats as a 1-D float64 array, the values are converted at once instead of one by one."""
+    array = np.asarray(value, dtype=np.float64)
+    if array.ndim != 1:
+        raise ValueError(f"expected a 1-D series of floats, got an array of shape {array.shape}")
+    return array
+
+FloatArray = Annotated[
+    np.ndarray,
+    PlainValidator(_as_float_array),
+    PlainSerializer(lambda array: array.tolist(), return_type=List[float]),
+    WithJsonSchema({"type": "array", "items": {"type": "number"}}),
+]
+"""a series of floats, stored as a 1-D float64 ndarray and serialized as a list of floats (same json as List[float])"""
 
 class Series(BaseModel):
 
     class TimeSeries(BaseModel):
-        time: List[float]
+        time: FloatArray
 
         @classmethod
         def from_numpy(cls, data: np.ndarray,sample_number:int=None):
             flatten_time = data.flatten()
             if sample_number is not None:
                 sampling_index = np.linspace(0, len(flatten_time)-1, sample_number, dtype=int)
-                return cls(time=flatten_time[sampling_index].tolist())
+                return cls(time=flatten_time[sampling_index])
             else:
-                return cls(time=flatten_time.tolist())
+                return cls(time=flatten_time)
 
     class DataSeries(BaseModel):
 
         class CordinateSeries(BaseModel):
             coordinate_number: int
-            data: List[float]
+            data: FloatArray
 
         series: List[CordinateSeries]
 
+        # contiguous (samples, coordinates) buffer holding the data of every coordinate
+        _values: np.ndarray|None = PrivateAttr(default=None)
+
+        @model_validator(mode="after")
+        def gather_coordinates(self):
+            """Copy the coordinates in one contiguous (samples, coordinates) buffer, each data becoming a column of it."""
+            if self.series and len({len(coord.data) for coord in self.series}) == 1:
+                buffer = np.column_stack([coord.data for coord in self.series])
+                for i, coord in enumerate(self.series):
+                    coord.data = buffer[:, i]
+                self._values = buffer
+            return self
+
         def get_numpy_series(self)-> np.ndarray:
-            coord_data = []
-            for coord in self.series:
-                coord_data.append(coord.data)
-            return np.column_stack(coord_data)
+            """The (samples, coordinates) array of the series, the buffer of the model itself (not a copy)."""
+            if self._values is None:
+                return np.column_stack([coord.data for coord in self.series])
+            return self._values
 
         @classmethod
         def from_numpy(cls, data: np.ndarray,sample_number:int=None):
-            series = []
-            for i in range(data.shape[1]):
-                
-                if sample_number is not None:
-                    sampling_index = np.linspace(0, data.shape[0]-1, sample_number, dtype=int) 
-                    series.append(cls.CordinateSeries(
-                        coordinate_number=i,
-                        data=data[sampling_index,i].tolist()
-                    ))
-                else:
-                    series.append(cls.CordinateSeries(
-                        coordinate_number=i,
-                        data=data[:,i].tolist()
-                    ))
-            return cls(series=series)
+            if sample_number is not None:
+                sampling_index = np.linspace(0, data.shape[0]-1, sample_number, dtype=int)
+                data = data[sampling_index]
+            return cls(series=[
+                cls.CordinateSeries(coordinate_number=i, data=data[:,i])
+                for i in range(data.shape[1])
+            ])
 
     time: TimeSeries
     qpos: DataSeries
@@ -134,6 +158,20 @@ class Series(BaseModel):
     sample_number: int
     """the number of sample in the trajectory"""
 
+class SeriesReference(BaseModel):
+    """the location of the series of a trajectory in the binary sidecar of the experiment (see experiment_io.py)"""
+
+    offset: int
+    """the offset in bytes of the first value in the sidecar"""
+    length: int
+    """the number of time samples"""
+    coordinates: int
+    """the number of coordinates of qpos, qvel, qacc and forces"""
+    sample_number: int
+    """the sample_number of the series"""
+    dtype: str = "<f8"
+    """the numpy dtype of the stored values"""
+
 class Solution(BaseModel):
     mode_solution: str
     """the mode used to generate the solution (mixed, explicit, implicit)"""
@@ -157,6 +195,34 @@ class TrajectoryData(BaseModel):
     solutions : List[Solution]|None = None
     reference:bool = False
     regression_result: RegressionResult|None = None
+    series_reference: SeriesReference|None = None
+    """where the series is stored in the sidecar, only set in the json of an experiment saved with a sidecar"""
+
+    # the parser of a series left unparsed, see defer_series
+    _series_loader: Callable[[], Series|None]|None = PrivateAttr(default=None)
+
+    def defer_series(self, loader: Callable[[], Series|None]) -> None:
+        """Leave the series unparsed, `series` stays None until load_series calls `loader` (experiment_io.load_experiment(series="lazy"))."""
+        self._series_loader = loader
+        self.series = None
+
+    def load_series(self) -> Series|None:
+        """Parse the deferred series if any (see defer_series) and return the series."""
+        if self._series_loader is not None:
+            loader = self._series_loader
+            self._series_loader = None
+            self.series = loader()
+        return self.series
+
+    # a deferred series is parsed before dumping, a trajectory is always dumped with its series
+
+    def model_dump(self, **kwargs):
+        self.load_series()
+        return super().model_dump(**kwargs)
+
+    def model_dump_json(self, **kwargs):
+        self.load_series()
+        return super().model_dump_json(**kwargs)
 
     def get_solution_mode(self)-> List[str]:
         return [sol.mode_solution for sol in self.solutions]
@@ -180,6 +246,9 @@ class TrajectoryData(BaseModel):
     ):
         
         if reference_time is not None:
+            # scipy is only needed here, keep it out of the import of the dataclasses
+            from scipy.interpolate import CubicSpline
+
             # Interpolate all data onto reference_time
             time_flat = np.array(time).flatten()
             ref_time_flat = np.array( reference_time).flatten()
@@ -250,6 +319,25 @@ class Experiment(BaseModel):
     """the data generation parameters used to generate the data"""
     data_path: str
     """the path to the generated data"""
+    series_path: str|None = None
+    """the binary sidecar holding the series of the trajectories, relative to the json folder (default None, series inline in the json)"""
+
+    # set when loaded without the series (experiment_io.load_experiment(series="headers")), such an experiment cannot be saved
+    _headers_only: bool = PrivateAttr(default=False)
+
+    def load_series(self) -> None:
+        """Parse every deferred series of the trajectories (see TrajectoryData.defer_series)."""
+        for group in (self.data.validation_group, self.data.training_group):
+            for trajectory in group.trajectories:
+                trajectory.load_series()
+
+    def model_dump(self, **kwargs):
+        self.load_series()
+        return super().model_dump(**kwargs)
+
+    def model_dump_json(self, **kwargs):
+        self.load_series()
+        return super().model_dump_json(**kwargs)
 
     class ExperimentData(BaseModel):
 
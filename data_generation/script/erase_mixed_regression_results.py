@@ -2,10 +2,12 @@
 """
 
 import argparse
-import json
 import os
 from typing import Dict, Any, List, Tuple
 
+from data_generation.script.dataclass import Experiment,TrajectoryData
+from data_generation.script.experiment_io import load_experiment,update_experiment
+
 RESULTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "..", "results")
 RESULTS_DIR = os.path.normpath(RESULTS_DIR)
 
@@ -20,76 +22,62 @@ def is_mixed_regression(parameters: Dict[str, Any]) -> bool:
     return paradigm == "mixed" and reg_type == "mixed"
 
 
-def process_trajectories(trajectories: List[Dict[str, Any]]) -> Tuple[int, int]:
-    """Remove `regression_result` from trajectories where parameters are mixed.
+def process_trajectories(trajectories: List[TrajectoryData]) -> Tuple[int, int]:
+    """Remove the trajectories whose regression parameters are mixed, in place.
 
     Returns (checked_count, removed_count).
     """
     checked = 0
-    removed = 0
     erase_index = []
     for i,traj in enumerate(trajectories):
-        rr = traj.get("regression_result")
+        rr = traj.regression_result
         if rr is None:
             continue
         checked += 1
-        params = rr.get("regression_parameters", {}) if isinstance(rr, dict) else {}
-        if is_mixed_regression(params):
+        if is_mixed_regression(rr.regression_parameters.model_dump()):
             # Erase the regression result completely
             erase_index.append(i)
-            removed += 1
 
     for i in reversed(erase_index):
         del trajectories[i]
-    
-    return checked, removed
+
+    return checked, len(erase_index)
 
 
 def process_file(path: str, dry_run: bool, backup: bool) -> Tuple[int, int, bool]:
-    """Process a single JSON file. Returns (checked, removed, modified)."""
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-    except Exception as e:
-        print(f"[WARN] Skipping {path}: {e}")
-        return 0, 0, False
-
-    checked_total = 0
-    removed_total = 0
-
-    data_obj = data.get("data", {})
-
-    # validation group
-    vg = data_obj.get("validation_group")
-    if isinstance(vg, dict) and isinstance(vg.get("trajectories"), list):
-        c, r = process_trajectories(vg["trajectories"])
-        checked_total += c
-        removed_total += r
-
-    # training group
-    tg = data_obj.get("training_group")
-    if isinstance(tg, dict) and isinstance(tg.get("trajectories"), list):
-        c, r = process_trajectories(tg["trajectories"])
-        checked_total += c
-        removed_total += r
-
-    modified = removed_total > 0
-    if modified and not dry_run:
-        if backup:
+    """Process a single experiment json. Returns (checked, removed, modified).
+
+    The experiment goes through experiment_io : the trajectory records of align_data are merged before the erase
+    and written back in the json (update_experiment), an erased regression can not come back from its record.
+    """
+    counts = {"checked": 0, "removed": 0}
+
+    def erase(experiment: Experiment) -> bool:
+        if backup and not dry_run:
             try:
                 with open(path + ".bak", "w", encoding="utf-8") as bf:
-                    json.dump(data, bf, indent=4)
+                    bf.write(experiment.model_dump_json(indent=4))
             except Exception as e:
                 print(f"[WARN] Could not write backup for {path}: {e}")
-        # Write updated data
-        try:
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=4)
-        except Exception as e:
-            print(f"[ERROR] Failed to write changes to {path}: {e}")
-            modified = False
 
-    return checked_total, removed_total, modified
+        for group in (experiment.data.validation_group, experiment.data.training_group):
+            c, r = process_trajectories(group.trajectories)
+            counts["checked"] += c
+            counts["removed"] += r
+
+        return counts["removed"] > 0 and not dry_run
+
+    try:
+        if dry_run:
+            erase(load_experiment(path, series="headers"))
+            return counts["checked"], counts["removed"], False
+
+        modified = update_experiment(path, erase)
+    except Exception as e:
+        print(f"[WARN] Skipping {path}: {e}")
+        return counts["checked"], 0, False
+
+    return counts["checked"], counts["removed"], modified
 
 
 def find_result_files(root: str) -> List[str]:
@@ -97,7 +85,8 @@ def find_result_files(root: str) -> List[str]:
     if not os.path.isdir(root):
         return files
     for name in os.listdir(root):
-        if not name.endswith(".json"):
+        # the manifest of the site lives in the same folder
+        if not name.endswith(".json") or name == "files.json":
             continue
         files.append(os.path.join(root, name))
     return files
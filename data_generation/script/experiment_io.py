@@ -0,0 +1,454 @@
+"""
+Reading and writing of the experiment json of results/.
+
+An experiment is saved either inline (every series as json float lists, the format read by the site) or with a binary
+sidecar : the series of every trajectory are packed in `{UID}.series.bin` next to a slim json that only keeps the
+parameters, the solutions and the regression results, each trajectory pointing to its series with a SeriesReference.
+
+Layout of a series in the sidecar, starting at `offset` : the time (length values) then qpos, qvel, qacc and forces,
+each as `coordinates` rows of `length` values.
+
+load_experiment reads both formats and always return the series inline, the consumers do not need to know the format.
+Most consumers only need the parameters and the regression results : with series="lazy" a series is only parsed when
+`trajectory.load_series()` is called, and with series="headers" the series are not loaded at all.
+
+The trajectories of the regressions are not written in the experiment json : align_data saves each of them in its own
+record `{UID}.trajectories/{name}.json` (save_trajectory), load_experiment merges the records in the validation group,
+and compact_experiment writes them back in the experiment json (e.g. before packaging results/ for the site).
+
+Several align_data processes can work on the same experiment : every writer holds the advisory lock `{UID}.lock`
+(experiment_lock), the read-modify-write of the experiment json goes through update_experiment, and load_experiment
+holds the lock shared while it merges the records, so that it never sees a compaction half done.
+"""
+import contextlib
+import fcntl
+import functools
+import json
+import logging
+import os
+import re
+
+import numpy as np
+
+from typing import List
+
+from data_generation.script.dataclass import Experiment,Series,SeriesReference,TrajectoryData
+
+logger = logging.getLogger(__name__)
+
+SERIES_FIELDS = ("qpos", "qvel", "qacc", "forces")
+
+GROUPS = ("training_group", "validation_group")
+
+SERIES_MODES = ("full", "lazy", "headers")
+
+# The series of a TrajectoryData is the only "series" key holding an object, the series of a DataSeries holds a list
+_SERIES_KEY = b'"series"'
+_OBJECT_VALUE = re.compile(rb"\s*:\s*\{")
+
+# The fields of the sidecar format, left out of the inline json so that it stays the same as before the sidecar
+INLINE_EXCLUDE = {
+    "series_path": True,
+    "data": {group: {"trajectories": {"__all__": {"series_reference"}}} for group in GROUPS},
+}
+
+def sidecar_path(json_path: str) -> str:
+    """Path of the sidecar of an experiment json (results/{UID}.json -> results/{UID}.series.bin)."""
+    return os.path.splitext(json_path)[0] + ".series.bin"
+
+def pack_series(series: Series, dtype: str = "<f8") -> tuple:
+    """
+    Pack a series in the sidecar layout.
+
+    Returns:
+        np.ndarray: the packed values (flat).
+        int: the number of time samples.
+        int: the number of coordinates.
+    """
+    time = series.time.time
+    length = len(time)
+    coordinates = len(series.qpos.series)
+
+    values = [time]
+    for field in SERIES_FIELDS:
+        data = getattr(series, field).get_numpy_series()
+        if data.shape != (length, coordinates):
+            raise ValueError(f"{field} has shape {data.shape}, expected {(length, coordinates)}")
+        # (samples, coordinates) -> rows of coordinates
+        values.append(data.T.ravel())
+
+    return np.concatenate(values).astype(dtype, copy=False), length, coordinates
+
+def unpack_series(buffer, reference: SeriesReference) -> Series:
+    """Rebuild the Series of a SeriesReference from the content of the sidecar."""
+    length = reference.length
+    coordinates = reference.coordinates
+
+    values = np.frombuffer(
+        buffer,
+        dtype=reference.dtype,
+        count=length * (1 + len(SERIES_FIELDS) * coordinates),
+        offset=reference.offset,
+    ).astype(np.float64)
+
+    time = values[:length]
+    data = values[length:].reshape(len(SERIES_FIELDS), coordinates, length)
+
+    return Series(
+        time=Series.TimeSeries(time=time),
+        qpos=Series.DataSeries.from_numpy(data[0].T),
+        qvel=Series.DataSeries.from_numpy(data[1].T),
+        qacc=Series.DataSeries.from_numpy(data[2].T),
+        forces=Series.DataSeries.from_numpy(data[3].T),
+        sample_number=reference.sample_number,
+    )
+
+def _closing_brace(text: bytes, start: int) -> int:
+    """Index after the brace closing the object opened at `start`."""
+    depth = 0
+    position = start
+    next_open = text.find(b"{", position)
+    next_close = text.find(b"}", position)
+
+    while next_close != -1:
+        if next_open != -1 and next_open < next_close:
+            depth += 1
+            position = next_open + 1
+            next_open = text.find(b"{", position)
+        else:
+            depth -= 1
+            position = next_close + 1
+            if depth == 0:
+                return position
+            next_close = text.find(b"}", position)
+
+    raise ValueError("Unbalanced series object in the experiment json")
+
+def split_series(text: bytes) -> tuple:
+    """
+    Cut the series objects of the trajectories out of an inline experiment json, without parsing the values.
+
+    Each series object is replaced by its index in the returned spans. Only the braces are counted to find the end of an
+    object (a Series does not hold any string), with bytes.find so that the float lists are skipped at memchr speed.
+
+    Returns:
+        bytes: the json without the series.
+        list: the (start, end) span of each series in `text`.
+    """
+    pieces = []
+    spans = []
+    position = 0
+    search = 0
+
+    while (key := text.find(_SERIES_KEY, search)) != -1:
+        search = key + len(_SERIES_KEY)
+
+        # an escaped key is inside a string, a null series has nothing to cut
+        match = _OBJECT_VALUE.match(text, search)
+        if (key > 0 and text[key - 1] == ord("\\")) or match is None:
+            continue
+
+        start = match.end() - 1
+        end = _closing_brace(text, start)
+
+        pieces.append(text[position:start])
+        pieces.append(str(len(spans)).encode())
+        spans.append((start, end))
+        position = search = end
+
+    pieces.append(text[position:])
+    return b"".join(pieces), spans
+
+def _write(path: str, content: bytes|str):
+    """Write a file under a temporary name then rename it."""
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb" if isinstance(content, bytes) else "w") as f:
+        f.write(content)
+    os.replace(temporary_path, path)
+
+def save_experiment(experiment: Experiment, json_path: str, sidecar: bool|None = None, dtype: str = "<f8") -> str:
+    """
+    Save an experiment json, inline or with a binary sidecar.
+
+    The experiment given is not modified, it keeps its series inline.
+
+    Args:
+        experiment (Experiment): the experiment to save.
+        json_path (str): the json file (e.g. results/{UID}.json).
+        sidecar (bool): true for a binary sidecar, false for inline series (default None, keep the format of the experiment).
+        dtype (str): the numpy dtype of the values in the sidecar, "<f4" halves the size but is not lossless (default "<f8").
+
+    Returns:
+        str: the json file written.
+    """
+    if experiment._headers_only:
+        raise ValueError("The experiment has been loaded without its series (series=\"headers\"), it cannot be saved")
+
+    if sidecar is None:
+        sidecar = experiment.series_path is not None
+
+    # the series deferred by load_experiment(series="lazy") are written with the others
+    experiment.load_series()
+
+    if not sidecar:
+        _write(json_path, experiment.model_dump_json(indent=4, exclude=INLINE_EXCLUDE))
+
+        # the series are back in the json, the previous sidecar is stale
+        if os.path.exists(sidecar_path(json_path)):
+            os.remove(sidecar_path(json_path))
+
+        return json_path
+
+    chunks = []
+    offset = 0
+    groups = {}
+
+    for group_name in GROUPS:
+        group = getattr(experiment.data, group_name)
+        trajectories = []
+
+        for trajectory in group.trajectories:
+            if trajectory.series is None:
+                trajectories.append(trajectory)
+                continue
+
+            values, length, coordinates = pack_series(trajectory.series, dtype)
+            reference = SeriesReference(
+                offset=offset,
+                length=length,
+                coordinates=coordinates,
+                sample_number=trajectory.series.sample_number,
+                dtype=np.dtype(dtype).str,
+            )
+            chunks.append(values.tobytes())
+            offset += values.nbytes
+
+            trajectories.append(trajectory.model_copy(update={"series": None, "series_reference": reference}))
+
+        groups[group_name] = group.model_copy(update={"trajectories": trajectories})
+
+    slim_experiment = experiment.model_copy(update={
+        "series_path": os.path.basename(sidecar_path(json_path)),
+        "data": experiment.data.model_copy(update=groups),
+    })
+
+    # the sidecar first, the json written after always points to complete series
+    _write(sidecar_path(json_path), b"".join(chunks))
+    _write(json_path, slim_experiment.model_dump_json(indent=4))
+
+    return json_path
+
+def lock_path(json_path: str) -> str:
+    """Advisory lock file of an experiment (results/{UID}.json -> results/{UID}.lock)."""
+    return os.path.splitext(json_path)[0] + ".lock"
+
+@contextlib.contextmanager
+def experiment_lock(json_path: str, shared: bool = False):
+    """
+    Hold the advisory lock of an experiment, exclusive for the writers and shared for the readers.
+
+    The lock file is kept : removing it would let two writers lock two different files.
+    """
+    with open(lock_path(json_path), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def update_experiment(json_path: str, update) -> bool:
+    """
+    Read, modify and write an experiment json under its lock, in the format it is stored in.
+
+    The experiment is read with its trajectory records merged, they are written in the json and removed with it
+    (as compact_experiment), no trajectory is stored both in the json and in a record.
+
+    Args:
+        json_path (str): the json file (e.g. results/{UID}.json).
+        update (Callable[[Experiment], bool]): modifies the experiment in place, returns false if there was nothing to change.
+
+    Returns:
+        bool: true if the experiment json has been written.
+    """
+    with experiment_lock(json_path):
+        experiment = load_experiment(json_path, locked=True)
+        if not update(experiment):
+            return False
+        save_experiment(experiment, json_path)
+        discard_trajectory_records(json_path)
+        return True
+
+def records_dir(json_path: str) -> str:
+    """Folder of the trajectory records of an experiment (results/{UID}.json -> results/{UID}.trajectories)."""
+    return os.path.splitext(json_path)[0] + ".trajectories"
+
+def trajectory_records(json_path: str) -> list:
+    """
+    The trajectory records of an experiment, in the order they have been written.
+
+    Returns:
+        list: the (path, mtime_ns) of each record.
+    """
+    folder = records_dir(json_path)
+    if not os.path.isdir(folder):
+        return []
+
+    records = []
+    for entry in os.scandir(folder):
+        if entry.name.endswith(".json"):
+            records.append((entry.path, entry.stat().st_mtime_ns))
+
+    return sorted(records, key=lambda record: (record[1], record[0]))
+
+def save_trajectory(json_path: str, trajectory: TrajectoryData) -> str:
+    """
+    Add or replace a trajectory of the validation group of an experiment, without rewriting the experiment json.
+
+    Returns:
+        str: the record written.
+    """
+    return save_trajectories(json_path, [trajectory])[0]
+
+def save_trajectories(json_path: str, trajectories: List[TrajectoryData]) -> List[str]:
+    """
+    Add or replace several trajectories of the validation group of an experiment, under one lock.
+
+    Returns:
+        List[str]: the records written.
+    """
+    folder = records_dir(json_path)
+    contents = {
+        os.path.join(folder, f"{trajectory.name}.json"): trajectory.model_dump_json(indent=4)
+        for trajectory in trajectories
+    }
+    with experiment_lock(json_path):
+        os.makedirs(folder, exist_ok=True)
+        for record_path, content in contents.items():
+            _write(record_path, content)
+    return list(contents)
+
+def discard_trajectory_records(json_path: str) -> None:
+    """Remove the trajectory records of an experiment (its data has been generated again), the caller holds the lock."""
+    for record_path, _ in trajectory_records(json_path):
+        os.remove(record_path)
+    if os.path.isdir(records_dir(json_path)):
+        os.rmdir(records_dir(json_path))
+
+def compact_experiment(json_path: str) -> int:
+    """
+    Write the trajectory records of an experiment in its json, and remove them.
+
+    Returns:
+        int: the number of records merged.
+    """
+    if not trajectory_records(json_path):
+        return 0
+
+    with experiment_lock(json_path):
+        records = trajectory_records(json_path)
+        save_experiment(load_experiment(json_path, locked=True), json_path)
+        discard_trajectory_records(json_path)
+
+    return len(records)
+
+def _load_trajectory(text: bytes, series: str) -> TrajectoryData:
+    """Load a trajectory record, same series modes as load_experiment."""
+    if series == "full":
+        return TrajectoryData.model_validate_json(text)
+
+    slim_text, spans = split_series(text)
+    data = json.loads(slim_text)
+    data["series"] = None
+    trajectory = TrajectoryData.model_validate(data)
+
+    if spans and series == "lazy":
+        start, end = spans[0]
+        trajectory.defer_series(lambda: Series.model_validate_json(text[start:end]))
+
+    return trajectory
+
+def load_experiment(json_path: str, series: str = "full", locked: bool = False) -> Experiment:
+    """
+    Load an experiment json, inline or with a binary sidecar, with its trajectory records.
+
+    The series of the sidecar are put back inline, `series_path` is kept so that save_experiment keeps the format.
+    A record replaces the trajectory of the same name and is put at the end of the validation group, as align_data did
+    when it rewrote the experiment json.
+
+    Args:
+        json_path (str): the json file (e.g. results/{UID}.json).
+        series (str): "full" parse every series, "lazy" parse a series when `trajectory.load_series()` is called,
+            "headers" leave every series to None, such an experiment cannot be saved (default full).
+        locked (bool): the caller already holds the lock of the experiment (default false).
+
+    Returns:
+        Experiment: the experiment.
+    """
+    if series not in SERIES_MODES:
+        raise ValueError(f"Unknown series mode {series}, expected one of {SERIES_MODES}")
+
+    # without records there is nothing to merge, and results/ can be read without creating the lock file
+    if not locked and os.path.isdir(records_dir(json_path)):
+        with experiment_lock(json_path, shared=True):
+            return load_experiment(json_path, series, locked=True)
+
+    experiment = _load_experiment_file(json_path, series)
+
+    validation_group = experiment.data.validation_group
+    for record_path, _ in trajectory_records(json_path):
+        with open(record_path, "rb") as f:
+            trajectory = _load_trajectory(f.read(), series)
+        validation_group.del_trajectory_by_name(trajectory.name)
+        validation_group.trajectories.append(trajectory)
+
+    return experiment
+
+def _load_experiment_file(json_path: str, series: str) -> Experiment:
+    """Load the experiment json alone, see load_experiment."""
+    # bytes, decoding the whole file costs more than parsing the headers
+    with open(json_path, "rb") as f:
+        text = f.read()
+
+    deferred = []
+
+    if series == "full":
+        experiment = Experiment.model_validate_json(text)
+    else:
+        slim_text, spans = split_series(text)
+        data = json.loads(slim_text)
+
+        for group_name in GROUPS:
+            for index, trajectory in enumerate(data["data"][group_name]["trajectories"]):
+                if isinstance(trajectory.get("series"), int):
+                    deferred.append((group_name, index, spans[trajectory["series"]]))
+                    trajectory["series"] = None
+
+        experiment = Experiment.model_validate(data)
+
+    if series == "headers":
+        experiment._headers_only = True
+        return experiment
+
+    for group_name, index, (start, end) in deferred:
+        trajectory = getattr(experiment.data, group_name).trajectories[index]
+        trajectory.defer_series(lambda start=start, end=end: Series.model_validate_json(text[start:end]))
+
+    if experiment.series_path is None:
+        return experiment
+
+    @functools.cache
+    def read_sidecar() -> bytes:
+        with open(os.path.join(os.path.dirname(json_path), experiment.series_path), "rb") as f:
+            return f.read()
+
+    for group_name in GROUPS:
+        for trajectory in getattr(experiment.data, group_name).trajectories:
+            if trajectory.series_reference is not None:
+                reference = trajectory.series_reference
+                trajectory.series_reference = None
+                if series == "full":
+                    trajectory.series = unpack_series(read_sidecar(), reference)
+                else:
+                    trajectory.defer_series(lambda reference=reference: unpack_series(read_sidecar(), reference))
+
+    return experiment
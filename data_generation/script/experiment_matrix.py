@@ -0,0 +1,247 @@
+"""
+Memoization of the expanded catalog and of the experiment matrix of the regressions.
+
+xlsindy.simulation.regression_explicite, regression_implicite and regression_mixed expand the catalog, lambdify every
+function of the expanded catalog and evaluate them on the training data at each call (about 5 s for cart_pole, the
+regression itself is a fraction of it). In a sweep the catalog of a paradigm is the same for every regression, and the
+sampled training data only depends on the noise level, the random seed and the data ratio : regressions that only differ
+by their optimization function evaluate the same matrix.
+
+ExperimentMatrixCache memoizes the three steps : the expanded catalog (keyed on the catalog labels, as the acceleration
+function cache), its lambdified functions, and the evaluated matrix (keyed on the catalog and a hash of the data).
+The xlsindy regressions are run unchanged inside `cached_experiment_matrix`, which gives them a catalog with a memoized
+expansion and routes their experiment matrix through the cache.
+
+xlsindy.simulation has no parameter for a precomputed matrix, the regressions build it with the module functions
+create_experiment_matrix and jax_create_experiment_matrix (py-xl-sindy 2.2.1, ROUTED_FUNCTIONS). While a context is
+open, these two module attributes are replaced by routing functions : a call goes to the cache only for the catalog of
+the context opened by the calling thread, every other call (another catalog, another thread) goes to xlsindy unchanged.
+The originals are restored when the last open context exits, outside of a context xlsindy.simulation is untouched.
+If a version of xlsindy no longer has these attributes the context raises instead of silently skipping the cache. The
+context is not re-entrant and the cache itself is not thread safe : one regression at a time per process, as align_data
+and align_batch.
+"""
+import contextlib
+import hashlib
+import logging
+import threading
+import numpy as np
+
+from collections import OrderedDict
+from typing import Callable, List
+
+import sympy as sp
+import xlsindy
+import xlsindy.simulation
+
+logger = logging.getLogger(__name__)
+
+class CatalogEntry:
+    """The expanded catalog of a CatalogRepartition and its lambdified functions (built on the first matrix)."""
+
+    def __init__(self, key: str, expanded: np.ndarray):
+        self.key = key
+        self.expanded = expanded
+        self.functions = {}
+
+    def lambdified(self, symbols_matrix: np.ndarray) -> List[List[Callable]]:
+        """The functions of the expanded catalog, functions[i][j] is the function j of the coordinate i (as xlsindy)."""
+        symbols_key = str(symbols_matrix)
+        if symbols_key not in self.functions:
+            self.functions[symbols_key] = [
+                [sp.lambdify([symbols_matrix], expression, modules="numpy") for expression in self.expanded[:, i]]
+                for i in range(self.expanded.shape[1])
+            ]
+        return self.functions[symbols_key]
+
+class MemoizedCatalog:
+    """CatalogRepartition whose expand_catalog returns the memoized expansion, everything else is the catalog."""
+
+    def __init__(self, catalog: xlsindy.catalog.CatalogRepartition, entry: CatalogEntry):
+        self._catalog = catalog
+        self._entry = entry
+
+    def expand_catalog(self) -> np.ndarray:
+        return self._entry.expanded
+
+    def __getattr__(self, name):
+        return getattr(self._catalog, name)
+
+class ExperimentMatrixCache:
+    """
+    LRU memo of the expanded catalogs and of the experiment matrices.
+
+    Args:
+        max_size (int): number of catalogs (and of matrices) kept in memory (default 8).
+    """
+
+    def __init__(self, max_size: int = 8):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._catalogs = OrderedDict()
+        self._matrices = OrderedDict()
+
+    @staticmethod
+    def catalog_key(catalog: xlsindy.catalog.CatalogRepartition) -> str:
+        """Hash of the catalog labels."""
+        return hashlib.md5("\n".join(catalog.label()).encode()).hexdigest()
+
+    @staticmethod
+    def matrix_key(entry: CatalogEntry, symbols_matrix: np.ndarray, *values: np.ndarray|None) -> str:
+        """Hash of the catalog, the symbols and the data (a missing array is hashed as such)."""
+        key = hashlib.md5(entry.key.encode())
+        key.update(str(symbols_matrix).encode())
+        for array in values:
+            if array is None:
+                key.update(b"None")
+            else:
+                array = np.ascontiguousarray(array, dtype=np.float64)
+                key.update(str(array.shape).encode())
+                key.update(array.tobytes())
+        return key.hexdigest()
+
+    def _remember(self, store: OrderedDict, key, value):
+        store[key] = value
+        store.move_to_end(key)
+        while len(store) > self.max_size:
+            store.popitem(last=False)
+
+    def catalog(self, catalog: xlsindy.catalog.CatalogRepartition) -> CatalogEntry:
+        """Memoized expansion of a catalog."""
+        key = self.catalog_key(catalog)
+
+        if key in self._catalogs:
+            self._catalogs.move_to_end(key)
+            return self._catalogs[key]
+
+        entry = CatalogEntry(key, catalog.expand_catalog())
+        self._remember(self._catalogs, key, entry)
+        return entry
+
+    def matrix(
+        self,
+        entry: CatalogEntry,
+        num_coords: int,
+        symbols_matrix: np.ndarray,
+        position_values: np.ndarray,
+        velocity_values: np.ndarray,
+        acceleration_values: np.ndarray,
+        forces_values: np.ndarray|None = None,
+    ) -> np.ndarray:
+        """
+        Memoized experiment matrix, same values as xlsindy.euler_lagrange.jax_create_experiment_matrix
+        (create_experiment_matrix if `forces_values` is None).
+
+        Returns:
+            np.ndarray: a copy of the experiment matrix (sampled_steps * num_coords, catalog_length).
+        """
+        key = self.matrix_key(entry, symbols_matrix, position_values, velocity_values, acceleration_values, forces_values)
+
+        if key in self._matrices:
+            self._matrices.move_to_end(key)
+            self.hits += 1
+            return self._matrices[key].copy()
+
+        self.misses += 1
+
+        sampled_steps = len(position_values)
+        catalog_length = entry.expanded.shape[0]
+
+        experiment_matrix = np.zeros((sampled_steps * num_coords, catalog_length))
+
+        q_matrix = np.zeros((symbols_matrix.shape[0], symbols_matrix.shape[1], sampled_steps))
+        if forces_values is not None:
+            q_matrix[0, :, :] = np.transpose(forces_values)
+        q_matrix[1, :, :] = np.transpose(position_values)
+        q_matrix[2, :, :] = np.transpose(velocity_values)
+        q_matrix[3, :, :] = np.transpose(acceleration_values)
+
+        functions = entry.lambdified(symbols_matrix)
+
+        for i in range(num_coords):
+            for j, func in enumerate(functions[i]):
+                experiment_matrix[i * sampled_steps : (i + 1) * sampled_steps, j] = func(q_matrix)
+
+        self._remember(self._matrices, key, experiment_matrix)
+        return experiment_matrix.copy()
+
+experiment_matrix_cache = ExperimentMatrixCache()
+"""the process wide cache used by align_data and align_batch"""
+
+def configure_experiment_matrix_cache(max_size: int|None = None):
+    """Set the size of the process wide experiment matrix cache."""
+    if max_size is not None:
+        experiment_matrix_cache.max_size = max_size
+
+def expanded_catalog(catalog: xlsindy.catalog.CatalogRepartition) -> np.ndarray:
+    """Memoized catalog.expand_catalog(), the array is shared and should not be modified."""
+    return experiment_matrix_cache.catalog(catalog).expanded
+
+ROUTED_FUNCTIONS = ("create_experiment_matrix", "jax_create_experiment_matrix")
+"""the functions of xlsindy.simulation that build the experiment matrix of the regressions (py-xl-sindy 2.2.1)"""
+
+# the entry of the context opened by each thread (see cached_experiment_matrix)
+_active = threading.local()
+
+# the original xlsindy functions and the number of open contexts, while the routing is installed
+_routing = {"originals": None, "open": 0}
+_routing_lock = threading.Lock()
+
+def _routed(create_matrix: Callable) -> Callable:
+    """The xlsindy matrix function `create_matrix`, through the cache for the catalog of the open context."""
+
+    def routed_create_matrix(num_coords, catalogs, symbol_matrix, *values):
+        entry = getattr(_active, "entry", None)
+        if entry is None or catalogs is not entry.expanded:
+            return create_matrix(num_coords, catalogs, symbol_matrix, *values)
+        return experiment_matrix_cache.matrix(entry, num_coords, symbol_matrix, *values)
+
+    return routed_create_matrix
+
+def _open_routing():
+    """Install the routed matrix functions in xlsindy.simulation (on the first open context)."""
+    with _routing_lock:
+        if _routing["open"] == 0:
+            missing = [name for name in ROUTED_FUNCTIONS if not hasattr(xlsindy.simulation, name)]
+            if missing:
+                raise AttributeError(f"xlsindy.simulation has no {missing}, the experiment matrix cannot be cached with this xlsindy version")
+
+            _routing["originals"] = {name: getattr(xlsindy.simulation, name) for name in ROUTED_FUNCTIONS}
+            for name, original in _routing["originals"].items():
+                setattr(xlsindy.simulation, name, _routed(original))
+        _routing["open"] += 1
+
+def _close_routing():
+    """Restore the original matrix functions of xlsindy.simulation (on the last closed context)."""
+    with _routing_lock:
+        _routing["open"] -= 1
+        if _routing["open"] == 0:
+            for name, original in _routing["originals"].items():
+                setattr(xlsindy.simulation, name, original)
+            _routing["originals"] = None
+
+@contextlib.contextmanager
+def cached_experiment_matrix(catalog: xlsindy.catalog.CatalogRepartition):
+    """
+    Run the xlsindy regressions with the memoized expansion and experiment matrix of a catalog.
+
+    Yields the catalog to give to the regression as `catalog_repartition`. While the context is open, the experiment
+    matrices that xlsindy.simulation builds from this catalog in the calling thread go through the process wide cache,
+    the others are built by xlsindy as usual. Single threaded use only, the context cannot be nested.
+
+    exemple:
+        with cached_experiment_matrix(full_catalog) as catalog:
+            solution, exp_matrix = xlsindy.simulation.regression_explicite(..., catalog_repartition=catalog, ...)
+    """
+    assert getattr(_active, "entry", None) is None, "cached_experiment_matrix is not re-entrant"
+
+    entry = experiment_matrix_cache.catalog(catalog)
+
+    _open_routing()
+    _active.entry = entry
+    try:
+        yield MemoizedCatalog(catalog, entry)
+    finally:
+        _active.entry = None
+        _close_routing()
@@ -9,26 +9,24 @@ import tyro
 
 import sys
 import os 
-import importlib
-
-import mujoco
-
-import numpy as np
-import xlsindy
+import shutil
 
 import pickle
 
 import json
 import hashlib
 
-from xlsindy.logger import setup_logger
-from pydantic import BaseModel
+import numpy as np
 
-from tqdm import tqdm
+from pydantic import BaseModel
 
-from data_generation.script.generate_trajectory import generate_theoretical_trajectory,generate_mujoco_trajectory
+# Only light modules at the top, the skip path and --help should not pay for xlsindy, mujoco and jax.
+# The generation backends are imported in generate_data.
 
 from data_generation.script.dataclass import DataGenerationParams,Experiment,TrajectoryData
+from data_generation.script.experiment_io import discard_trajectory_records,experiment_lock,save_experiment
+from data_generation.script.simulation_data import load_spooled_batches,save_simulation_data,spool_batches
+from data_generation.script.util import import_xlsindy_gen,setup_logger
 
 logger = setup_logger(__name__)
 
@@ -37,20 +35,54 @@ class Args:
     params: DataGenerationParams
     skip_already_done: bool = True
     """if true, skip the generation if the data already exists (default true)"""
-
-if __name__ == "__main__":
-
-    args = tyro.cli(Args)
-
-    # Check if data already exists and skip if requested
-    if args.skip_already_done:
-        json_filename = f"results/{args.params.UID}.json"
-        if os.path.exists(json_filename):
-            logger.info(f"Data already exists for UID {args.params.UID}, skipping generation")
-            sys.exit(0)
-    
-    # Use args.params for the actual parameters
-    args = args.params
+    generation_workers: int = 1
+    """the number of batches simulated concurrently in mujoco generation, one MjData per thread (default 1)"""
+    acceleration_cache_dir: str|None = None
+    """if set, the folder where the symbolic acceleration systems are persisted and shared between runs (default in memory only)"""
+    mujoco_model_cache_dir: str|None = None
+    """if set, the folder where the compiled mujoco models are stored in binary form and shared between runs (default in memory only)"""
+    component_cache_dir: str|None = None
+    """if set, the folder where the xlsindy_component outputs (catalog, symbols, ideal solution) are cached between runs (default in memory only)"""
+    data_format: str = "columnar"
+    """the format of results_data : "columnar" (one .npy per array, memory mapped by align_data) or "pickle" (legacy dict of arrays) (default columnar)"""
+    series_format: str = "json"
+    """the format of the series in results/ : "json" (inline float lists, read by the site) or "sidecar" (binary {UID}.series.bin next to a slim json) (default json)"""
+
+def log_batches(batch_records):
+    """Pass the streamed batches through, logging each one as soon as it is generated."""
+    for i, record in enumerate(batch_records):
+        logger.info(f"Batch {i} generated : {len(record.time)} samples starting at {record.start_time:.3f}s")
+        yield record
+
+def generate_data(
+    args: DataGenerationParams,
+    generation_workers: int = 1,
+    component_cache_dir: str|None = None,
+    data_format: str = "columnar",
+    series_format: str = "json",
+) -> str:
+    """
+    Generate the training and validation data of an experiment, save them in results_data/ and the experiment json in results/.
+
+    The batches are written to a spool folder next to the data as they are generated (see spool_batches) and decimated
+    from the memory mapped spool : the memory used is one batch and the decimated data, not the whole generation.
+    The generators which integrate every batch at once (mujoco-rollout, theorical-vectorized, theorical-jax) still hold
+    every batch while they run.
+
+    Args:
+        args (DataGenerationParams): the parameters of the experiment.
+        generation_workers (int): the number of batches simulated concurrently in mujoco generation (default 1).
+        component_cache_dir (str): the folder of the xlsindy_component cache (default None, in memory only).
+        data_format (str): "columnar" or "pickle", the format of results_data (default columnar).
+        series_format (str): "json" or "sidecar", the format of the series of the experiment json (default json).
+
+    Returns:
+        str: the path of the experiment json file.
+    """
+
+    from data_generation.script.generate_trajectory import stream_theoretical_trajectory,stream_theoretical_vectorized_trajectory
+    from data_generation.script.generate_trajectory import stream_mujoco_trajectory,stream_mujoco_rollout_trajectory
+    from data_generation.script.component_cache import load_xlsindy_component
 
     # CLI validation
     if args.forces_scale_vector == []:
@@ -66,8 +98,8 @@ if __name__ == "__main__":
         logger.info(f"INFO : Using experiment folder {folder_path}")
         sys.path.append(folder_path)
 
-        # import the xlsindy_gen.py script
-        xlsindy_gen = importlib.import_module("xlsindy_gen")
+        # import the xlsindy_gen.py script (by path, a worker may go through several systems)
+        xlsindy_gen = import_xlsindy_gen(folder_path)
 
         try:
             xlsindy_component = xlsindy_gen.xlsindy_component
@@ -88,7 +120,7 @@ if __name__ == "__main__":
 
 
         num_coordinates, time_sym, symbols_matrix, full_catalog, xml_content, extra_info = (
-            xlsindy_component( random_seed=args.random_seed, damping_coefficients=args.damping_coefficients)  # type: ignore
+            load_xlsindy_component(xlsindy_component, component_cache_dir, random_seed=args.random_seed, damping_coefficients=args.damping_coefficients)  # type: ignore
         )
 
         
@@ -104,21 +136,27 @@ if __name__ == "__main__":
     ## TODO add a check for the number of forces scale vector in the input
 
 ### ----------------------- Part 1, generate the data using Mujoco or theorical ----------------------
-    
+
+    truncation = 5
+
+    # the raw batches, removed once decimated
+    spool_path = f"results_data/{args.UID}.{os.getpid()}.spool"
+    shutil.rmtree(spool_path, ignore_errors=True)
+
     # Batch generation
-    if args.generation_type == "mujoco" : # Mujoco Generation
+    if args.generation_type in ("mujoco", "mujoco-rollout") : # Mujoco Generation (python control callback or native rollout)
+
+        if args.generation_type == "mujoco":
+            mujoco_generator = stream_mujoco_trajectory
+        else:
+            mujoco_generator = stream_mujoco_rollout_trajectory
         
         if mujoco_transform is None or inverse_mujoco_transform is None:
             raise ValueError(
                 "mujoco_transform and inverse_mujoco_transform functions must be defined in xlsindy_gen.py for MuJoCo generation"
             )
         
-        (simulation_time_t, 
-         simulation_qpos_t, 
-         simulation_qvel_t, 
-         simulation_qacc_t, 
-         force_vector_t,
-         batch_starting_times) = generate_mujoco_trajectory(
+        batch_starting_times = spool_batches(spool_path, "training", num_coordinates, log_batches(mujoco_generator(
              num_coordinates,
              args.initial_position,
              args.initial_condition_randomness,
@@ -128,15 +166,13 @@ if __name__ == "__main__":
              xml_content,
              args.forces_scale_vector,
              mujoco_transform,
-             inverse_mujoco_transform
-         )
+             inverse_mujoco_transform,
+             sample_number=args.sample_number,
+             truncation=truncation,
+             workers=generation_workers,
+         )))
         
-        (simulation_time_v, 
-         simulation_qpos_v, 
-         simulation_qvel_v, 
-         simulation_qacc_v, 
-         force_vector_v,
-         _) = generate_mujoco_trajectory(
+        spool_batches(spool_path, "validation", num_coordinates, mujoco_generator(
              num_coordinates,
              args.initial_position,
              args.initial_condition_randomness,
@@ -146,17 +182,22 @@ if __name__ == "__main__":
              xml_content,
              args.forces_scale_vector,
              mujoco_transform,
-             inverse_mujoco_transform
-         )
-
-    elif args.generation_type == "theorical": # Theorical generation
-
-        (simulation_time_t, 
-         simulation_qpos_t, 
-         simulation_qvel_t, 
-         simulation_qacc_t, 
-         force_vector_t,
-         batch_starting_times) = generate_theoretical_trajectory(
+             inverse_mujoco_transform,
+             sample_number=args.max_validation_sample,
+             truncation=truncation,
+         ))
+
+    elif args.generation_type in ("theorical", "theorical-vectorized", "theorical-jax"): # Theorical generation (RK45 per batch or RK4 on every batch at once)
+
+        if args.generation_type == "theorical":
+            theoretical_generator = stream_theoretical_trajectory
+        elif args.generation_type == "theorical-vectorized":
+            theoretical_generator = stream_theoretical_vectorized_trajectory
+        else:
+            from data_generation.script.jax_trajectory import stream_jax_trajectory
+            theoretical_generator = stream_jax_trajectory
+
+        batch_starting_times = spool_batches(spool_path, "training", num_coordinates, log_batches(theoretical_generator(
              num_coordinates,
              args.initial_position,
              args.initial_condition_randomness,
@@ -168,14 +209,9 @@ if __name__ == "__main__":
              time_sym,
              symbols_matrix,
              args.forces_scale_vector,
-         )
+         )))
         
-        (simulation_time_v, 
-         simulation_qpos_v, 
-         simulation_qvel_v, 
-         simulation_qacc_v, 
-         force_vector_v,
-         _) = generate_theoretical_trajectory(
+        spool_batches(spool_path, "validation", num_coordinates, theoretical_generator(
              num_coordinates,
              args.initial_position,
              args.initial_condition_randomness,
@@ -187,39 +223,65 @@ if __name__ == "__main__":
              time_sym,
              symbols_matrix,
              args.forces_scale_vector,
-         )
+         ))
+
+    (simulation_time_t,
+     simulation_qpos_t,
+     simulation_qvel_t,
+     simulation_qacc_t,
+     force_vector_t) = load_spooled_batches(spool_path, "training").values()
 
-    logger.info( f"Raw simulation len {len(simulation_time_t)}")
+    (simulation_time_v,
+     simulation_qpos_v,
+     simulation_qvel_v,
+     simulation_qacc_v,
+     force_vector_v) = load_spooled_batches(spool_path, "validation").values()
+
+    logger.info(f"time shape : {simulation_time_t.shape} {simulation_time_v.shape}")
 
     # Reduce the data to the desired lenght
 
-    subsample_t = len(simulation_time_t) // args.sample_number
+    if args.generation_type in ("mujoco", "mujoco-rollout"):
 
-    subsample_v = len(simulation_time_v) // args.max_validation_sample
+        # Mujoco trajectories are already decimated at record time
+        training_slice = slice(None)
+        validation_slice = slice(None)
 
-    if subsample_t == 0 :
-        subsample_t =1
+    else:
 
-    if subsample_v == 0 :
-        subsample_v = 1
+        logger.info( f"Raw simulation len {len(simulation_time_t)}")
 
-    truncation = 5
+        subsample_t = len(simulation_time_t) // args.sample_number
 
-    logger.info(f"time shape : {simulation_time_t.shape} {simulation_time_v.shape}")
+        subsample_v = len(simulation_time_v) // args.max_validation_sample
+
+        if subsample_t == 0 :
+            subsample_t =1
+
+        if subsample_v == 0 :
+            subsample_v = 1
 
-    logger.info( f"Subsample training factor {subsample_t} and validation factor {subsample_v}")
+        logger.info( f"Subsample training factor {subsample_t} and validation factor {subsample_v}")
 
-    simulation_time_data_training = simulation_time_t[truncation:-truncation:subsample_t]
-    simulation_qpos_data_training = simulation_qpos_t[truncation:-truncation:subsample_t]
-    simulation_qvel_data_training = simulation_qvel_t[truncation:-truncation:subsample_t]
-    simulation_qacc_data_training = simulation_qacc_t[truncation:-truncation:subsample_t]
-    force_vector_data_training = force_vector_t[truncation:-truncation:subsample_t]
+        training_slice = slice(truncation, -truncation, subsample_t)
+        validation_slice = slice(truncation, -truncation, subsample_v)
 
-    simulation_time_data_validation = simulation_time_v[truncation:-truncation:subsample_v]
-    simulation_qpos_data_validation = simulation_qpos_v[truncation:-truncation:subsample_v]
-    simulation_qvel_data_validation = simulation_qvel_v[truncation:-truncation:subsample_v]
-    simulation_qacc_data_validation = simulation_qacc_v[truncation:-truncation:subsample_v]
-    force_vector_data_validation = force_vector_v[truncation:-truncation:subsample_v]
+    # copy the decimated rows out of the spool, only their pages are read
+    simulation_time_data_training = np.array(simulation_time_t[training_slice])
+    simulation_qpos_data_training = np.array(simulation_qpos_t[training_slice])
+    simulation_qvel_data_training = np.array(simulation_qvel_t[training_slice])
+    simulation_qacc_data_training = np.array(simulation_qacc_t[training_slice])
+    force_vector_data_training = np.array(force_vector_t[training_slice])
+
+    simulation_time_data_validation = np.array(simulation_time_v[validation_slice])
+    simulation_qpos_data_validation = np.array(simulation_qpos_v[validation_slice])
+    simulation_qvel_data_validation = np.array(simulation_qvel_v[validation_slice])
+    simulation_qacc_data_validation = np.array(simulation_qacc_v[validation_slice])
+    force_vector_data_validation = np.array(force_vector_v[validation_slice])
+
+    del simulation_time_t, simulation_qpos_t, simulation_qvel_t, simulation_qacc_t, force_vector_t
+    del simulation_time_v, simulation_qpos_v, simulation_qvel_v, simulation_qacc_v, force_vector_v
+    shutil.rmtree(spool_path)
 
     data = {
         "simulation_time_training": simulation_time_data_training,
@@ -234,11 +296,14 @@ if __name__ == "__main__":
         "force_vector_validation": force_vector_data_validation,
     }
 
-    # Save pickle file
+    # Save simulation data
 
-    filename = f"results_data/{args.UID}.pkl"
-    with open(filename,'wb') as f : 
-        pickle.dump(data, f)
+    if data_format == "columnar":
+        filename = save_simulation_data(f"results_data/{args.UID}", data)
+    else:
+        filename = f"results_data/{args.UID}.pkl"
+        with open(filename,'wb') as f : 
+            pickle.dump(data, f)
     logger.info(f"Data saved with uid {args.UID}")
 
     ## ----------------------- Part 2, generate the json file for visualisation ----------------------
@@ -285,10 +350,36 @@ if __name__ == "__main__":
     # Save json file
     json_filename = f"results/{args.UID}.json"
 
-    with open(json_filename,'w') as f :
-        f.write(experiment_data.model_dump_json(indent=4))
+    with experiment_lock(json_filename):
+        save_experiment(experiment_data, json_filename, sidecar=series_format == "sidecar")
+        # the regressions saved for the previous data do not apply anymore
+        discard_trajectory_records(json_filename)
 
     logger.info(f"Settings saved with uid {args.UID}")
 
+    return json_filename
+
+if __name__ == "__main__":
+
+    args = tyro.cli(Args)
+
+    # Check if data already exists and skip if requested
+    if args.skip_already_done:
+        json_filename = f"results/{args.params.UID}.json"
+        if os.path.exists(json_filename):
+            logger.info(f"Data already exists for UID {args.params.UID}, skipping generation")
+            sys.exit(0)
+
+    from data_generation.script.acceleration_function import configure_acceleration_cache
+    from data_generation.script.generate_trajectory import configure_mujoco_model_cache
 
+    configure_acceleration_cache(cache_dir=args.acceleration_cache_dir)
+    configure_mujoco_model_cache(cache_dir=args.mujoco_model_cache_dir)
 
+    generate_data(
+        args.params,
+        generation_workers=args.generation_workers,
+        component_cache_dir=args.component_cache_dir,
+        data_format=args.data_format,
+        series_format=args.series_format,
+    )
@@ -5,9 +5,9 @@ This script scans the results directory for .json files and creates a manifest
 with metadata extracted from each file's generation_settings.
 
 Usage:
-    python3 data_generation/generate_manifest.py
-    python3 data_generation/generate_manifest.py --results-dir custom_results
-    python3 data_generation/generate_manifest.py --output custom_manifest.json
+    python3 -m data_generation.script.generate_manifest
+    python3 -m data_generation.script.generate_manifest --results-dir custom_results
+    python3 -m data_generation.script.generate_manifest --output custom_manifest.json
 
 Output format:
 {
@@ -28,7 +28,8 @@ import os
 import glob
 from pathlib import Path
 from typing import Dict, List, Any
-from dataclass import Experiment
+from data_generation.script.dataclass import Experiment
+from data_generation.script.experiment_io import load_experiment
 
 def extract_experiment_folder_name(experiment_folder: str) -> str:
     """Extract the last part of the experiment folder path after the last slash."""
@@ -98,11 +99,8 @@ def generate_manifest(results_dir: str = "results", output_file: str = None) ->
         print(f"Processing: {filename}")
         
         try:
-            with open(json_file, 'r') as f:
-                data = json.load(f)
-            
-            # Parse using Experiment dataclass
-            experiment = Experiment(**data)
+            # Parse using Experiment dataclass, the series are not needed
+            experiment = load_experiment(json_file, series="headers")
             
             # Extract required fields from generation_params
             gen_params = experiment.generation_params
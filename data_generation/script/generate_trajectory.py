@@ -3,26 +3,92 @@ Some util used in generate data, align data and so one.
 Not really something that should go in xlsindy.
 """
 import contextlib
+import hashlib
 import logging 
+import os
+import queue
 import numpy as np
 
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, NamedTuple
 
 import xlsindy
 from tqdm import tqdm
 
 import sympy as sp
 
-import mujoco
+# mujoco is imported by the mujoco generators only, the theoretical path does not need it
+if TYPE_CHECKING:
+    import mujoco
+
+from data_generation.script.acceleration_function import cached_acceleration_function
 
 logger = logging.getLogger(__name__)
 
+class BatchRecord(NamedTuple):
+    """One batch of a streamed generation, the time is already shifted to the start time of the batch."""
+    time: np.ndarray
+    qpos: np.ndarray
+    qvel: np.ndarray
+    qacc: np.ndarray
+    forces: np.ndarray
+    start_time: float
+
+class TabulatedForces:
+    """
+    Force function precomputed on a time grid.
+
+    Drop-in replacement of the force function : a time of the grid is an exact lookup (same value as the tabulated
+    force function), any other time is linearly interpolated between the two nearest samples (clamped outside of the grid).
+
+    Args:
+        forces_function (Callable): the force function, evaluated once on the whole grid.
+        time_grid (np.ndarray): the times where the force will be asked (duplicates are merged).
+    """
+
+    def __init__(self, forces_function, time_grid: np.ndarray):
+        self.time_grid = np.unique(np.asarray(time_grid, dtype=np.float64))
+        self.table = np.ascontiguousarray(forces_function(self.time_grid).T)
+
+    def lookup(self, times: np.ndarray) -> np.ndarray:
+        """Forces at each time of the 1D array `times`, of shape (len(times), component_count)."""
+        index = np.clip(np.searchsorted(self.time_grid, times), 1, len(self.time_grid) - 1)
+        left, right = self.time_grid[index - 1], self.time_grid[index]
+        weight = np.clip((times - left) / (right - left), 0.0, 1.0)
+
+        values = self.table[index - 1] + weight[:, None] * (self.table[index] - self.table[index - 1])
+
+        on_grid = right == times
+        values[on_grid] = self.table[index[on_grid]]
+        on_grid = left == times
+        values[on_grid] = self.table[index[on_grid] - 1]
+
+        return values
+
+    def __call__(self, t):
+        if isinstance(t, np.ndarray):
+            # Same layout as the force function (component_count, *t.shape)
+            return np.moveaxis(self.lookup(t.flatten()).reshape(t.shape + (-1,)), -1, 0)
+
+        index = np.searchsorted(self.time_grid, t)
+        if index < len(self.time_grid) and self.time_grid[index] == t:
+            return self.table[index].copy()
+        return self.lookup(np.array([t], dtype=np.float64))[0]
+
 def generate_forces_function(
     component_count: int,
     scale_vector: np.ndarray,
     random_seed: List[int],
     time_end: float,
+    time_grid: np.ndarray|None = None,
 ):
+    """
+    Random sinusoidal force function of a batch.
+
+    Args:
+        time_grid (np.ndarray): if given, the force is precomputed on this grid and a TabulatedForces is returned (default None).
+    """
         # First try to generate forces function        
     # forces_function = xlsindy.dynamics_modeling.optimized_force_generator(
     #     component_count=num_coordinates,
@@ -43,10 +109,137 @@ def generate_forces_function(
         random_seed=random_seed,
     )
 
+    if time_grid is not None:
+        return TabulatedForces(forces_function, time_grid)
+
     return forces_function
 
+class DivergenceGuard:
+    """
+    Stop a rollout once its state leaves a bound or once the step size of the RK45 collapses.
 
-def generate_theoretical_trajectory(
+    A state is out of bound when the absolute position or velocity of a coordinate exceeds its bound, or when it is not
+    finite. The guard records why and when the first guarded rollout stopped, stop_reason stays None if it went to the end.
+
+    Args:
+        qpos_bound (np.ndarray): the bound of the absolute position of each coordinate.
+        qvel_bound (np.ndarray): the bound of the absolute velocity of each coordinate.
+        min_step (float): the RK45 stops once its step size is below (default 1e-4, the min_step of xlsindy run_rk45_integration).
+    """
+
+    DIVERGED = "diverged"
+    STEP_COLLAPSE = "step_collapse"
+
+    def __init__(self, qpos_bound: np.ndarray, qvel_bound: np.ndarray, min_step: float = 1e-4):
+        self.qpos_bound = np.asarray(qpos_bound, dtype=np.float64)
+        self.qvel_bound = np.asarray(qvel_bound, dtype=np.float64)
+        self.min_step = min_step
+        self.stop_reason: str|None = None
+        self.stop_time: float|None = None
+
+    @classmethod
+    def from_reference(cls, qpos: np.ndarray, qvel: np.ndarray, factor: float = 10.0, min_step: float = 1e-4) -> "DivergenceGuard":
+        """
+        Guard of a rollout against a reference trajectory : the bound of each coordinate is `factor` times the largest
+        absolute value of the reference on it (1.0 instead of 0.0 for a coordinate that does not move).
+
+        Args:
+            qpos (np.ndarray): the reference positions (steps, num_coordinates).
+            qvel (np.ndarray): the reference velocities (steps, num_coordinates).
+        """
+        def bound(values: np.ndarray) -> np.ndarray:
+            scale = np.max(np.abs(values), axis=0)
+            return factor * np.where(scale > 0, scale, 1.0)
+
+        return cls(bound(qpos), bound(qvel), min_step=min_step)
+
+    def out_of_bound(self, qpos: np.ndarray, qvel: np.ndarray) -> np.ndarray:
+        """Whether each state is out of bound, for arrays of shape (..., num_coordinates)."""
+        # a nan fails the comparison, it is out of bound
+        inside = (np.abs(qpos) <= self.qpos_bound) & (np.abs(qvel) <= self.qvel_bound)
+        return ~np.all(inside, axis=-1)
+
+    def first_out_of_bound(self, qpos: np.ndarray, qvel: np.ndarray) -> int|None:
+        """Index of the first out of bound sample of a trajectory (steps, num_coordinates), None if it stays inside."""
+        out = self.out_of_bound(qpos, qvel)
+        return int(np.argmax(out)) if np.any(out) else None
+
+    def stop(self, reason: str, time: float) -> None:
+        """Record the stop of a rollout, only the first one is kept."""
+        logger.warning(f"rollout stopped at t={time} : {reason}")
+        if self.stop_reason is None:
+            self.stop_reason = reason
+            self.stop_time = float(time)
+
+def run_guarded_rk45_integration(
+    dynamics,
+    initial_state: np.ndarray,
+    time_end: float,
+    guard: DivergenceGuard,
+    max_step: float = 0.05,
+):
+    """
+    xlsindy.dynamics_modeling.run_rk45_integration (same solver settings, same samples) that also stops once the state
+    leaves the bound of the guard. The reason of the stop is recorded in the guard.
+
+    Args:
+        dynamics (function): Dynamics function for integration, of the flat state (q0, q0_d, q1, q1_d, ...).
+        initial_state (np.ndarray): Initial state of the system (num_coordinates, 2).
+        time_end (float): End time for the integration.
+        guard (DivergenceGuard): the bound of the state and the min step of the integration.
+        max_step (float, optional): Maximum step size for the integration. Defaults to 0.05.
+
+    Returns:
+        tuple: Arrays of time values and states, up to the last step (included) if the integration stopped. A rollout
+        stopped on its first step only has the initial state (one sample, xlsindy repeats it at t=0).
+    """
+    from scipy.integrate import RK45
+
+    initial_state_flat = np.reshape(initial_state, (-1,))
+
+    model = RK45(
+        dynamics,
+        0,
+        initial_state_flat,
+        time_end,
+        max_step,
+        0.001,
+        np.e**-6,
+        first_step=guard.min_step * 5,
+    )
+
+    time_values = [0]
+    state_values = [initial_state_flat]
+
+    first_step = dynamics(0, initial_state_flat)
+
+    if not np.all(np.isfinite(first_step)):
+        logger.error("Dynamics function fail on first step")
+        guard.stop(DivergenceGuard.DIVERGED, 0.0)
+        return np.array(time_values), np.array(state_values)
+
+    while model.status == "running":
+        model.step()
+
+        if model.status == "failed":
+            guard.stop(DivergenceGuard.STEP_COLLAPSE, model.t)
+            break
+
+        time_values.append(model.t)
+        state_values.append(model.y)
+
+        if guard.out_of_bound(model.y[::2], model.y[1::2]):
+            guard.stop(DivergenceGuard.DIVERGED, model.t)
+            break
+
+        if (model.step_size is not None) and (model.step_size < guard.min_step):
+            guard.stop(DivergenceGuard.STEP_COLLAPSE, model.t)
+            break
+
+    return np.array(time_values), np.array(state_values)
+
+
+def stream_theoretical_trajectory(
     num_coordinates: int,
     initial_position: np.ndarray,
     initial_condition_randomness: np.ndarray,
@@ -58,96 +251,678 @@ def generate_theoretical_trajectory(
     time_symb: sp.Symbol,
     symbols_matrix: np.ndarray,
     forces_scale_vector: np.ndarray,
-):
+    divergence_guard: DivergenceGuard|None = None,
+) -> Iterator[BatchRecord]:
     """
     [INFO] maybe I should but this function inside the main library.
-    Generate a theoretical trajectory using theoretical background.
+    Generate a theoretical trajectory using theoretical background, one batch at a time.
 
     Args:
+        divergence_guard (DivergenceGuard): if given, each batch stops once its state leaves the bound of the guard or once the RK45 step collapses (default None).
 
-    Returns:
+    Yields:
+        BatchRecord: one record per batch, in batch order.
     """
-    
-    simulation_time_g = np.empty((0,1))
-    simulation_qpos_g = np.empty((0,num_coordinates))
-    simulation_qvel_g = np.empty((0,num_coordinates))
-    simulation_qacc_g = np.empty((0,num_coordinates))
-    force_vector_g = np.empty((0,num_coordinates))
-    batch_starting_times = []
 
     if len(initial_position)==0:
         initial_position = np.zeros((num_coordinates,2))
 
     rng = np.random.default_rng(random_seed)
 
-    model_acceleration_func, valid_model = xlsindy.dynamics_modeling.generate_acceleration_function(
+    model_acceleration_func, valid_model = cached_acceleration_function(
     solution_vector,
     solution_catalog,
     symbols_matrix,
     time_symb,
     lambdify_module="numpy"
     )
-    
-    for i in tqdm(range(batch_number),desc="Generating batches", unit="batch"):
 
-        # Record batch starting time
-        batch_start_time = 0.0 if len(simulation_time_g) == 0 else np.max(simulation_time_g)
-        batch_starting_times.append(float(batch_start_time))
+    def batch_results():
 
-        # Initial condition
-        initial_condition = np.array(initial_position).reshape(num_coordinates,2)
+        for i in tqdm(range(batch_number),desc="Generating batches", unit="batch"):
 
-        if len(initial_condition_randomness) == 1:
-            initial_condition += rng.normal(
-                loc=0, scale=initial_condition_randomness, size=initial_condition.shape
+            # Initial condition
+            initial_condition = np.array(initial_position).reshape(num_coordinates,2)
+
+            if len(initial_condition_randomness) == 1:
+                initial_condition += rng.normal(
+                    loc=0, scale=initial_condition_randomness, size=initial_condition.shape
+                )
+            else:
+                initial_condition += rng.normal(
+                    loc=0, scale=np.reshape(initial_condition_randomness,initial_condition.shape)
+                )
+
+            forces_function = generate_forces_function(
+                component_count=num_coordinates,
+                scale_vector=forces_scale_vector,
+                time_end=max_time,
+                random_seed=[random_seed,i],
             )
-        else:
-            initial_condition += rng.normal(
-                loc=0, scale=np.reshape(initial_condition_randomness,initial_condition.shape)
+
+            model_dynamics_system = xlsindy.dynamics_modeling.dynamics_function(model_acceleration_func,forces_function) 
+            logger.info("theoretical initialized")
+            try:
+                if divergence_guard is None:
+                    simulation_time_m, phase_values = xlsindy.dynamics_modeling.run_rk45_integration(model_dynamics_system, initial_condition, max_time, max_step=0.005)
+                else:
+                    simulation_time_m, phase_values = run_guarded_rk45_integration(model_dynamics_system, initial_condition, max_time, divergence_guard, max_step=0.005)
+            except Exception as e:
+                logger.error(f"An error occurred on the RK45 integration: {e}")
+                raise
+            logger.info("theoretical simulation done")
+
+            simulation_qpos_m = phase_values[:, ::2]
+            simulation_qvel_m = phase_values[:, 1::2]
+
+            if len(simulation_time_m) > 1:
+                simulation_qacc_m = np.gradient(simulation_qvel_m, simulation_time_m, axis=0, edge_order=1)
+            else:
+                # a guarded rollout stopped on its initial state, no gradient
+                simulation_qacc_m = np.full_like(simulation_qvel_m, np.nan)
+
+            force_vector_m = forces_function(simulation_time_m.T).T
+
+            # The next batch start at the end of this one
+            yield (
+                simulation_time_m.reshape(-1, 1),
+                simulation_qpos_m,
+                simulation_qvel_m,
+                simulation_qacc_m,
+                force_vector_m,
+                np.max(simulation_time_m),
             )
 
-        forces_function = generate_forces_function(
+    yield from stream_batches(batch_results())
+
+def generate_theoretical_trajectory(
+    num_coordinates: int,
+    initial_position: np.ndarray,
+    initial_condition_randomness: np.ndarray,
+    random_seed: List[int],
+    batch_number: int,
+    max_time: float,
+    solution_vector: np.ndarray,
+    solution_catalog: xlsindy.catalog.CatalogRepartition,
+    time_symb: sp.Symbol,
+    symbols_matrix: np.ndarray,
+    forces_scale_vector: np.ndarray,
+    divergence_guard: DivergenceGuard|None = None,
+):
+    """
+    Generate a theoretical trajectory, all the batches of stream_theoretical_trajectory concatenated.
+
+    Returns:
+        tuple: (simulation_time_g, simulation_qpos_g, simulation_qvel_g, simulation_qacc_g, force_vector_g, batch_starting_times)
+    """
+    return concatenate_batches(num_coordinates, stream_theoretical_trajectory(
+        num_coordinates,
+        initial_position,
+        initial_condition_randomness,
+        random_seed,
+        batch_number,
+        max_time,
+        solution_vector,
+        solution_catalog,
+        time_symb,
+        symbols_matrix,
+        forces_scale_vector,
+        divergence_guard=divergence_guard,
+    ))
+
+def generate_batched_acceleration_function(
+    solution_vector: np.ndarray,
+    solution_catalog: xlsindy.catalog.CatalogRepartition,
+    symbols_matrix: np.ndarray,
+    time_symb: sp.Symbol,
+):
+    """
+    Batched numpy counterpart of xlsindy.dynamics_modeling.generate_acceleration_function.
+
+    The linear system A(q,q_d) q_dd = b(q,q_d,f) is built the same way, but every entry is lambdified
+    on its own so that it can be evaluated on arrays of states (see acceleration_function.lambdify_batched_acceleration_function).
+    The result is memoized in the process wide acceleration function cache.
+
+    Args:
+        solution_vector (np.ndarray): the solution vector of the system.
+        solution_catalog (xlsindy.catalog.CatalogRepartition): the catalog of the solution.
+        symbols_matrix (np.ndarray): the symbolic matrix (forces, positions, velocities, accelerations).
+        time_symb (sp.Symbol): the time symbol.
+
+    Returns:
+        function: acceleration(forces, qpos, qvel) -> qacc, every array of shape (batch, num_coordinates). None if the model is not valid.
+        bool: Whether the acceleration function generation was successful.
+    """
+    return cached_acceleration_function(
+        solution_vector,
+        solution_catalog,
+        symbols_matrix,
+        time_symb,
+        lambdify_module="batched",
+    )
+
+def stream_theoretical_vectorized_trajectory(
+    num_coordinates: int,
+    initial_position: np.ndarray,
+    initial_condition_randomness: np.ndarray,
+    random_seed: List[int],
+    batch_number: int,
+    max_time: float,
+    solution_vector: np.ndarray,
+    solution_catalog: xlsindy.catalog.CatalogRepartition,
+    time_symb: sp.Symbol,
+    symbols_matrix: np.ndarray,
+    forces_scale_vector: np.ndarray,
+    time_step: float = 0.005,
+    divergence_guard: DivergenceGuard|None = None,
+) -> Iterator[BatchRecord]:
+    """
+    Generate a theoretical trajectory integrating every batch at once.
+
+    Same inputs and outputs as stream_theoretical_trajectory, but instead of one adaptive RK45 run per batch,
+    a fixed step RK4 is performed on the (batch, num_coordinates) state arrays with the batched acceleration
+    function (see generate_batched_acceleration_function). The recorded acceleration is the model acceleration
+    at each sample instead of the gradient of the velocity.
+
+    Args:
+        time_step (float): the fixed integration step, also the sampling period of the output (default 0.005, the max_step of the RK45 generator).
+        divergence_guard (DivergenceGuard): if given, the integration stops once the state of a batch leaves the bound of the guard, every batch is truncated there (default None).
+
+    Yields:
+        BatchRecord: one record per batch, in batch order (every batch is integrated before the first one is yielded).
+    """
+
+    if len(initial_position)==0:
+        initial_position = np.zeros((num_coordinates,2))
+
+    rng = np.random.default_rng(random_seed)
+
+    model_acceleration_func, valid_model = generate_batched_acceleration_function(
+        solution_vector,
+        solution_catalog,
+        symbols_matrix,
+        time_symb,
+    )
+
+    if not valid_model:
+        raise ValueError("The solution vector does not give a valid acceleration function")
+
+    initial_conditions = np.array(draw_initial_conditions(
+        num_coordinates, initial_position, initial_condition_randomness, rng, batch_number
+    ))
+
+    step_number = int(round(max_time / time_step))
+    simulation_time_m = time_step * np.arange(step_number + 1)
+
+    # Every stage time of the RK4 (start, middle and end of each step)
+    stage_times = np.concatenate((simulation_time_m, simulation_time_m + time_step / 2, simulation_time_m + time_step))
+
+    # The forces of every batch at every stage time, tabulated once : (stage, step, batch, num_coordinates)
+    stage_forces = np.stack([
+        generate_forces_function(
             component_count=num_coordinates,
             scale_vector=forces_scale_vector,
             time_end=max_time,
             random_seed=[random_seed,i],
+            time_grid=stage_times,
+        ).lookup(stage_times)
+        for i in range(batch_number)
+    ], axis=1).reshape(3, step_number + 1, batch_number, num_coordinates)
+
+    start_forces, middle_forces, end_forces = stage_forces
+
+    def derivative(forces: np.ndarray, qpos: np.ndarray, qvel: np.ndarray):
+        return qvel, model_acceleration_func(forces, qpos, qvel)
+
+    simulation_qpos_m = np.empty((step_number + 1, batch_number, num_coordinates))
+    simulation_qvel_m = np.empty((step_number + 1, batch_number, num_coordinates))
+    simulation_qacc_m = np.empty((step_number + 1, batch_number, num_coordinates))
+    force_vector_m = np.empty((step_number + 1, batch_number, num_coordinates))
+
+    qpos = initial_conditions[:, :, 0]
+    qvel = initial_conditions[:, :, 1]
+
+    logger.info("theoretical vectorized initialized")
+
+    last_step = step_number
+    # the last step stored in the outputs, if the integration fails
+    stored_step = -1
+    try:
+        for k in tqdm(range(step_number + 1), desc="Integrating batches", unit="step", leave=False):
+
+            t = simulation_time_m[k]
+
+            force_vector_m[k] = start_forces[k]
+            k1_pos, k1_vel = qvel, model_acceleration_func(force_vector_m[k], qpos, qvel)
+
+            simulation_qpos_m[k] = qpos
+            simulation_qvel_m[k] = qvel
+            simulation_qacc_m[k] = k1_vel
+            stored_step = k
+
+            if k == step_number:
+                break
+
+            if divergence_guard is not None and np.any(divergence_guard.out_of_bound(qpos, qvel)):
+                last_step = k
+                divergence_guard.stop(DivergenceGuard.DIVERGED, t)
+                break
+
+            k2_pos, k2_vel = derivative(middle_forces[k], qpos + time_step / 2 * k1_pos, qvel + time_step / 2 * k1_vel)
+            k3_pos, k3_vel = derivative(middle_forces[k], qpos + time_step / 2 * k2_pos, qvel + time_step / 2 * k2_vel)
+            k4_pos, k4_vel = derivative(end_forces[k], qpos + time_step * k3_pos, qvel + time_step * k3_vel)
+
+            qpos = qpos + time_step / 6 * (k1_pos + 2 * k2_pos + 2 * k3_pos + k4_pos)
+            qvel = qvel + time_step / 6 * (k1_vel + 2 * k2_vel + 2 * k3_vel + k4_vel)
+
+    except np.linalg.LinAlgError as e:
+        # a failure in the k2 to k4 stages keeps the step k, already stored
+        last_step = stored_step
+        logger.error(f"An error occurred on the vectorized RK4 integration at t={simulation_time_m[k]}: {e}")
+
+    logger.info("theoretical vectorized simulation done")
+
+    simulation_time_m = simulation_time_m[:last_step + 1]
+    last_time = simulation_time_m[-1] if len(simulation_time_m) > 0 else 0.0
+
+    batch_results = (
+        (
+            simulation_time_m.reshape(-1, 1).copy(),
+            simulation_qpos_m[:last_step + 1, i],
+            simulation_qvel_m[:last_step + 1, i],
+            simulation_qacc_m[:last_step + 1, i],
+            force_vector_m[:last_step + 1, i],
+            last_time,
         )
+        for i in range(batch_number)
+    )
 
-        model_dynamics_system = xlsindy.dynamics_modeling.dynamics_function(model_acceleration_func,forces_function) 
-        logger.info("theoretical initialized")
-        try:
-            simulation_time_m, phase_values = xlsindy.dynamics_modeling.run_rk45_integration(model_dynamics_system, initial_condition, max_time, max_step=0.005)
-        except Exception as e:
-            logger.error(f"An error occurred on the RK45 integration: {e}")
-        logger.info("theoretical simulation done")
+    yield from stream_batches(batch_results)
+
+def generate_theoretical_vectorized_trajectory(
+    num_coordinates: int,
+    initial_position: np.ndarray,
+    initial_condition_randomness: np.ndarray,
+    random_seed: List[int],
+    batch_number: int,
+    max_time: float,
+    solution_vector: np.ndarray,
+    solution_catalog: xlsindy.catalog.CatalogRepartition,
+    time_symb: sp.Symbol,
+    symbols_matrix: np.ndarray,
+    forces_scale_vector: np.ndarray,
+    time_step: float = 0.005,
+    divergence_guard: DivergenceGuard|None = None,
+):
+    """
+    Generate a theoretical trajectory integrating every batch at once, all the batches of stream_theoretical_vectorized_trajectory concatenated.
 
-        simulation_qpos_m = phase_values[:, ::2]
-        simulation_qvel_m = phase_values[:, 1::2]
+    Returns:
+        tuple: (simulation_time_g, simulation_qpos_g, simulation_qvel_g, simulation_qacc_g, force_vector_g, batch_starting_times)
+    """
+    return concatenate_batches(num_coordinates, stream_theoretical_vectorized_trajectory(
+        num_coordinates,
+        initial_position,
+        initial_condition_randomness,
+        random_seed,
+        batch_number,
+        max_time,
+        solution_vector,
+        solution_catalog,
+        time_symb,
+        symbols_matrix,
+        forces_scale_vector,
+        time_step=time_step,
+        divergence_guard=divergence_guard,
+    ))
 
-        simulation_qacc_m = np.gradient(simulation_qvel_m, simulation_time_m, axis=0, edge_order=1)
+# In process cache of the compiled models, keyed by mujoco_model_key
+_mujoco_models: Dict[str, "mujoco.MjModel"] = {}
+_mujoco_model_cache_dir: str|None = None
 
-        force_vector_m = forces_function(simulation_time_m.T).T
+def configure_mujoco_model_cache(cache_dir: str|None = None):
+    """Set the folder where the compiled models are stored in binary (MJB) form (default None, in memory only)."""
+    global _mujoco_model_cache_dir
+    _mujoco_model_cache_dir = cache_dir
 
-        if len(simulation_qvel_g) >0:
-            simulation_time_m += np.max(simulation_time_g)
+def mujoco_model_key(xml_content: str) -> str:
+    """Hash of the substituted xml (damping included) and of the mujoco version, the MJB format is version specific."""
+    import mujoco
+    return hashlib.md5(f"{mujoco.__version__}\n{xml_content}".encode()).hexdigest()
 
-        # Concatenate the data
-        simulation_time_g = np.concatenate((simulation_time_g, simulation_time_m.reshape(-1, 1)), axis=0)
-        simulation_qpos_g = np.concatenate((simulation_qpos_g, simulation_qpos_m), axis=0)
-        simulation_qvel_g = np.concatenate((simulation_qvel_g, simulation_qvel_m), axis=0)
-        simulation_qacc_g = np.concatenate((simulation_qacc_g, simulation_qacc_m), axis=0)
-        force_vector_g = np.concatenate((force_vector_g, force_vector_m), axis=0)
+def load_mujoco_model(xml_content: str) -> "mujoco.MjModel":
+    """
+    Compile the xml of a system once per process, and once per cache folder if configured (see configure_mujoco_model_cache).
 
-    return simulation_time_g, simulation_qpos_g, simulation_qvel_g, simulation_qacc_g, force_vector_g, batch_starting_times
+    The model is shared between the calls, it should not be modified.
+    """
+    import mujoco
+
+    key = mujoco_model_key(xml_content)
+
+    if key in _mujoco_models:
+        return _mujoco_models[key]
+
+    mujoco_model = None
+    file_path = os.path.join(_mujoco_model_cache_dir, f"{key}.mjb") if _mujoco_model_cache_dir is not None else None
+
+    if file_path is not None and os.path.exists(file_path):
+        try:
+            mujoco_model = mujoco.MjModel.from_binary_path(file_path)
+        except Exception as e:
+            logger.warning(f"Failed to load the compiled model {file_path}: {e}")
+
+    if mujoco_model is None:
+        mujoco_model = mujoco.MjModel.from_xml_string(xml_content)
+
+        if file_path is not None:
+            os.makedirs(_mujoco_model_cache_dir, exist_ok=True)
+            # write then rename, another process may read the same model
+            temporary_path = f"{file_path}.{os.getpid()}.tmp"
+            mujoco.mj_saveModel(mujoco_model, temporary_path, None)
+            os.replace(temporary_path, file_path)
+
+    _mujoco_models[key] = mujoco_model
+    return mujoco_model
 
 #Used for mujoco ref : https://github.com/google-deepmind/mujoco/issues/1014
 @contextlib.contextmanager
 def temporary_callback(setter, callback):
   setter(callback)
-  yield
-  setter(None)
+  try:
+    yield
+  finally:
+    setter(None)
 
-def generate_mujoco_trajectory(
+def mujoco_step_times(mujoco_model, max_time: float) -> np.ndarray:
+    """
+    Starting time of each mj_step needed to reach `max_time` from time 0.
+
+    The time is accumulated the same way MuJoCo does it (data.time += timestep) so the step grid is exact.
+    """
+    step_times = []
+    time = 0.0
+    while time < max_time:
+        step_times.append(time)
+        time += mujoco_model.opt.timestep
+    return np.array(step_times)
+
+def mujoco_callback_times(mujoco_model, max_time: float) -> np.ndarray:
+    """
+    Every time where the control callback is called to reach `max_time` from time 0 (sorted, without duplicates).
+
+    The RK4 integrator evaluate its stages at time + timestep * (0, 0.5, 0.5, 1) of each step.
+    """
+    import mujoco
+
+    step_times = mujoco_step_times(mujoco_model, max_time)
+    if mujoco_model.opt.integrator == mujoco.mjtIntegrator.mjINT_RK4:
+        step_times = np.concatenate((
+            step_times,
+            step_times + mujoco_model.opt.timestep * 0.5,
+            step_times + mujoco_model.opt.timestep,
+        ))
+    return np.unique(step_times)
+
+def mujoco_stage_count(mujoco_model) -> int:
+    """
+    Number of control callback call per mj_step.
+
+    The RK4 integrator call the control callback once per stage (4 times per mj_step), the first call of a step is
+    made at the start of the step.
+    """
+    import mujoco
+
+    if mujoco_model.opt.integrator == mujoco.mjtIntegrator.mjINT_RK4:
+        return 4
+    return 1
+
+def mujoco_callback_count(mujoco_model, max_time: float) -> int:
+    """
+    Number of control callback call needed to reach `max_time` from time 0.
+    """
+    return mujoco_stage_count(mujoco_model) * len(mujoco_step_times(mujoco_model, max_time))
+
+def decimation_indices(total: int, sample_number: int, truncation: int = 0) -> np.ndarray:
+    """
+    Indices kept when reducing `total` samples to roughly `sample_number`.
+
+    Every `stride = max(total // sample_number, 1)` index from `truncation` included to `total - truncation` excluded.
+    For truncation > 0 this is `array[truncation:-truncation:stride]`, the reduction used by generate_data on the
+    concatenated batches. For truncation = 0 every sample is in the range (the slice `[0:-0:stride]` would be empty).
+    """
+    stride = max(total // sample_number, 1)
+    return np.arange(truncation, total - truncation, stride)
+
+def step_keep_masks(step_number: int, batch_number: int, sample_number: int, truncation: int = 0) -> np.ndarray:
+    """
+    Steps kept by the decimation of the mujoco backends (see decimation_indices).
+
+    The decimation is made on the steps of the concatenated batches so that stream_mujoco_trajectory and
+    stream_mujoco_rollout_trajectory keep the same steps for the same `sample_number` and `truncation`.
+
+    Returns:
+        np.ndarray: (batch_number,step_number) boolean mask, true for the kept steps.
+    """
+    kept_indices = decimation_indices(step_number * batch_number, sample_number, truncation)
+    keep_masks = np.zeros((batch_number, step_number), dtype=bool)
+    keep_masks.flat[kept_indices] = True
+    return keep_masks
+
+def draw_initial_conditions(
+    num_coordinates: int,
+    initial_position: np.ndarray,
+    initial_condition_randomness: np.ndarray,
+    rng: np.random.Generator,
+    batch_number: int,
+) -> List[np.ndarray]:
+    """
+    Draw the initial condition of every batch, in batch order.
+
+    Returns:
+        List[np.ndarray]: one (num_coordinates,2) array [qpos,qvel] per batch.
+    """
+    initial_conditions = []
+    for _ in range(batch_number):
+
+        initial_condition = np.array(initial_position).reshape(num_coordinates,2)
+
+        if len(initial_condition_randomness) == 1:
+            initial_condition += rng.normal(
+                loc=0, scale=initial_condition_randomness, size=initial_condition.shape
+            )
+        else:
+            initial_condition += rng.normal(
+                loc=0, scale=np.reshape(initial_condition_randomness,initial_condition.shape)
+            )
+
+        initial_conditions.append(initial_condition)
+
+    return initial_conditions
+
+def stream_batches(batch_results) -> Iterator[BatchRecord]:
+    """
+    Chain the batches of a generation, each batch start at the last simulated time of the previous one.
+
+    Args:
+        batch_results: iterable of (time, qpos, qvel, qacc, forces, last_time) per batch, in batch order.
+
+    Yields:
+        BatchRecord: one record per batch, in batch order.
+    """
+    time_offset = 0.0
+
+    for i, (simulation_time_m,
+            simulation_qpos_m,
+            simulation_qvel_m,
+            simulation_qacc_m,
+            force_vector_m,
+            last_time) in enumerate(batch_results):
+
+        batch_start_time = float(time_offset)
+
+        # Not in place, the batch arrays may be kept by the caller
+        if i > 0:
+            simulation_time_m = simulation_time_m + time_offset
+
+        # The next batch start at the last simulated time (recorded or not)
+        time_offset = last_time if i == 0 else time_offset + last_time
+
+        yield BatchRecord(
+            simulation_time_m,
+            simulation_qpos_m,
+            simulation_qvel_m,
+            simulation_qacc_m,
+            force_vector_m,
+            batch_start_time,
+        )
+
+def concatenate_batches(num_coordinates: int, batch_records: Iterable[BatchRecord]):
+    """
+    Concatenate streamed batches into the output of the generators.
+
+    The batches are collected and concatenated once at the end (linear in the number of batches). Every batch is kept
+    until then, the memory used is the whole group (twice during the concatenation) : streaming gives access to each
+    batch as soon as it is generated, it does not bound the memory of a generation (generate_data writes the batches
+    to disk as they come, see simulation_data.spool_batches).
+
+    Args:
+        num_coordinates (int): Number of coordinates in the system.
+        batch_records: iterable of BatchRecord, in batch order.
+
+    Returns:
+        tuple: (simulation_time_g, simulation_qpos_g, simulation_qvel_g, simulation_qacc_g, force_vector_g, batch_starting_times)
+    """
+    simulation_time_c = [np.empty((0,1))]
+    simulation_qpos_c = [np.empty((0,num_coordinates))]
+    simulation_qvel_c = [np.empty((0,num_coordinates))]
+    simulation_qacc_c = [np.empty((0,num_coordinates))]
+    force_vector_c = [np.empty((0,num_coordinates))]
+    batch_starting_times = []
+
+    for record in batch_records:
+        simulation_time_c.append(record.time)
+        simulation_qpos_c.append(record.qpos)
+        simulation_qvel_c.append(record.qvel)
+        simulation_qacc_c.append(record.qacc)
+        force_vector_c.append(record.forces)
+        batch_starting_times.append(record.start_time)
+
+    simulation_time_g = np.concatenate(simulation_time_c, axis=0)
+    simulation_qpos_g = np.concatenate(simulation_qpos_c, axis=0)
+    simulation_qvel_g = np.concatenate(simulation_qvel_c, axis=0)
+    simulation_qacc_g = np.concatenate(simulation_qacc_c, axis=0)
+    force_vector_g = np.concatenate(force_vector_c, axis=0)
+
+    return simulation_time_g, simulation_qpos_g, simulation_qvel_g, simulation_qacc_g, force_vector_g, batch_starting_times
+
+def stitch_batches(num_coordinates: int, batch_results):
+    """
+    Concatenate the batches of a generation, each batch start at the last simulated time of the previous one.
+
+    Args:
+        num_coordinates (int): Number of coordinates in the system.
+        batch_results: iterable of (time, qpos, qvel, qacc, forces, last_time) per batch, in batch order.
+
+    Returns:
+        tuple: (simulation_time_g, simulation_qpos_g, simulation_qvel_g, simulation_qacc_g, force_vector_g, batch_starting_times)
+    """
+    return concatenate_batches(num_coordinates, stream_batches(batch_results))
+
+class TrajectoryRecorder:
+    """
+    Record the state of a MuJoCo rollout into preallocated numpy buffers.
+
+    The buffers are sized once from the expected number of callback and grow by
+    `chunk_size` rows if the rollout runs longer, so that the control callback
+    only performs in place copies (no python allocation per step).
+    An optional `keep_mask` (see reset) restrict the copy to the selected calls.
+
+    Args:
+        nq (int): Size of the position vector (mujoco_model.nq).
+        nv (int): Size of the velocity / acceleration vector (mujoco_model.nv).
+        force_dim (int): Size of the applied force vector.
+        capacity (int): Initial number of rows of the buffers.
+        chunk_size (int): Number of rows added each time the buffers are full (default capacity // 4).
+    """
+
+    def __init__(self, nq: int, nv: int, force_dim: int, capacity: int, chunk_size: int|None = None):
+        capacity = max(int(capacity), 1)
+        self.chunk_size = chunk_size if chunk_size is not None else max(capacity // 4, 1)
+        self.time = np.empty((capacity,))
+        self.qpos = np.empty((capacity, nq))
+        self.qvel = np.empty((capacity, nv))
+        self.qacc = np.empty((capacity, nv))
+        self.forces = np.empty((capacity, force_dim))
+        self.size = 0
+        self.call_count = 0
+        self.last_time = 0.0
+        self.keep_mask = None
+
+    @classmethod
+    def from_model(cls, mujoco_model, force_dim: int, max_time: float, chunk_size: int|None = None):
+        """Build a recorder sized for a rollout of `max_time` seconds of `mujoco_model`."""
+        capacity = mujoco_callback_count(mujoco_model, max_time) + 1
+        return cls(mujoco_model.nq, mujoco_model.nv, force_dim, capacity, chunk_size)
+
+    @property
+    def capacity(self) -> int:
+        return self.time.shape[0]
+
+    def reset(self, keep_mask: np.ndarray|None = None):
+        """
+        Start a new rollout, the buffers are kept and overwritten.
+
+        Args:
+            keep_mask (np.ndarray): boolean mask over the callback calls of the rollout, only the True ones are recorded (default every call).
+        """
+        self.size = 0
+        self.call_count = 0
+        self.last_time = 0.0
+        self.keep_mask = keep_mask
+
+    def _grow(self):
+        new_capacity = self.capacity + self.chunk_size
+        for name in ("time", "qpos", "qvel", "qacc", "forces"):
+            old = getattr(self, name)
+            new = np.empty((new_capacity,) + old.shape[1:])
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def record(self, data, forces: np.ndarray):
+        """Copy the current state of `data` and the applied `forces` in the next row if the step is kept."""
+        call = self.call_count
+        self.call_count += 1
+        self.last_time = data.time
+        if self.keep_mask is not None and (call >= len(self.keep_mask) or not self.keep_mask[call]):
+            return
+        if self.size == self.capacity:
+            self._grow()
+        i = self.size
+        self.time[i] = data.time
+        self.qpos[i] = data.qpos
+        self.qvel[i] = data.qvel
+        self.qacc[i] = data.qacc
+        self.forces[i] = forces
+        self.size += 1
+
+    def get(self):
+        """
+        Return views on the recorded rows.
+
+        Returns:
+            tuple: (time, qpos, qvel, qacc, forces), time is of shape (size,1). The views are invalidated by the next reset.
+        """
+        n = self.size
+        return (
+            self.time[:n].reshape(-1, 1),
+            self.qpos[:n],
+            self.qvel[:n],
+            self.qacc[:n],
+            self.forces[:n],
+        )
+
+def stream_mujoco_trajectory(
     num_coordinates: int,
     initial_position: np.ndarray,
     initial_condition_randomness: np.ndarray,
@@ -158,13 +933,27 @@ def generate_mujoco_trajectory(
     forces_scale_vector: np.ndarray,
     mujoco_transform,
     inverse_mujoco_transform,
-):
+    sample_number: int|None = None,
+    truncation: int = 0,
+    workers: int = 1,
+) -> Iterator[BatchRecord]:
     """
     Generate a MuJoCo trajectory using physics simulation.
     
     This function creates realistic trajectories by simulating the system dynamics
     using MuJoCo physics engine with applied forces and initial conditions.
 
+    If `sample_number` is given, the decimation (see step_keep_masks) is applied at record time on the steps of the
+    concatenated batches : every step is simulated but only the first callback call of the kept steps (the state at the
+    start of the step) is copied out of MjData. The kept steps are the ones of stream_mujoco_rollout_trajectory.
+    Without `sample_number` every callback call is recorded, including the intermediate RK4 stages.
+
+    With `workers` > 1 the batches are simulated in a thread pool (one MjData per worker on the same MjModel)
+    and yielded back in batch order, the output is identical to the serial one.
+
+    The batches are yielded as soon as they are simulated. The mujoco control callback is installed until the
+    generator is exhausted or closed, so no other mujoco simulation should be stepped meanwhile.
+
     Args:
         num_coordinates (int): Number of coordinates in the system.
         initial_position (np.ndarray): Initial position configuration.
@@ -179,23 +968,20 @@ def generate_mujoco_trajectory(
         extra_info (dict): Additional system information including initial conditions.
         mujoco_transform: Function to transform MuJoCo data to desired coordinate system.
         inverse_mujoco_transform: Function to transform desired coordinates to MuJoCo format.
+        sample_number (int): Target number of sample over all the batches (default None, every step is recorded).
+        truncation (int): Number of step dropped at the start and at the end of the full recording (only used with sample_number).
+        workers (int): Number of batches simulated concurrently, each worker thread step its own MjData (default 1, serial).
 
-    Returns:
-        tuple: (simulation_time_g, simulation_qpos_g, simulation_qvel_g, simulation_qacc_g, force_vector_g)
-            - simulation_time_g (np.ndarray): Time vector for all batches.
-            - simulation_qpos_g (np.ndarray): Position trajectories for all batches.
-            - simulation_qvel_g (np.ndarray): Velocity trajectories for all batches.
-            - simulation_qacc_g (np.ndarray): Acceleration trajectories for all batches.
-            - force_vector_g (np.ndarray): Applied forces for all batches.
+    Yields:
+        BatchRecord: one record per batch, in batch order.
+            - time (np.ndarray): Time vector of the batch, shifted to its start time.
+            - qpos (np.ndarray): Position trajectory of the batch.
+            - qvel (np.ndarray): Velocity trajectory of the batch.
+            - qacc (np.ndarray): Acceleration trajectory of the batch.
+            - forces (np.ndarray): Applied forces of the batch.
+            - start_time (float): Start time of the batch.
     """
-    
-    # Initialise 
-    simulation_time_g = np.empty((0,1))
-    simulation_qpos_g = np.empty((0,num_coordinates))
-    simulation_qvel_g = np.empty((0,num_coordinates))
-    simulation_qacc_g = np.empty((0,num_coordinates))
-    force_vector_g = np.empty((0,num_coordinates))
-    batch_starting_times = []
+    import mujoco
 
     if len(initial_position)==0:
         initial_position = np.zeros((num_coordinates,2))
@@ -203,58 +989,241 @@ def generate_mujoco_trajectory(
     rng = np.random.default_rng(random_seed)
 
     # initialize Mujoco environment and controller
-    mujoco_model = mujoco.MjModel.from_xml_string(xml_content)
-    mujoco_data = mujoco.MjData(mujoco_model)
+    mujoco_model = load_mujoco_model(xml_content)
 
-    def random_controller(forces_function):
+    # The force signal is tabulated on the callback times, the control callback only does a lookup
+    callback_times = mujoco_callback_times(mujoco_model, max_time)
 
-        def ret(model, data):
+    if sample_number is None:
+        keep_masks = [None] * batch_number
+        recorder_capacity = mujoco_callback_count(mujoco_model, max_time) + 1
+    else:
+        # Select the kept steps on the whole recording, each one is recorded at the first callback call of the step
+        stage_count = mujoco_stage_count(mujoco_model)
+        kept_steps = step_keep_masks(
+            len(mujoco_step_times(mujoco_model, max_time)), batch_number, sample_number, truncation
+        )
+        keep_masks = np.zeros((batch_number, kept_steps.shape[1] * stage_count), dtype=bool)
+        keep_masks[:, ::stage_count] = kept_steps
+        recorder_capacity = int(keep_masks.sum(axis=1).max()) + 1
 
-            forces = forces_function(data.time)
-            data.qfrc_applied = forces
+    # The initial conditions are drawn in batch order so that the result does not depend on the scheduling
+    initial_conditions = draw_initial_conditions(
+        num_coordinates, initial_position, initial_condition_randomness, rng, batch_number
+    )
 
-            force_vector_m.append(forces.copy())
+    # The control callback is global to mujoco, it dispatch to the controller of each MjData
+    controllers = {}
 
-            simulation_time_m.append(data.time)
-            simulation_qpos_m.append(data.qpos.copy())
-            simulation_qvel_m.append(data.qvel.copy())
-            simulation_qacc_m.append(data.qacc.copy())
+    def random_controller(model, data):
 
-        return ret
-    
-    
-    for i in tqdm(range(batch_number),desc="Generating batches", unit="batch"):
+        # the MjData of a batch being primed (see simulate_batch)
+        if id(data) not in controllers:
+            return
 
-        # Record batch starting time
-        batch_start_time = 0.0 if len(simulation_time_g) == 0 else np.max(simulation_time_g)
-        batch_starting_times.append(float(batch_start_time))
+        forces_function, recorder = controllers[id(data)]
 
-        # Random controller initialisation. This is the only random place of the code Everything else is deterministic (except if non deterministic solver is used)
-        simulation_time_m = []
-        simulation_qpos_m = []
-        simulation_qvel_m = []
-        simulation_qacc_m = []
-        force_vector_m = []
+        forces = forces_function(data.time)
+        data.qfrc_applied = forces
 
-        # Initial condition
-        initial_condition = np.array(initial_position).reshape(num_coordinates,2)
+        recorder.record(data, forces)
 
-        if len(initial_condition_randomness) == 1:
-            initial_condition += rng.normal(
-                loc=0, scale=initial_condition_randomness, size=initial_condition.shape
+    # One MjData and recorder per worker, handed over to the batches through a queue
+    workspaces = queue.Queue()
+    for _ in range(max(workers, 1)):
+        workspaces.put((
+            mujoco.MjData(mujoco_model),
+            TrajectoryRecorder(mujoco_model.nq, mujoco_model.nv, num_coordinates, recorder_capacity),
+        ))
+
+    def simulate_batch(i):
+
+        mujoco_data, recorder = workspaces.get()
+
+        try:
+            # Random controller initialisation. This is the only random place of the code Everything else is deterministic (except if non deterministic solver is used)
+            recorder.reset(keep_masks[i])
+
+            forces_function = generate_forces_function(
+                component_count=num_coordinates,
+                scale_vector=forces_scale_vector,
+                time_end=max_time,
+                random_seed=[random_seed,i],
+                time_grid=callback_times,
+            )
+
+            initial_condition = initial_conditions[i]
+            initial_qpos,initial_qvel = initial_condition[:,0].reshape(1,-1),initial_condition[:,1].reshape(1,-1)
+
+            initial_qpos,initial_qvel,_ = inverse_mujoco_transform(initial_qpos,initial_qvel,None)
+
+            # the MjData of a worker is reused, nothing (qacc, warmstart, ...) should leak from its previous batch
+            mujoco.mj_resetData(mujoco_model, mujoco_data)
+            mujoco_data.qpos = initial_qpos
+            mujoco_data.qvel = initial_qvel
+            mujoco_data.time = 0.0
+
+            # the first callback of a step records the qacc of the previous evaluation, at the first step it is the
+            # initial acceleration computed here (without recording) under the initial force
+            mujoco_data.qfrc_applied = forces_function(0.0)
+            mujoco.mj_forward(mujoco_model, mujoco_data)
+
+            controllers[id(mujoco_data)] = (forces_function, recorder)
+
+            pbar_2 = tqdm(
+                total=max_time,
+                desc="Running Mujoco simulation",
+                unit="s",
+                leave=False,
+                miniters=1,
+                disable=workers > 1,
+            )
+            while mujoco_data.time < max_time:
+                mujoco.mj_step(mujoco_model, mujoco_data)
+                pbar_2.update(mujoco_data.time - pbar_2.n)
+            pbar_2.close()
+
+            if sample_number is not None and recorder.call_count != keep_masks.shape[1]:
+                logger.warning(f"Unexpected callback count in batch {i}: {recorder.call_count} instead of {keep_masks.shape[1]}")
+
+            # copy out of the recorder (its buffers are reused on the next batch) and transform the data if needed
+            (simulation_time_m,
+             simulation_qpos_m,
+             simulation_qvel_m,
+             simulation_qacc_m,
+             force_vector_m) = (array.copy() for array in recorder.get())
+
+            simulation_qpos_m, simulation_qvel_m, simulation_qacc_m = mujoco_transform(
+                simulation_qpos_m, simulation_qvel_m, simulation_qacc_m
             )
+
+            return simulation_time_m, simulation_qpos_m, simulation_qvel_m, simulation_qacc_m, force_vector_m, recorder.last_time
+
+        finally:
+            controllers.pop(id(mujoco_data), None)
+            workspaces.put((mujoco_data, recorder))
+
+    with temporary_callback(mujoco.set_mjcb_control, random_controller):
+
+        if workers > 1:
+            # mj_step release the GIL, batches are independent and yielded back in order
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                yield from stream_batches(tqdm(
+                    executor.map(simulate_batch, range(batch_number)),
+                    total=batch_number,
+                    desc="Generating batches",
+                    unit="batch",
+                ))
         else:
-            initial_condition += rng.normal(
-                loc=0, scale=np.reshape(initial_condition_randomness,initial_condition.shape)
+            yield from stream_batches(
+                simulate_batch(i) for i in tqdm(range(batch_number),desc="Generating batches", unit="batch")
             )
 
+    del mujoco_model, workspaces
+
+def generate_mujoco_trajectory(
+    num_coordinates: int,
+    initial_position: np.ndarray,
+    initial_condition_randomness: np.ndarray,
+    random_seed: List[int],
+    batch_number: int,
+    max_time: float,
+    xml_content: str,
+    forces_scale_vector: np.ndarray,
+    mujoco_transform,
+    inverse_mujoco_transform,
+    sample_number: int|None = None,
+    truncation: int = 0,
+    workers: int = 1,
+):
+    """
+    Generate a MuJoCo trajectory, all the batches of stream_mujoco_trajectory concatenated.
+
+    Returns:
+        tuple: (simulation_time_g, simulation_qpos_g, simulation_qvel_g, simulation_qacc_g, force_vector_g, batch_starting_times)
+    """
+    return concatenate_batches(num_coordinates, stream_mujoco_trajectory(
+        num_coordinates,
+        initial_position,
+        initial_condition_randomness,
+        random_seed,
+        batch_number,
+        max_time,
+        xml_content,
+        forces_scale_vector,
+        mujoco_transform,
+        inverse_mujoco_transform,
+        sample_number=sample_number,
+        truncation=truncation,
+        workers=workers,
+    ))
+
+def stream_mujoco_rollout_trajectory(
+    num_coordinates: int,
+    initial_position: np.ndarray,
+    initial_condition_randomness: np.ndarray,
+    random_seed: List[int],
+    batch_number: int,
+    max_time: float,
+    xml_content: str,
+    forces_scale_vector: np.ndarray,
+    mujoco_transform,
+    inverse_mujoco_transform,
+    sample_number: int|None = None,
+    truncation: int = 0,
+    workers: int = 1,
+) -> Iterator[BatchRecord]:
+    """
+    Generate a MuJoCo trajectory with the native rollout API (mujoco.rollout).
+
+    Same inputs and outputs as stream_mujoco_trajectory, but there is no python callback during the simulation :
+    the force of every batch is tabulated on the step grid and handed to the rollout as qfrc_applied control.
+    All the batches are rolled out in a single call, on `workers` threads.
+
+    One sample is recorded per step (the state at the start of the step) and the acceleration of the kept samples
+    is recomputed with mj_forward. With `sample_number` the kept steps are the ones of stream_mujoco_trajectory
+    (see step_keep_masks). The force is held constant during a step while the callback backend evaluates it
+    at every integrator stage, so the two backends agree up to the integration error (checked by check_mujoco_backends).
+
+    Yields:
+        BatchRecord: one record per batch, in batch order (every batch is rolled out before the first one is yielded).
+    """
+    import mujoco
+    from mujoco import rollout
+
+    if len(initial_position)==0:
+        initial_position = np.zeros((num_coordinates,2))
+
+    rng = np.random.default_rng(random_seed)
+
+    mujoco_model = load_mujoco_model(xml_content)
+    mujoco_data = mujoco.MjData(mujoco_model)
+
+    step_times = mujoco_step_times(mujoco_model, max_time)
+    step_number = len(step_times)
+
+    state_spec = mujoco.mjtState.mjSTATE_FULLPHYSICS
+    state_size = mujoco.mj_stateSize(mujoco_model, state_spec)
+
+    initial_conditions = draw_initial_conditions(
+        num_coordinates, initial_position, initial_condition_randomness, rng, batch_number
+    )
+
+    initial_state = np.empty((batch_number, state_size))
+    control = np.empty((batch_number, step_number, mujoco_model.nv))
+
+    for i in range(batch_number):
+
+        initial_condition = initial_conditions[i]
         initial_qpos,initial_qvel = initial_condition[:,0].reshape(1,-1),initial_condition[:,1].reshape(1,-1)
 
         initial_qpos,initial_qvel,_ = inverse_mujoco_transform(initial_qpos,initial_qvel,None)
 
+        mujoco.mj_resetData(mujoco_model, mujoco_data)
         mujoco_data.qpos = initial_qpos
         mujoco_data.qvel = initial_qvel
         mujoco_data.time = 0.0
+        mujoco.mj_getState(mujoco_model, mujoco_data, initial_state[i], state_spec)
 
         forces_function = generate_forces_function(
             component_count=num_coordinates,
@@ -262,41 +1231,92 @@ def generate_mujoco_trajectory(
             time_end=max_time,
             random_seed=[random_seed,i],
         )
+        control[i] = forces_function(step_times).T
 
-        with temporary_callback(mujoco.set_mjcb_control, random_controller(forces_function)):
+    logger.info(f"Rolling out {batch_number} batches of {step_number} steps")
 
-            pbar_2 = tqdm(
-                total=max_time,
-                desc="Running Mujoco simulation",
-                unit="s",
-                leave=False,
-                miniters=1,
-            )
-            while mujoco_data.time < max_time:
-                mujoco.mj_step(mujoco_model, mujoco_data)
-                pbar_2.update(mujoco_data.time - pbar_2.n)
-            pbar_2.close()
-            
+    state, _ = rollout.rollout(
+        mujoco_model,
+        [mujoco.MjData(mujoco_model) for _ in range(max(workers, 1))],
+        initial_state,
+        control,
+        control_spec=mujoco.mjtState.mjSTATE_QFRC_APPLIED.value,
+    )
 
-            # turn the result into a numpy array, and transform the data if needed
-        simulation_qpos_m, simulation_qvel_m, simulation_qacc_m = mujoco_transform(
-            np.array(simulation_qpos_m), np.array(simulation_qvel_m), np.array(simulation_qacc_m)
-        )
-        simulation_time_m = np.array(simulation_time_m).reshape(-1, 1)
-        force_vector_m = np.array(force_vector_m)
+    # State at the start of each step : the initial state followed by the output of every step but the last
+    start_state = np.concatenate((initial_state[:, None, :], state[:, :-1, :]), axis=1)
+
+    if sample_number is None:
+        keep_masks = np.ones((batch_number, step_number), dtype=bool)
+    else:
+        keep_masks = step_keep_masks(step_number, batch_number, sample_number, truncation)
+
+    nq, nv = mujoco_model.nq, mujoco_model.nv
+
+    def batch_results():
 
-        if len(simulation_qvel_g) >0:
-            simulation_time_m += np.max(simulation_time_g)
+        for i in range(batch_number):
 
-        # Concatenate the data
-        simulation_time_g = np.concatenate((simulation_time_g, simulation_time_m), axis=0)
-        simulation_qpos_g = np.concatenate((simulation_qpos_g, simulation_qpos_m), axis=0)
-        simulation_qvel_g = np.concatenate((simulation_qvel_g, simulation_qvel_m), axis=0)
-        simulation_qacc_g = np.concatenate((simulation_qacc_g, simulation_qacc_m), axis=0)
-        force_vector_g = np.concatenate((force_vector_g, force_vector_m), axis=0)
+            kept_state = start_state[i, keep_masks[i]]
+            force_vector_m = control[i, keep_masks[i]]
+
+            simulation_time_m = kept_state[:, 0].reshape(-1, 1)
+            simulation_qpos_m = kept_state[:, 1:1 + nq]
+            simulation_qvel_m = kept_state[:, 1 + nq:1 + nq + nv]
+
+            # Recompute the exact acceleration of the kept samples
+            simulation_qacc_m = np.empty((len(kept_state), nv))
+            for j in range(len(kept_state)):
+                mujoco.mj_setState(mujoco_model, mujoco_data, kept_state[j], state_spec)
+                mujoco_data.qfrc_applied = force_vector_m[j]
+                mujoco.mj_forward(mujoco_model, mujoco_data)
+                simulation_qacc_m[j] = mujoco_data.qacc
+
+            simulation_qpos_m, simulation_qvel_m, simulation_qacc_m = mujoco_transform(
+                simulation_qpos_m, simulation_qvel_m, simulation_qacc_m
+            )
+
+            yield simulation_time_m, simulation_qpos_m, simulation_qvel_m, simulation_qacc_m, force_vector_m, state[i, -1, 0]
+
+    yield from stream_batches(batch_results())
 
     del mujoco_model, mujoco_data
 
-    return simulation_time_g, simulation_qpos_g, simulation_qvel_g, simulation_qacc_g, force_vector_g, batch_starting_times
+def generate_mujoco_rollout_trajectory(
+    num_coordinates: int,
+    initial_position: np.ndarray,
+    initial_condition_randomness: np.ndarray,
+    random_seed: List[int],
+    batch_number: int,
+    max_time: float,
+    xml_content: str,
+    forces_scale_vector: np.ndarray,
+    mujoco_transform,
+    inverse_mujoco_transform,
+    sample_number: int|None = None,
+    truncation: int = 0,
+    workers: int = 1,
+):
+    """
+    Generate a MuJoCo trajectory with the native rollout API, all the batches of stream_mujoco_rollout_trajectory concatenated.
+
+    Returns:
+        tuple: (simulation_time_g, simulation_qpos_g, simulation_qvel_g, simulation_qacc_g, force_vector_g, batch_starting_times)
+    """
+    return concatenate_batches(num_coordinates, stream_mujoco_rollout_trajectory(
+        num_coordinates,
+        initial_position,
+        initial_condition_randomness,
+        random_seed,
+        batch_number,
+        max_time,
+        xml_content,
+        forces_scale_vector,
+        mujoco_transform,
+        inverse_mujoco_transform,
+        sample_number=sample_number,
+        truncation=truncation,
+        workers=workers,
+    ))
 
     
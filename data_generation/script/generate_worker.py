@@ -0,0 +1,98 @@
+"""
+Long lived generation worker : generate every DataGenerationParams of a queue inside the same interpreter.
+
+The queue is a JSONL file (or stdin with "-"), one DataGenerationParams per line, e.g. the output of
+create_generate_experiment_file.py --jobs-output. The imports, the xlsindy components, the compiled models and the
+acceleration functions are shared between the jobs, the data and json written are the same as one generate_data run per job.
+
+exemple:
+python -m data_generation.script.generate_worker --jobs data_generation/generate_all_experiments.jsonl
+"""
+
+from dataclasses import dataclass
+import tyro
+
+import sys
+import os
+import time
+
+from data_generation.script.generate_data import generate_data
+
+from data_generation.script.dataclass import DataGenerationParams
+from data_generation.script.util import setup_logger
+
+logger = setup_logger(__name__)
+
+@dataclass
+class Args:
+    jobs: str = "-"
+    """the JSONL file of DataGenerationParams to generate, "-" to read them from stdin (default stdin)"""
+    skip_already_done: bool = True
+    """if true, skip the jobs whose data already exists (default true)"""
+    generation_workers: int = 1
+    """the number of batches simulated concurrently in mujoco generation, one MjData per thread (default 1)"""
+    acceleration_cache_dir: str|None = None
+    """if set, the folder where the symbolic acceleration systems are persisted and shared between runs (default in memory only)"""
+    mujoco_model_cache_dir: str|None = None
+    """if set, the folder where the compiled mujoco models are stored in binary form and shared between runs (default in memory only)"""
+    component_cache_dir: str|None = None
+    """if set, the folder where the xlsindy_component outputs (catalog, symbols, ideal solution) are cached between runs (default in memory only)"""
+    data_format: str = "columnar"
+    """the format of results_data : "columnar" (one .npy per array, memory mapped by align_data) or "pickle" (legacy dict of arrays) (default columnar)"""
+    series_format: str = "json"
+    """the format of the series in results/ : "json" (inline float lists, read by the site) or "sidecar" (binary {UID}.series.bin next to a slim json) (default json)"""
+
+def read_jobs(jobs: str):
+    """Yield the DataGenerationParams of a JSONL file or of stdin, blank lines are ignored."""
+    stream = sys.stdin if jobs == "-" else open(jobs, "r")
+    try:
+        for line in stream:
+            if line.strip():
+                yield DataGenerationParams.model_validate_json(line)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+if __name__ == "__main__":
+
+    args = tyro.cli(Args)
+
+    from data_generation.script.acceleration_function import configure_acceleration_cache
+    from data_generation.script.generate_trajectory import configure_mujoco_model_cache
+
+    configure_acceleration_cache(cache_dir=args.acceleration_cache_dir)
+    configure_mujoco_model_cache(cache_dir=args.mujoco_model_cache_dir)
+
+    successful = 0
+    skipped = 0
+    failed = 0
+
+    for i, params in enumerate(read_jobs(args.jobs)):
+
+        if args.skip_already_done and os.path.exists(f"results/{params.UID}.json"):
+            logger.info(f"[{i+1}] Data already exists for UID {params.UID}, skipping generation")
+            skipped += 1
+            continue
+
+        start_time = time.perf_counter()
+
+        try:
+            generate_data(
+                params,
+                generation_workers=args.generation_workers,
+                component_cache_dir=args.component_cache_dir,
+                data_format=args.data_format,
+                series_format=args.series_format,
+            )
+        except Exception as e:
+            logger.error(f"[{i+1}] Generation failed for UID {params.UID}: {e}")
+            failed += 1
+            continue
+
+        logger.info(f"[{i+1}] Generated UID {params.UID} in {time.perf_counter() - start_time:.2f} seconds")
+        successful += 1
+
+    logger.info(f"Worker done : {successful} generated, {skipped} skipped, {failed} failed")
+
+    if failed > 0:
+        sys.exit(1)
@@ -0,0 +1,308 @@
+"""
+JAX rollout engine for the theoretical generator.
+The integration of every batch is a single jitted program : a RK4 in a lax.scan over time, vmapped over the batches,
+the force signal of each batch is tabulated at every stage time beforehand (see generate_forces_function).
+"""
+import logging
+import numpy as np
+
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import xlsindy
+
+import sympy as sp
+
+import jax
+import jax.numpy as jnp
+
+from data_generation.script.compilation_cache import padded_length
+from data_generation.script.experiment_matrix import expanded_catalog as cached_expanded_catalog
+from data_generation.script.generate_trajectory import generate_forces_function, draw_initial_conditions
+from data_generation.script.generate_trajectory import BatchRecord, DivergenceGuard, concatenate_batches, stream_batches
+
+logger = logging.getLogger(__name__)
+
+# In process caches, the catalog system and the jitted rollout only depend on the catalog (not on the solution vector)
+_catalog_systems: Dict[Tuple, "CatalogSystem"] = {}
+_compiled_rollouts: Dict[Tuple, Callable] = {}
+
+class CatalogSystem:
+    """
+    The linear system A(q,q_d) q_dd = b(q,q_d,f) of a catalog, kept linear in the solution vector.
+
+    Every term l of the expanded catalog is split into its own A_l and b_l, so that for a solution vector c
+    A = sum_l c_l A_l and b = sum_l c_l b_l. Only the non zero entries are lambdified (with jax), the solution vector
+    is then a plain argument of the acceleration function and a compiled rollout can be reused for any solution of the catalog.
+
+    Args:
+        solution_catalog (xlsindy.catalog.CatalogRepartition): the catalog of the solution.
+        symbols_matrix (np.ndarray): the symbolic matrix (forces, positions, velocities, accelerations).
+    """
+
+    def __init__(self, solution_catalog: xlsindy.catalog.CatalogRepartition, symbols_matrix: np.ndarray):
+
+        expanded_catalog = cached_expanded_catalog(solution_catalog)
+        term_number, num_coordinates = expanded_catalog.shape
+
+        self.num_coordinates = num_coordinates
+        self.term_number = term_number
+
+        entries = []
+        entry_term = []
+        entry_slot = []
+        # qdd_mask[l,i] is true if the term l bring the acceleration of coordinate i in the equation i
+        self.qdd_mask = np.zeros((term_number, num_coordinates), dtype=bool)
+
+        for l in range(term_number):
+            for i in range(num_coordinates):
+                equation = sp.sympify(expanded_catalog[l, i])
+                for j in range(num_coordinates):
+                    equation = equation.collect(symbols_matrix[3, j])
+                    term = equation.coeff(symbols_matrix[3, j])
+                    equation -= term * symbols_matrix[3, j]
+                    if term != 0:
+                        entries.append(-term)
+                        entry_term.append(l)
+                        entry_slot.append(i * num_coordinates + j)
+                        if i == j:
+                            self.qdd_mask[l, i] = True
+                if equation != 0:
+                    entries.append(equation)
+                    entry_term.append(l)
+                    entry_slot.append(num_coordinates**2 + i)
+
+        self.entry_term = np.array(entry_term, dtype=int)
+        self.entry_slot = np.array(entry_slot, dtype=int)
+        self.entries_func = sp.lambdify([symbols_matrix], entries, "jax")
+
+    def is_valid(self, solution_vector: np.ndarray) -> bool:
+        """Same check as xlsindy generate_acceleration_function : every equation should contain its acceleration."""
+        active = np.reshape(solution_vector, (-1,)) != 0
+        return bool(np.all(np.any(self.qdd_mask[active], axis=0)))
+
+    def acceleration(self, coefficients, forces, qpos, qvel):
+        """Acceleration of a single state, every array of shape (num_coordinates,), coefficients of shape (term_number,)."""
+        n = self.num_coordinates
+        input_matrix = jnp.stack([forces, qpos, qvel, jnp.zeros_like(qpos)])
+
+        values = jnp.stack([jnp.asarray(value, dtype=qpos.dtype) for value in self.entries_func(input_matrix)])
+        slots = jax.ops.segment_sum(
+            coefficients[self.entry_term] * values, self.entry_slot, num_segments=n * n + n
+        )
+
+        return jnp.linalg.solve(slots[:n * n].reshape(n, n), slots[n * n:])
+
+def get_catalog_system(
+    solution_catalog: xlsindy.catalog.CatalogRepartition,
+    symbols_matrix: np.ndarray,
+    reuse_compiled: bool = True,
+) -> CatalogSystem:
+    """Return the CatalogSystem of the catalog, built once per process if `reuse_compiled`."""
+    key = (tuple(solution_catalog.label()), str(symbols_matrix))
+    if reuse_compiled and key in _catalog_systems:
+        return _catalog_systems[key]
+    catalog_system = CatalogSystem(solution_catalog, symbols_matrix)
+    if reuse_compiled:
+        _catalog_systems[key] = catalog_system
+    return catalog_system
+
+def build_rollout(catalog_system: CatalogSystem) -> Callable:
+    """
+    Build the jitted rollout of a catalog.
+
+    Returns:
+        function: rollout(coefficients, stage_forces, initial_conditions, times) -> (qpos, qvel, qacc, forces)
+            with initial_conditions of shape (batch, num_coordinates, 2), stage_forces of shape
+            (batch, 3, len(times), num_coordinates) the forces at the start, middle and end of every step,
+            times the fixed step time grid and every output of shape (batch, len(times), num_coordinates).
+    """
+
+    acceleration = catalog_system.acceleration
+
+    def single_rollout(coefficients, stage_forces, initial_condition, times):
+
+        time_step = times[1] - times[0]
+
+        def derivative(forces, qpos, qvel):
+            return qvel, acceleration(coefficients, forces, qpos, qvel)
+
+        def step(carry, step_forces):
+            qpos, qvel = carry
+
+            forces, middle_forces, end_forces = step_forces
+            k1_pos, k1_vel = qvel, acceleration(coefficients, forces, qpos, qvel)
+            k2_pos, k2_vel = derivative(middle_forces, qpos + time_step / 2 * k1_pos, qvel + time_step / 2 * k1_vel)
+            k3_pos, k3_vel = derivative(middle_forces, qpos + time_step / 2 * k2_pos, qvel + time_step / 2 * k2_vel)
+            k4_pos, k4_vel = derivative(end_forces, qpos + time_step * k3_pos, qvel + time_step * k3_vel)
+
+            next_qpos = qpos + time_step / 6 * (k1_pos + 2 * k2_pos + 2 * k3_pos + k4_pos)
+            next_qvel = qvel + time_step / 6 * (k1_vel + 2 * k2_vel + 2 * k3_vel + k4_vel)
+
+            return (next_qpos, next_qvel), (qpos, qvel, k1_vel, forces)
+
+        _, outputs = jax.lax.scan(
+            step, (initial_condition[:, 0], initial_condition[:, 1]), (stage_forces[0], stage_forces[1], stage_forces[2])
+        )
+        return outputs
+
+    return jax.jit(jax.vmap(single_rollout, in_axes=(None, 0, 0, None)))
+
+def get_rollout(
+    solution_catalog: xlsindy.catalog.CatalogRepartition,
+    symbols_matrix: np.ndarray,
+    reuse_compiled: bool = True,
+) -> Tuple[CatalogSystem, Callable]:
+    """Return the CatalogSystem and jitted rollout of the catalog, jax keep the compiled executable of each input shape."""
+    catalog_system = get_catalog_system(solution_catalog, symbols_matrix, reuse_compiled)
+    key = (tuple(solution_catalog.label()), str(symbols_matrix))
+    if reuse_compiled and key in _compiled_rollouts:
+        return catalog_system, _compiled_rollouts[key]
+    rollout = build_rollout(catalog_system)
+    if reuse_compiled:
+        _compiled_rollouts[key] = rollout
+    return catalog_system, rollout
+
+def stream_jax_trajectory(
+    num_coordinates: int,
+    initial_position: np.ndarray,
+    initial_condition_randomness: np.ndarray,
+    random_seed: List[int],
+    batch_number: int,
+    max_time: float,
+    solution_vector: np.ndarray,
+    solution_catalog: xlsindy.catalog.CatalogRepartition,
+    time_symb: sp.Symbol,
+    symbols_matrix: np.ndarray,
+    forces_scale_vector: np.ndarray,
+    time_step: float = 0.005,
+    reuse_compiled: bool = True,
+    divergence_guard: DivergenceGuard|None = None,
+) -> Iterator[BatchRecord]:
+    """
+    Generate a theoretical trajectory with the JAX rollout engine.
+
+    Same inputs and outputs as stream_theoretical_trajectory. Every batch is integrated at once on CPU in double precision
+    with a fixed step RK4 (see build_rollout), the recorded acceleration is the model acceleration at each sample.
+
+    Args:
+        time_step (float): the fixed integration step, also the sampling period of the output (default 0.005).
+        reuse_compiled (bool): if true, the catalog system and the compiled rollout are kept for the next call on the same catalog (default true).
+        divergence_guard (DivergenceGuard): if given, each batch is truncated at its first state out of the bound of the guard (default None).
+            The compiled rollout always runs to the end, only the recorded trajectory is cut.
+
+    Yields:
+        BatchRecord: one record per batch, in batch order (every batch is rolled out before the first one is yielded).
+    """
+
+    if len(initial_position)==0:
+        initial_position = np.zeros((num_coordinates,2))
+
+    rng = np.random.default_rng(random_seed)
+
+    catalog_system, rollout = get_rollout(solution_catalog, symbols_matrix, reuse_compiled)
+
+    if not catalog_system.is_valid(solution_vector):
+        raise ValueError("The solution vector does not give a valid acceleration function")
+
+    initial_conditions = np.array(draw_initial_conditions(
+        num_coordinates, initial_position, initial_condition_randomness, rng, batch_number
+    ))
+
+    step_number = int(round(max_time / time_step))
+    simulation_time_m = time_step * np.arange(step_number + 1)
+
+    # with the persistent compilation cache, the rollout runs on a padded time grid whose executable is shared by the
+    # close validation times, the padded steps are dropped
+    padded_time_m = time_step * np.arange(padded_length(step_number + 1))
+
+    # Every stage time of the RK4 (start, middle and end of each step)
+    stage_times = np.concatenate((padded_time_m, padded_time_m + time_step / 2, padded_time_m + time_step))
+
+    # The forces of every batch at every stage time, tabulated once : (batch, stage, step, num_coordinates)
+    stage_forces = np.stack([
+        generate_forces_function(
+            component_count=num_coordinates,
+            scale_vector=forces_scale_vector,
+            time_end=max_time,
+            random_seed=[random_seed,i],
+            time_grid=stage_times,
+        ).lookup(stage_times).reshape(3, len(padded_time_m), num_coordinates)
+        for i in range(batch_number)
+    ])
+
+    logger.info("theoretical jax initialized")
+
+    with jax.enable_x64(True), jax.default_device(jax.devices("cpu")[0]):
+        qpos, qvel, qacc, forces = rollout(
+            jnp.asarray(np.reshape(solution_vector, (-1,)), dtype=jnp.float64),
+            jnp.asarray(stage_forces, dtype=jnp.float64),
+            jnp.asarray(initial_conditions, dtype=jnp.float64),
+            jnp.asarray(padded_time_m, dtype=jnp.float64),
+        )
+        qpos, qvel, qacc, forces = (
+            np.asarray(array[:, :step_number + 1]) for array in (qpos, qvel, qacc, forces)
+        )
+
+    logger.info("theoretical jax simulation done")
+
+    # number of samples kept in each batch
+    batch_steps = [step_number + 1] * batch_number
+    if divergence_guard is not None:
+        for i in range(batch_number):
+            first_out = divergence_guard.first_out_of_bound(qpos[i], qvel[i])
+            if first_out is not None:
+                batch_steps[i] = first_out + 1
+                divergence_guard.stop(DivergenceGuard.DIVERGED, simulation_time_m[first_out])
+
+    batch_results = (
+        (
+            simulation_time_m[:batch_steps[i]].reshape(-1, 1).copy(),
+            qpos[i, :batch_steps[i]],
+            qvel[i, :batch_steps[i]],
+            qacc[i, :batch_steps[i]],
+            forces[i, :batch_steps[i]],
+            simulation_time_m[batch_steps[i] - 1],
+        )
+        for i in range(batch_number)
+    )
+
+    yield from stream_batches(batch_results)
+
+def generate_jax_trajectory(
+    num_coordinates: int,
+    initial_position: np.ndarray,
+    initial_condition_randomness: np.ndarray,
+    random_seed: List[int],
+    batch_number: int,
+    max_time: float,
+    solution_vector: np.ndarray,
+    solution_catalog: xlsindy.catalog.CatalogRepartition,
+    time_symb: sp.Symbol,
+    symbols_matrix: np.ndarray,
+    forces_scale_vector: np.ndarray,
+    time_step: float = 0.005,
+    reuse_compiled: bool = True,
+    divergence_guard: DivergenceGuard|None = None,
+):
+    """
+    Generate a theoretical trajectory with the JAX rollout engine, all the batches of stream_jax_trajectory concatenated.
+
+    Returns:
+        tuple: (simulation_time_g, simulation_qpos_g, simulation_qvel_g, simulation_qacc_g, force_vector_g, batch_starting_times)
+    """
+    return concatenate_batches(num_coordinates, stream_jax_trajectory(
+        num_coordinates,
+        initial_position,
+        initial_condition_randomness,
+        random_seed,
+        batch_number,
+        max_time,
+        solution_vector,
+        solution_catalog,
+        time_symb,
+        symbols_matrix,
+        forces_scale_vector,
+        time_step=time_step,
+        reuse_compiled=reuse_compiled,
+        divergence_guard=divergence_guard,
+    ))
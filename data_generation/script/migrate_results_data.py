@@ -0,0 +1,94 @@
+"""
+Convert the pickled simulation data of results_data/ to the columnar format of simulation_data.py.
+
+Every `{UID}.pkl` without a columnar folder `{UID}/` is converted and checked array by array, with `--remove-pickle`
+an existing folder is checked the same way before its pickle is removed. The experiment json are
+not modified : their data_path still ends with `.pkl` and load_simulation_data picks the columnar folder next to it.
+
+exemple:
+python -m data_generation.script.migrate_results_data --results-data-dir results_data --remove-pickle
+"""
+
+from dataclasses import dataclass
+import tyro
+
+import glob
+import os
+import pickle
+
+import numpy as np
+
+from data_generation.script.simulation_data import array_names,load_simulation_data,save_simulation_data
+from data_generation.script.util import setup_logger
+
+logger = setup_logger(__name__)
+
+@dataclass
+class Args:
+    results_data_dir: str = "results_data"
+    """the folder of the simulation data to convert (default results_data)"""
+    remove_pickle: bool = False
+    """if true, remove each pickle once its columnar copy has been checked (default false)"""
+
+def check_columnar_copy(pickle_path: str, data_path: str, data: dict) -> None:
+    """
+    Check that the columnar folder holds the same arrays as the pickle.
+
+    Raises:
+        ValueError: if an array is missing from the columnar folder or differs from the pickle.
+    """
+    stored = load_simulation_data(data_path)
+    for name in array_names():
+        if name not in stored:
+            raise ValueError(f"{name} of {pickle_path} is missing from {data_path}")
+        if not np.array_equal(stored[name], data[name]):
+            raise ValueError(f"{name} of {pickle_path} differs from {data_path}")
+
+def migrate_pickle(pickle_path: str, remove_pickle: bool = False) -> bool:
+    """
+    Convert one pickle to a columnar folder next to it.
+
+    The pickle is only removed once the columnar folder has been checked against it, including a folder which
+    already existed.
+
+    Returns:
+        bool: true if the pickle has been converted, false if the columnar folder already existed.
+    """
+    data_path = pickle_path[:-len(".pkl")]
+
+    converted = not os.path.isdir(data_path)
+
+    if not converted and not remove_pickle:
+        return converted
+
+    with open(pickle_path, "rb") as f:
+        data = pickle.load(f)
+
+    if converted:
+        save_simulation_data(data_path, data)
+
+    check_columnar_copy(pickle_path, data_path, data)
+
+    if remove_pickle:
+        os.remove(pickle_path)
+
+    return converted
+
+if __name__ == "__main__":
+
+    args = tyro.cli(Args)
+
+    pickle_paths = sorted(glob.glob(os.path.join(args.results_data_dir, "*.pkl")))
+
+    converted = 0
+    failed = 0
+
+    for pickle_path in pickle_paths:
+        try:
+            if migrate_pickle(pickle_path, remove_pickle=args.remove_pickle):
+                converted += 1
+        except Exception as e:
+            logger.error(f"Failed to convert {pickle_path}: {e}")
+            failed += 1
+
+    logger.info(f"{converted} converted, {len(pickle_paths) - converted - failed} already converted, {failed} failed")
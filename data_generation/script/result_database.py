@@ -21,6 +21,7 @@ from tqdm import tqdm
 import tyro
 
 from data_generation.script.dataclass import Experiment, TrajectoryData, Series
+from data_generation.script.experiment_io import load_experiment as load_experiment_file
 
 
 def setup_logging(verbose: bool = False) -> None:
@@ -34,11 +35,9 @@ def setup_logging(verbose: bool = False) -> None:
 
 
 def load_experiment(file_path: str) -> Optional[Experiment]:
-    """Load and parse an experiment JSON file safely."""
+    """Load and parse an experiment JSON file safely (inline or with a series sidecar), a series is parsed by trajectory.load_series()."""
     try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-            return Experiment(**data)
+        return load_experiment_file(file_path, series="lazy")
     except (json.JSONDecodeError, IOError, Exception) as e:
         logging.error(f"Failed to load {file_path}: {e}")
         return None
@@ -60,10 +59,11 @@ def compute_end_simulation_time(trajectory: TrajectoryData) -> Optional[float]:
         The last non-zero time value, or None if no time data found
     """
     try:
-        if not trajectory.series or not trajectory.series.time:
+        series = trajectory.load_series()
+        if not series or not series.time:
             return None
             
-        time_array = np.array(trajectory.series.time.time)
+        time_array = np.array(series.time.time)
         
         if len(time_array) == 0:
             return None
@@ -136,6 +136,7 @@ def extract_trajectory_data(experiment: Experiment,
             'regression_time': rr.regression_time,
             'RMSE_acceleration': rr.RMSE_acceleration,
             'RMSE_validation_position': rr.RMSE_validation_position,
+            'validation_stop_reason': rr.validation_stop_reason,
         })
     else:
         # Set defaults if no regression result
@@ -150,6 +151,7 @@ def extract_trajectory_data(experiment: Experiment,
             'regression_time': None,
             'RMSE_acceleration': None,
             'RMSE_validation_position': None,
+            'validation_stop_reason': None,
         })
     
     # Extract validation error from regression result
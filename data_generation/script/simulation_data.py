@@ -0,0 +1,228 @@
+"""
+Storage of the simulation data of an experiment (results_data/).
+
+The ten arrays of an experiment (time, qpos, qvel, qacc and forces of the training and of the validation trajectory)
+are stored column wise : one uncompressed `.npy` file per array in the folder `results_data/{UID}/`, with an
+`index.json` listing the arrays, their group, shape and dtype. The arrays are opened memory mapped, so align_data only
+reads the pages of the slice it uses.
+
+The previous format (a pickled dict in `results_data/{UID}.pkl`) is still read by load_simulation_data, and can be
+converted with migrate_results_data.py.
+
+generate_data writes the streamed batches of a generation to a spool folder as they come (spool_batches), so that only
+one batch is in memory, and reads them back memory mapped (load_spooled_batches) to decimate them.
+"""
+import json
+import logging
+import os
+import pickle
+import shutil
+
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+GROUPS = ("training", "validation")
+"""the trajectory groups of an experiment"""
+
+FIELDS = (
+    "simulation_time",
+    "simulation_qpos",
+    "simulation_qvel",
+    "simulation_qacc",
+    "force_vector",
+)
+"""the arrays of a group, the stored name is f"{field}_{group}" """
+
+INDEX_FILE = "index.json"
+
+FORMAT_VERSION = 1
+
+def array_names(group: str|None = None) -> list:
+    """Stored names of the arrays of a group (every group if None)."""
+    groups = GROUPS if group is None else (group,)
+    for name in groups:
+        if name not in GROUPS:
+            raise ValueError(f"Unknown group {name}, expected one of {GROUPS}")
+    return [f"{field}_{name}" for name in groups for field in FIELDS]
+
+def resolve_data_path(data_path: str) -> str:
+    """
+    Path of the stored data of an experiment, whatever its format.
+
+    The data_path of the experiment json written before the columnar format ends with `.pkl`, if this pickle has been
+    migrated the columnar folder next to it is used instead.
+    """
+    if data_path.endswith(".pkl"):
+        columnar_path = data_path[:-len(".pkl")]
+        if os.path.isfile(os.path.join(columnar_path, INDEX_FILE)):
+            return columnar_path
+    return data_path
+
+def save_simulation_data(data_path: str, data: Dict[str, np.ndarray]) -> str:
+    """
+    Save the arrays of an experiment in the columnar format.
+
+    The folder is written under a temporary name then renamed, a reader never sees a partial experiment.
+
+    Args:
+        data_path (str): the folder of the experiment (e.g. results_data/{UID}).
+        data (Dict[str, np.ndarray]): the arrays, keyed by their stored name (see array_names).
+
+    Returns:
+        str: the folder written.
+    """
+    missing = set(array_names()) - set(data)
+    if missing:
+        raise ValueError(f"Missing arrays in the simulation data: {sorted(missing)}")
+
+    temporary_path = f"{data_path}.{os.getpid()}.tmp"
+    shutil.rmtree(temporary_path, ignore_errors=True)
+    os.makedirs(temporary_path)
+
+    index = {"version": FORMAT_VERSION, "arrays": {}}
+
+    for group in GROUPS:
+        for name in array_names(group):
+            array = np.ascontiguousarray(data[name])
+            np.save(os.path.join(temporary_path, f"{name}.npy"), array, allow_pickle=False)
+            index["arrays"][name] = {
+                "group": group,
+                "shape": list(array.shape),
+                "dtype": array.dtype.str,
+            }
+
+    with open(os.path.join(temporary_path, INDEX_FILE), "w") as f:
+        json.dump(index, f, indent=4)
+
+    if os.path.exists(data_path):
+        shutil.rmtree(data_path)
+    os.replace(temporary_path, data_path)
+
+    return data_path
+
+def load_simulation_data(data_path: str, group: str|None = None, mmap: bool = True) -> Dict[str, np.ndarray]:
+    """
+    Load the arrays of an experiment, from the columnar folder or from the legacy pickle.
+
+    Args:
+        data_path (str): the data_path of the experiment json (folder or .pkl).
+        group (str): "training" or "validation" to only load this slice (default None, every array).
+        mmap (bool): if true, the columnar arrays are opened memory mapped and read only (default true).
+            The arrays of a pickle are always fully loaded.
+
+    Returns:
+        Dict[str, np.ndarray]: the arrays keyed by their stored name (e.g. "simulation_qpos_training").
+    """
+    data_path = resolve_data_path(data_path)
+    names = array_names(group)
+
+    if os.path.isdir(data_path):
+        with open(os.path.join(data_path, INDEX_FILE), "r") as f:
+            index = json.load(f)
+
+        if index.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported simulation data version {index.get('version')} in {data_path}")
+
+        return {
+            name: np.load(os.path.join(data_path, f"{name}.npy"), mmap_mode="r" if mmap else None, allow_pickle=False)
+            for name in names
+        }
+
+    with open(data_path, "rb") as f:
+        data = pickle.load(f)
+
+    return {name: data[name] for name in names}
+
+class ArrayAppender:
+    """
+    A `.npy` file written by blocks of rows, only the block being appended is in memory.
+
+    The header is written with no row and rewritten in place with the final row count on close (numpy pads the header
+    so that the first dimension can grow without moving the data).
+
+    Args:
+        path (str): the `.npy` file.
+        row_shape (tuple): the shape of a row.
+        dtype: the dtype of the array (default float64).
+    """
+
+    def __init__(self, path: str, row_shape: tuple, dtype=np.float64):
+        self.row_shape = tuple(row_shape)
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        self.file = open(path, "wb")
+        self._write_header()
+        self.data_offset = self.file.tell()
+
+    def _write_header(self):
+        self.file.seek(0)
+        np.lib.format.write_array_header_1_0(self.file, {
+            "descr": np.lib.format.dtype_to_descr(self.dtype),
+            "fortran_order": False,
+            "shape": (self.rows,) + self.row_shape,
+        })
+
+    def append(self, rows: np.ndarray):
+        rows = np.ascontiguousarray(rows, dtype=self.dtype).reshape((-1,) + self.row_shape)
+        self.file.write(rows.tobytes())
+        self.rows += len(rows)
+
+    def close(self):
+        self._write_header()
+        if self.file.tell() != self.data_offset:
+            raise ValueError(f"The header of {self.file.name} changed size, the array is corrupted")
+        self.file.close()
+
+def spool_batches(spool_path: str, group: str, num_coordinates: int, batch_records: Iterable) -> List[float]:
+    """
+    Write the streamed batches of a trajectory group to the `.npy` files of a spool folder, batch by batch.
+
+    The arrays are the ones of concatenate_batches, under their stored name (see array_names), but only the batch
+    being written is in memory. They are read back with load_spooled_batches.
+
+    Args:
+        spool_path (str): the spool folder, created if needed.
+        group (str): "training" or "validation".
+        num_coordinates (int): Number of coordinates in the system.
+        batch_records: iterable of BatchRecord (time, qpos, qvel, qacc, forces, start_time), in batch order.
+
+    Returns:
+        List[float]: the starting time of each batch.
+    """
+    os.makedirs(spool_path, exist_ok=True)
+
+    appenders = {
+        name: ArrayAppender(os.path.join(spool_path, f"{name}.npy"), (1,) if field == "simulation_time" else (num_coordinates,))
+        for field, name in zip(FIELDS, array_names(group))
+    }
+    batch_starting_times = []
+
+    try:
+        for record in batch_records:
+            for appender, array in zip(appenders.values(), record[:len(FIELDS)]):
+                appender.append(array)
+            batch_starting_times.append(record[len(FIELDS)])
+    finally:
+        for appender in appenders.values():
+            appender.close()
+
+    return batch_starting_times
+
+def load_spooled_batches(spool_path: str, group: str|None = None) -> Dict[str, np.ndarray]:
+    """
+    Open the arrays written by spool_batches, memory mapped and read only.
+
+    Args:
+        spool_path (str): the spool folder.
+        group (str): "training" or "validation" to only open this group (default None, every group).
+
+    Returns:
+        Dict[str, np.ndarray]: the arrays keyed by their stored name (e.g. "simulation_qpos_training").
+    """
+    return {
+        name: np.load(os.path.join(spool_path, f"{name}.npy"), mmap_mode="r", allow_pickle=False)
+        for name in array_names(group)
+    }
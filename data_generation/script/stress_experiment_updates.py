@@ -0,0 +1,138 @@
+"""
+Stress test of the concurrent updates of an experiment json (see experiment_io.py).
+
+`writers` processes save regressions in the same experiment like parallel align_data runs : each update writes a
+trajectory record (save_trajectory) and adds a reference solution (update_experiment, the read-modify-write of the
+experiment json). Meanwhile another process compacts the experiment and checks that no load ever misses a trajectory
+already written. At the end every trajectory and every solution must be in the experiment, the script fails otherwise.
+
+exemple:
+python -m data_generation.script.stress_experiment_updates --writers 8 --updates 25
+"""
+
+from dataclasses import dataclass
+import tyro
+
+import multiprocessing
+import os
+import tempfile
+import time
+
+from data_generation.script.dataclass import DataGenerationParams,Experiment,RegressionParameter
+from data_generation.script.dataclass import RegressionResult,Solution,TrajectoryData
+from data_generation.script.experiment_io import compact_experiment,load_experiment,save_experiment
+from data_generation.script.experiment_io import save_trajectory,update_experiment
+
+@dataclass
+class Args:
+    writers: int = 8
+    """the number of processes updating the experiment at the same time (default 8)"""
+    updates: int = 25
+    """the number of updates of each writer (default 25)"""
+    compact: bool = True
+    """if true, compact the experiment while the writers run (default true)"""
+
+def empty_experiment(json_path: str) -> None:
+    """Write an experiment with only the reference trajectories."""
+    params = DataGenerationParams()
+
+    experiment = Experiment(
+        generation_params=params,
+        data_path=f"results_data/{params.UID}",
+        data=Experiment.ExperimentData(
+            validation_group=Experiment.ExperimentData.TrajectoryGroup(
+                batch_starting_time=[0.0],
+                trajectories=[TrajectoryData(name="validation_data", solutions=[], reference=True)],
+            ),
+            training_group=Experiment.ExperimentData.TrajectoryGroup(
+                batch_starting_time=[0.0],
+                trajectories=[TrajectoryData(name="training_data", solutions=[], reference=True)],
+            ),
+        ),
+    )
+    save_experiment(experiment, json_path)
+
+def writer(json_path: str, writer_index: int, updates: int) -> None:
+    """Save `updates` regressions and reference solutions, named after the writer."""
+    for update_index in range(updates):
+        name = f"writer{writer_index}_{update_index}"
+
+        def add_solution(experiment: Experiment) -> bool:
+            experiment.data.validation_group.get_trajectory_by_name("validation_data").solutions.append(
+                Solution(mode_solution=name, solution_vector=[float(update_index)], solution_label=[name])
+            )
+            return True
+
+        update_experiment(json_path, add_solution)
+        save_trajectory(
+            json_path,
+            TrajectoryData(name=name, regression_result=RegressionResult(regression_parameters=RegressionParameter())),
+        )
+
+def compactor(json_path: str, compact: bool, stop, errors) -> None:
+    """Compact the experiment until `stop` is set, record in `errors` a load missing a trajectory seen before."""
+    seen = set()
+    while not stop.is_set():
+        if compact:
+            compact_experiment(json_path)
+
+        names = set(load_experiment(json_path, series="headers").data.validation_group.get_trajectory_name())
+        if not seen <= names:
+            errors.put(f"{len(seen - names)} trajectories missing from a load : {sorted(seen - names)[:5]}")
+        seen = names
+
+        time.sleep(0.01)
+
+if __name__ == "__main__":
+
+    args = tyro.cli(Args)
+
+    with tempfile.TemporaryDirectory() as workdir:
+
+        json_path = os.path.join(workdir, "experiment.json")
+        empty_experiment(json_path)
+
+        stop = multiprocessing.Event()
+        errors = multiprocessing.Queue()
+
+        start_time = time.perf_counter()
+
+        watcher = multiprocessing.Process(target=compactor, args=(json_path, args.compact, stop, errors))
+        watcher.start()
+
+        processes = [
+            multiprocessing.Process(target=writer, args=(json_path, writer_index, args.updates))
+            for writer_index in range(args.writers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        stop.set()
+        watcher.join()
+
+        elapsed = time.perf_counter() - start_time
+
+        experiment = load_experiment(json_path)
+        expected = {f"writer{w}_{u}" for w in range(args.writers) for u in range(args.updates)}
+
+        trajectories = set(experiment.data.validation_group.get_trajectory_name())
+        solutions = set(experiment.data.validation_group.get_trajectory_by_name("validation_data").get_solution_mode())
+
+        failures = []
+        if any(process.exitcode != 0 for process in processes + [watcher]):
+            failures.append("a process failed")
+        while not errors.empty():
+            failures.append(errors.get())
+        if expected - trajectories:
+            failures.append(f"{len(expected - trajectories)} trajectories lost")
+        if expected - solutions:
+            failures.append(f"{len(expected - solutions)} solutions lost")
+
+        print(f"{args.writers} writers x {args.updates} updates in {elapsed:.2f} s")
+
+        if failures:
+            raise SystemExit("FAILED : " + ", ".join(failures))
+
+        print(f"ok : {len(expected)} trajectories and {len(expected)} solutions, nothing lost")
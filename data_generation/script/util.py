@@ -1,5 +1,7 @@
 
+import importlib.util
 import logging 
+import os
 import numpy as np
 
 from typing import List, Dict
@@ -7,6 +9,52 @@ from typing import List, Dict
 
 logger = logging.getLogger(__name__)
 
+class TqdmLoggingHandler(logging.Handler):
+    """Same handler as xlsindy.logger, tqdm is only imported on the first record."""
+    def emit(self, record):
+        try:
+            from tqdm import tqdm
+            msg = self.format(record)
+            tqdm.write(msg)
+            self.flush()
+        except Exception:
+            self.handleError(record)
+
+def setup_logger(name=None, level=logging.INFO):
+    """
+    Same logger as xlsindy.logger.setup_logger.
+
+    Importing xlsindy.logger import the whole xlsindy package (several seconds), the CLIs use this one to start fast.
+    """
+    logger = logging.getLogger(name)
+    if not logger.hasHandlers():
+        logger.setLevel(level)
+        handler = TqdmLoggingHandler()
+        handler.setFormatter(
+            logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+        )
+        logger.addHandler(handler)
+    return logger
+
+# xlsindy_gen modules already imported, keyed by folder
+_xlsindy_gen_modules = {}
+
+def import_xlsindy_gen(folder_path: str):
+    """
+    Import the xlsindy_gen.py script of an experiment folder, once per folder.
+
+    The script is loaded from its path instead of `import xlsindy_gen` so that several systems can be used in the same process.
+    """
+    folder_path = os.path.abspath(folder_path)
+
+    if folder_path not in _xlsindy_gen_modules:
+        spec = importlib.util.spec_from_file_location("xlsindy_gen", os.path.join(folder_path, "xlsindy_gen.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _xlsindy_gen_modules[folder_path] = module
+
+    return _xlsindy_gen_modules[folder_path]
+
 def convert_to_lists(d):
     if isinstance(d, dict):
         return {k: convert_to_lists(v) for k, v in d.items()}
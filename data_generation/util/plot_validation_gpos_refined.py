@@ -1,12 +1,18 @@
-from pydantic import BaseModel
+import os
+import sys
+
+from pydantic import BaseModel, ValidationError
+
+# the util scripts are run by path, the experiment dataclasses live in data_generation/script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 class GenerationSettings(BaseModel):
 
     batch_number:int
     damping_coefficients:list[float]
     experiment_folder:str
-    forces_period:float
-    forces_period_shift:float
+    forces_period:float|None = None
+    forces_period_shift:float|None = None
     forces_scale_vector:list[float]
     generation_type:str
     initial_condition_randomness:list[float]
@@ -71,13 +77,84 @@ class ExperimentFile(BaseModel):
 
     visualisation:Visualisation
 
-def load_experiment_file(file_path: str) -> ExperimentFile:
+def trajectory_layout(trajectory) -> dict:
+    """A TrajectoryData of the experiment dataclasses in the layout of ExperimentData."""
+    layout = {
+        "time": None,
+        "series": {},
+        "reference": trajectory.reference,
+        "solution": {
+            solution.mode_solution: {
+                "vector": [[value] for value in solution.solution_vector],
+                "label": solution.solution_label,
+            }
+            for solution in trajectory.solutions or []
+        },
+    }
+
+    series = trajectory.series
+    if series is not None:
+        layout["time"] = series.time.time.tolist()
+        layout["series"] = {
+            f"coor_{i}": {
+                name: getattr(series, name).series[i].data.tolist()
+                for name in ("qpos", "qvel", "qacc", "forces")
+            }
+            for i in range(len(series.qpos.series))
+        }
+
+    result = trajectory.regression_result
+    if result is not None:
+        parameters = result.regression_parameters
+        layout["extra_info"] = {
+            "noise_level": parameters.noise_level,
+            "optimization_function": parameters.optimization_function,
+            "random_seed": parameters.random_seed,
+            "regression_type": parameters.regression_type,
+            "valid": result.valid,
+            "regression_time": result.regression_time,
+            "timeout": result.timeout,
+            "results": {"RMSE_acceleration": result.RMSE_acceleration},
+        }
+
+    return layout
+
+def load_experiment_json(file_path: str) -> dict:
+    """
+    The json of an experiment in the layout of ExperimentFile.
+
+    The experiments of data_generation/script are loaded with experiment_io.load_experiment : the trajectory records
+    of align_data ({UID}.trajectories/) and the series of a binary sidecar are included. A json in the layout of
+    ExperimentFile is returned as is.
+    """
     import json
 
-    with open(file_path, 'r') as f:
-        data = json.load(f)
+    from data_generation.script.experiment_io import load_experiment
+
+    try:
+        experiment = load_experiment(file_path)
+    except ValidationError:
+        with open(file_path, 'r') as f:
+            return json.load(f)
+
+    def group_layout(group, batch_starting_times):
+        return {
+            "data": {trajectory.name: trajectory_layout(trajectory) for trajectory in group.trajectories},
+            "batch_starting_times": batch_starting_times,
+        }
+
+    return {
+        "generation_settings": experiment.generation_params.model_dump(),
+        "data_path": experiment.data_path,
+        "visualisation": {
+            "training_group": group_layout(experiment.data.training_group, experiment.data.training_group.batch_starting_time),
+            "validation_group": group_layout(experiment.data.validation_group, None),
+        },
+    }
+
+def load_experiment_file(file_path: str) -> ExperimentFile:
 
-    experiment_file = ExperimentFile(**data)
+    experiment_file = ExperimentFile(**load_experiment_json(file_path))
     return experiment_file
 
 if __name__ == "__main__":
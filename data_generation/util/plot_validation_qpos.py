@@ -7,11 +7,11 @@ Reads a JSON experiment file and generates a 2-row plot:
 - Row 2: Validation data trajectories
 """
 
-import json
 import sys
 import matplotlib.pyplot as plt
 import numpy as np
 from pathlib import Path
+from plot_validation_gpos_refined import load_experiment_json
 
 
 def plot_training_validation_qpos(json_data: dict, output_path: str, solution_types: list = None, noise_level: float = None, regression_types: list = None, plot_error: bool = False):
@@ -323,8 +323,7 @@ def main():
             suffix += f"_{'_'.join(regression_types)}"
         output_path = str(input_path.parent / f"{input_path.stem}_trajectories{suffix}.png")
     
-    with open(json_path, 'r') as f:
-        json_data = json.load(f)
+    json_data = load_experiment_json(json_path)
     
     # Generate plot
     plot_training_validation_qpos(json_data, output_path, solution_types, noise_level, regression_types, plot_error)
@@ -18,6 +18,7 @@ from typing import Dict, List, Any, Optional, Tuple
 import argparse
 import logging
 from tqdm import tqdm
+from plot_validation_gpos_refined import load_experiment_json
 
 
 def setup_logging(verbose: bool = False) -> None:
@@ -31,11 +32,10 @@ def setup_logging(verbose: bool = False) -> None:
 
 
 def load_json_file(file_path: str) -> Optional[Dict[str, Any]]:
-    """Load and parse a JSON file safely."""
+    """Load and parse an experiment file safely, with its trajectory records and sidecar series (see load_experiment_json)."""
     try:
-        with open(file_path, 'r') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, IOError) as e:
+        return load_experiment_json(file_path)
+    except (json.JSONDecodeError, IOError, ValueError) as e:
         logging.error(f"Failed to load {file_path}: {e}")
         return None
 
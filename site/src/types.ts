@@ -34,6 +34,8 @@ export interface RegressionResult {
   timeout: boolean;
   RMSE_acceleration: number | null;
   RMSE_validation_position: number | null;
+  validation_stop_reason?: string | null;
+  validation_end_time?: number | null;
 }
 
 export interface CoordinateSeries {
@@ -52,9 +52,26 @@ mkdir -p "$OUTPUT_DIR"
 # Get timestamp for file naming
 TIMESTAMP=$(date +%Y%m%d_%H%M%S)
 
+# Merge the trajectory records of align_data (results/{UID}.trajectories/) in the experiment json, the site reads the json alone
+if [ -d "$RESULTS_DIR" ]; then
+    echo -e "${YELLOW}🗜️  Compacting the align_data records...${NC}"
+    python -m data_generation.script.compact_results --results-dir "$RESULTS_DIR"
+fi
+
+# Put the series of the sidecar experiments ({UID}.series.bin) back inline, the site reads the inline json only
+if [ -d "$RESULTS_DIR" ]; then
+    echo -e "${YELLOW}🔁 Converting the sidecar series back to inline json...${NC}"
+    python -m data_generation.script.convert_results_series --results-dir "$RESULTS_DIR" --series-format json
+    sidecar_count=$(find "$RESULTS_DIR" -maxdepth 1 -name "*.series.bin" | wc -l)
+    if [ $sidecar_count -gt 0 ]; then
+        echo -e "${RED}❌ $sidecar_count experiments still have a binary series sidecar, their json has no series${NC}"
+        exit 1
+    fi
+fi
+
 # Package JSON results
 if [ -d "$RESULTS_DIR" ]; then
-    json_count=$(find "$RESULTS_DIR" -name "*.json" | wc -l)
+    json_count=$(find "$RESULTS_DIR" -maxdepth 1 -name "*.json" | wc -l)
     if [ $json_count -gt 0 ]; then
         echo -e "${YELLOW}📄 Packaging $json_count JSON files...${NC}"
         cd "$RESULTS_DIR"